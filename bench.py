@@ -0,0 +1,439 @@
+"""
+    Benchmark suite for the automata algorithms.
+
+    Every benchmark times one operation over a family of generated workloads
+    of growing size and the results are written as JSON, so two runs (e.g. of
+    two commits) can be compared with --compare:
+
+        python bench.py --output before.json
+        git checkout other-branch
+        python bench.py --output after.json --compare before.json
+"""
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import argparse
+import copy
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from tools.nfa import NFA
+from tools.parallel import parallel_determinize
+from tools.canonical import EquivalenceCache, canonical_form
+from tools.codegen import compile_matcher
+from tools.regex import ENGINES, regex_to_dfa
+from tools.thompson import Program
+from tools.sampling import WordSampler
+
+
+def random_nfa(
+        n_states: int, n_symbols: int=2, density: float=1.5,
+        final_ratio: float=0.3, seed: int=0) -> NFA:
+    """
+        Random NFA where each (state, symbol) pair goes, on average, to
+        `density` states
+    """
+    rng = random.Random(seed)
+    states = ["q" + str(i) for i in range(n_states)]
+    alphabet = [chr(ord('a') + i) for i in range(n_symbols)]
+    transitions = {}
+    for state in states:
+        for symbol in alphabet:
+            count = int(density) + (rng.random() < density % 1)
+            if count:
+                transitions[state, symbol] = \
+                    set(rng.sample(states, min(count, n_states)))
+    final_states = {
+        state for state in states if rng.random() < final_ratio}
+    return NFA(
+        set(states), set(alphabet), transitions, states[0], final_states)
+
+
+def random_dfa(
+        n_states: int, n_symbols: int=2, final_ratio: float=0.3,
+        seed: int=0) -> NFA:
+    """ Random complete DFA """
+    rng = random.Random(seed)
+    states = ["q" + str(i) for i in range(n_states)]
+    alphabet = [chr(ord('a') + i) for i in range(n_symbols)]
+    transitions = {
+        (state, symbol): {rng.choice(states)}
+        for state in states for symbol in alphabet}
+    final_states = {
+        state for state in states if rng.random() < final_ratio}
+    return NFA(
+        set(states), set(alphabet), transitions, states[0], final_states)
+
+
+def blowup_regex(n: int) -> str:
+    """ (a|b)*a(a|b){n}, its minimal DFA has 2^(n+1) states """
+    return "(a|b)*a" + "(a|b)" * n
+
+
+def blowup_nfa(n: int) -> NFA:
+    """ The n + 2 states NFA of (a|b)*a(a|b){n} """
+    states = {"q" + str(i) for i in range(n + 2)}
+    transitions = {
+        ("q0", "a"): {"q0", "q1"},
+        ("q0", "b"): {"q0"}
+    }
+    for i in range(1, n + 1):
+        for symbol in "ab":
+            transitions["q" + str(i), symbol] = {"q" + str(i + 1)}
+    return NFA(states, {"a", "b"}, transitions, "q0", {"q" + str(n + 1)})
+
+
+def concatenation_regex(n: int, seed: int=0) -> str:
+    """ Concatenation of n random symbols and optional groups """
+    rng = random.Random(seed)
+    parts = []
+    for _ in range(n):
+        symbol = rng.choice("abcd")
+        parts.append(symbol + rng.choice(["", "", "*", "?"]))
+    return "".join(parts)
+
+
+def alternation_regex(n: int, length: int=8, seed: int=0) -> str:
+    """ Alternation of n random words """
+    return "|".join(random_words(n, length, seed))
+
+
+def combined_nfa(n: int) -> NFA:
+    """
+        (A|B)*(A|B) for the DFAs of two alternations of n random words,
+        combined with epsilon transitions, so many states are redundant
+    """
+    nfa = regex_to_dfa(alternation_regex(n))
+    nfa.union(regex_to_dfa(alternation_regex(n, seed=1)))
+    other = copy.deepcopy(nfa)
+    nfa.star()
+    nfa.concatenation(other)
+    return nfa
+
+
+def random_words(n: int, length: int=8, seed: int=0) -> List[str]:
+    rng = random.Random(seed)
+    return [
+        "".join(rng.choice("abcd") for _ in range(rng.randint(1, length)))
+        for _ in range(n)]
+
+
+def random_string(length: int, alphabet: str="ab", seed: int=0) -> str:
+    rng = random.Random(seed)
+    return "".join(rng.choice(alphabet) for _ in range(length))
+
+
+class Benchmark():
+    """
+        A timed operation over a workload family. `setup(size)` builds the
+        input (not timed) and `run(input)` is the timed call. Inputs are
+        deep copied before each repetition, since most operations work in
+        place. When the timed call returns an automaton, its number of
+        states is reported too.
+    """
+
+    def __init__(
+            self, name: str, workload: str, sizes: List[int],
+            setup: Callable[[int], Any], run: Callable[[Any], Any]) -> None:
+        self.name = name
+        self.workload = workload
+        self.sizes = sizes
+        self.setup = setup
+        self.run = run
+
+    def measure(self, size: int, repeat: int) \
+            -> Tuple[List[float], Optional[int]]:
+        data = self.setup(size)
+        times = []
+        states = None
+        for _ in range(repeat):
+            data_copy = copy.deepcopy(data)
+            begin = time.perf_counter()
+            result = self.run(data_copy)
+            times.append(time.perf_counter() - begin)
+            if isinstance(result, NFA):
+                states = len(result.states)
+        return times, states
+
+
+def _pair(generator: Callable[..., NFA]) -> Callable[[int], Tuple[NFA, NFA]]:
+    return lambda n: (generator(n, seed=1), generator(n, seed=2))
+
+
+def _several(
+        generator: Callable[..., NFA]) -> Callable[[int], List[NFA]]:
+    """ 4 automata of different languages """
+    return lambda n: [generator(n, seed=seed) for seed in range(1, 5)]
+
+
+def _intersect_chained(automata: List[NFA]) -> NFA:
+    nfa = copy.deepcopy(automata[0])
+    for automaton in automata[1:]:
+        nfa.intersection(automaton)
+    return nfa
+
+
+def _reduce_determinize(nfa: NFA) -> NFA:
+    nfa.reduce()
+    nfa.determinize()
+    return nfa
+
+
+def _determinize_minimize(nfa: NFA) -> NFA:
+    nfa.determinize()
+    nfa.minimize()
+    return nfa
+
+
+def _minimize_brzozowski(nfa: NFA) -> NFA:
+    nfa.minimize(engine="brzozowski")
+    return nfa
+
+
+def _corpus(generator: Callable[..., NFA]) -> Callable[[int], List[NFA]]:
+    """ 20 automata, 4 of each language """
+    return lambda n: [generator(n, seed=seed % 5) for seed in range(20)]
+
+
+def _dedupe_pairwise(automata: List[NFA]) -> int:
+    """ Number of distinct languages, comparing with the previous ones """
+    distinct = []  # type: List[NFA]
+    for automaton in automata:
+        if not any(automaton.is_equal(other) for other in distinct):
+            distinct.append(automaton)
+    return len(distinct)
+
+
+def _dedupe_fingerprint(automata: List[NFA]) -> int:
+    """ Number of distinct languages, one fingerprint per automaton """
+    cache = EquivalenceCache()
+    return len({cache.add(automaton) for automaton in automata})
+
+
+def _determinized(generator: Callable[..., NFA]) -> Callable[[int], NFA]:
+    def setup(n: int) -> NFA:
+        nfa = generator(n)
+        nfa.determinize()
+        return nfa
+    return setup
+
+
+def _compile(engine: str, minimize: bool) -> Callable[[str], NFA]:
+    def run(regex: str) -> NFA:
+        dfa = regex_to_dfa(regex, engine=engine)
+        if minimize:
+            dfa.minimize()
+        return dfa
+    return run
+
+
+def _regex_benchmarks() -> Iterator[Benchmark]:
+    """
+        Compilation with each engine, alone and followed by a minimization,
+        to see which engine gives the minimal DFA faster
+    """
+    workloads = [
+        ("blowup", [2, 4, 6, 8], blowup_regex),
+        ("concatenation", [10, 50, 100, 200], concatenation_regex),
+        ("alternation", [10, 50, 100, 200], alternation_regex)
+    ]
+    for engine in sorted(ENGINES):
+        for minimize, name in ((False, "regex_to_dfa"),
+                               (True, "regex_to_min_dfa")):
+            for workload, sizes, generator in workloads:
+                yield Benchmark(
+                    name + "[" + engine + "]", workload, sizes, generator,
+                    _compile(engine, minimize))
+
+
+def benchmarks() -> List[Benchmark]:
+    """ The benchmark suite """
+    return list(_regex_benchmarks()) + [
+        Benchmark(
+            "determinize", "random", [4, 8, 12, 16],
+            random_nfa, NFA.determinize),
+        Benchmark(
+            "determinize", "blowup", [2, 4, 6, 8, 10, 12],
+            blowup_nfa, NFA.determinize),
+        Benchmark(
+            "determinize", "combined", [25, 50, 100, 200],
+            combined_nfa, NFA.determinize),
+        Benchmark(
+            "determinize[reduced]", "random", [4, 8, 12, 16],
+            random_nfa, _reduce_determinize),
+        Benchmark(
+            "determinize[reduced]", "combined", [25, 50, 100, 200],
+            combined_nfa, _reduce_determinize),
+        Benchmark(
+            "determinize[parallel]", "blowup", [8, 10, 12],
+            blowup_nfa, lambda nfa: parallel_determinize(nfa, 4)),
+        Benchmark(
+            "minimize", "random", [10, 20, 40, 80],
+            random_dfa, NFA.minimize),
+        Benchmark(
+            "minimize", "blowup", [2, 3, 4, 5],
+            _determinized(blowup_nfa), NFA.minimize),
+        Benchmark(
+            "minimize[brzozowski]", "random", [5, 10, 15, 20],
+            random_dfa, _minimize_brzozowski),
+        Benchmark(
+            "nfa_to_min_dfa[table]", "random", [4, 8, 12, 16],
+            random_nfa, _determinize_minimize),
+        Benchmark(
+            "nfa_to_min_dfa[table]", "combined", [25, 50, 100, 200],
+            combined_nfa, _determinize_minimize),
+        Benchmark(
+            "nfa_to_min_dfa[brzozowski]", "random", [4, 8, 12, 16],
+            random_nfa, _minimize_brzozowski),
+        Benchmark(
+            "nfa_to_min_dfa[brzozowski]", "combined", [25, 50, 100, 200],
+            combined_nfa, _minimize_brzozowski),
+        Benchmark(
+            "beautify_qn", "blowup", [4, 6, 8, 10],
+            _determinized(blowup_nfa), NFA.beautify_qn),
+        Benchmark(
+            "union", "random", [5, 10, 20, 40],
+            _pair(random_dfa), lambda pair: pair[0].union(pair[1])),
+        Benchmark(
+            "intersection", "random", [5, 10, 20, 40],
+            _pair(random_dfa), lambda pair: pair[0].intersection(pair[1])),
+        Benchmark(
+            "intersect_all[chained]", "random", [5, 10, 20],
+            _several(random_dfa), _intersect_chained),
+        Benchmark(
+            "intersect_all", "random", [5, 10, 20],
+            _several(random_dfa), NFA.intersect_all),
+        Benchmark(
+            "contains", "random", [5, 10, 20, 40],
+            _pair(random_dfa), lambda pair: pair[0].contains(pair[1])),
+        Benchmark(
+            "is_equal", "random", [5, 10, 20, 40],
+            _pair(random_dfa), lambda pair: pair[0].is_equal(pair[1])),
+        Benchmark(
+            "from_words[sorted]", "random", [1000, 10000, 100000],
+            lambda n: sorted(random_words(n)),
+            lambda words: NFA.from_words(words, is_sorted=True)),
+        Benchmark(
+            "from_words[unsorted]", "random", [1000, 10000, 100000],
+            random_words, NFA.from_words),
+        Benchmark(
+            "canonical_form", "blowup", [4, 6, 8, 10],
+            blowup_nfa, canonical_form),
+        Benchmark(
+            "dedupe[is_equal]", "random", [4, 6, 8, 10],
+            _corpus(random_nfa), _dedupe_pairwise),
+        Benchmark(
+            "dedupe[fingerprint]", "random", [4, 6, 8, 10],
+            _corpus(random_nfa), _dedupe_fingerprint),
+        Benchmark(
+            "is_finite", "alternation", [10, 50, 100, 200],
+            lambda n: regex_to_dfa(alternation_regex(n)), NFA.is_finite),
+        Benchmark(
+            "is_finite", "random", [10, 50, 100, 200],
+            random_nfa, NFA.is_finite),
+        Benchmark(
+            "accept", "dfa", [1000, 10000, 100000],
+            lambda n: (random_dfa(50), random_string(n)),
+            lambda data: data[0].accept(data[1])),
+        Benchmark(
+            "accept[codegen]", "dfa", [1000, 10000, 100000],
+            lambda n: (compile_matcher(random_dfa(50)), random_string(n)),
+            lambda data: data[0](data[1])),
+        Benchmark(
+            "accept", "blowup_nfa", [1000, 10000, 100000],
+            lambda n: (blowup_nfa(10), random_string(n)),
+            lambda data: data[0].accept(data[1])),
+        Benchmark(
+            "thompson_accept", "blowup", [1000, 10000, 100000],
+            lambda n: (Program(blowup_regex(20)), random_string(n)),
+            lambda data: data[0].accept(data[1])),
+        Benchmark(
+            "sample", "blowup", [1000, 10000, 100000],
+            lambda n: (WordSampler(regex_to_dfa(blowup_regex(4)), 50), n),
+            lambda data: list(data[0].samples(data[1], 50))),
+    ]
+
+
+def run_benchmarks(
+        selected: Optional[List[str]], repeat: int, quick: bool) \
+        -> Iterator[Dict[str, Any]]:
+    for benchmark in benchmarks():
+        # "regex_to_dfa" selects every engine, "regex_to_dfa[simone]" one
+        names = {benchmark.name, benchmark.name.split("[")[0]}
+        if selected and not any(
+                name in selected or name + "/" + benchmark.workload in selected
+                for name in names):
+            continue
+        sizes = benchmark.sizes[:2] if quick else benchmark.sizes
+        for size in sizes:
+            times, states = benchmark.measure(size, repeat)
+            yield {
+                "benchmark": benchmark.name,
+                "workload": benchmark.workload,
+                "size": size,
+                "times": times,
+                "best": min(times),
+                "median": statistics.median(times),
+                "states": states
+            }
+
+
+def _key(result: Dict[str, Any]) -> Tuple[str, str, int]:
+    return result["benchmark"], result["workload"], result["size"]
+
+
+def _commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument(
+        "benchmarks", nargs="*",
+        help="benchmarks to run, as name or name/workload (default: all)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--quick", action="store_true", help="only the two smallest sizes")
+    parser.add_argument("--output", help="write the results to a JSON file")
+    parser.add_argument(
+        "--compare", help="JSON results of a previous run to compare with")
+    args = parser.parse_args(argv)
+
+    baseline = {}  # type: Dict[Tuple[str, str, int], Dict[str, Any]]
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = {
+                _key(result): result
+                for result in json.load(baseline_file)["results"]}
+
+    results = []
+    for result in run_benchmarks(args.benchmarks, args.repeat, args.quick):
+        results.append(result)
+        line = "{:<30} {:<14} {:>8} {:>12.6f}s {:>8}".format(
+            result["benchmark"], result["workload"], result["size"],
+            result["best"],
+            result["states"] if result["states"] is not None else "")
+        if _key(result) in baseline:
+            line += "  x{:.2f}".format(
+                baseline[_key(result)]["best"] / result["best"])
+        print(line, flush=True)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({
+                "commit": _commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "results": results
+            }, output_file, indent=4)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
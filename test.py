@@ -1,8 +1,31 @@
 import unittest
+import asyncio
+import tempfile
+import json
+import io
+import os
+import random
+import itertools
+import copy
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from typing import Set
 from tools.nfa import NFA
-from tools.grammar import RegularGrammar
-from tools.regex import regex_to_dfa
+from tools.canonical import (
+    EquivalenceCache, canonical_dfa, canonical_form, fingerprint)
+from tools.grammar import IndexedGrammar, RegularGrammar
+from tools.regex import ENGINES, RegExpParser, regex_to_dfa, regex_to_term
+from tools.derivatives import Terms
+from tools.thompson import Program
+from tools.parallel import parallel_determinize
+from tools.sampling import WordSampler
+from tools.stream import JSONStreamReader
+from tools.stats import Stats
+from tools.budget import Budget, BudgetExceeded, CancelToken
+from tools.analysis import LanguageAnalysis
+from tools.codegen import (
+    compile_matcher, export_matcher, matcher_source, regex_matcher)
+from tools.service import AutomatonService
 
 
 class TestNFA(unittest.TestCase):
@@ -24,6 +47,28 @@ class TestNFA(unittest.TestCase):
         false_cases = {"", "aabb", "bbaa", "ababababaababababb"}
         self.nfa_test(nfa, true_cases, false_cases)
 
+    def test_codegen(self) -> None:
+        nfa = NFA.load("examples/endsWbb.json")
+        match = compile_matcher(nfa)
+        for length in range(7):
+            for word in itertools.product("abc", repeat=length):
+                string = "".join(word)
+                self.assertEqual(match(string), nfa.accept(string))
+        # cached by language
+        self.assertIs(compile_matcher(regex_to_dfa("(a|b)*bb")), match)
+        self.assertIs(regex_matcher("(a|b)*bb"), match)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "div3.py")
+            export_matcher(NFA.load("examples/div3.json"), path, "div3")
+            namespace = {}  # type: dict
+            with open(path) as module_file:
+                exec(module_file.read(), namespace)
+        self.assertTrue(namespace["div3"]("110"))
+        self.assertFalse(namespace["div3"]("111"))
+        with self.assertRaises(ValueError):
+            matcher_source(nfa, "not a name")
+
     def test_minimization(self) -> None:
         nfa = NFA.load("examples/bdiv3.json")
         nfa.minimize()
@@ -57,6 +102,25 @@ class TestNFA(unittest.TestCase):
         with self.assertRaises(RuntimeError):
             nfa.merge_equivalent()
 
+    def test_brzozowski_minimization(self) -> None:
+        for name in ("endsWbb", "bad_case", "div5", "one1"):
+            nfa = NFA.load("examples/" + name + ".json")
+            dfa = copy.deepcopy(nfa)
+            dfa.minimize(engine="brzozowski")
+            self.assertTrue(dfa.is_deterministic())
+            self.assertTrue(dfa.is_equal(nfa))
+            if not nfa.is_deterministic():
+                nfa.determinize()
+            nfa.minimize()
+            self.assertEqual(len(dfa.states), len(nfa.states))
+
+        nfa = NFA.load("examples/endsWbb.json")
+        nfa.reverse()
+        self.assertTrue(nfa.accept("bba"))
+        self.assertFalse(nfa.accept("abb"))
+        with self.assertRaises(ValueError):
+            nfa.minimize(engine="moore")
+
     def test_emptiness(self) -> None:
         nfa = NFA.load("examples/one1.json")
         self.assertFalse(nfa.is_empty())
@@ -81,6 +145,33 @@ class TestNFA(unittest.TestCase):
         self.assertFalse(nfa.is_empty())
         self.assertTrue(nfa.is_finite())
 
+    def test_incremental_analysis(self) -> None:
+        nfa = NFA.load("examples/aa.json")
+        analysis = LanguageAnalysis(nfa)
+        self.assertFalse(analysis.is_empty())
+        self.assertTrue(analysis.is_finite())
+
+        rng = random.Random(0)
+        states = ["q" + str(i) for i in range(8)]
+        nfa = NFA({"q0", "q1"}, {"a", "b"}, {}, "q0", set())
+        analysis = LanguageAnalysis(nfa)
+        for _ in range(500):
+            operation = rng.randrange(5)
+            state = rng.choice(sorted(nfa.states))
+            if operation < 2:
+                next_states = set(rng.sample(nfa.states, min(
+                    len(nfa.states), rng.randrange(3))))
+                analysis.set_transition(state, rng.choice("ab"), next_states)
+            elif operation == 2:
+                analysis.toggle_final_state(state)
+            elif operation == 3:
+                analysis.add_state(rng.choice(states))
+            else:
+                analysis.remove_state(state)
+
+            self.assertEqual(analysis.is_empty(), nfa.is_empty())
+            self.assertEqual(analysis.is_finite(), nfa.is_finite())
+
     def test_determinization(self) -> None:
         nfa = NFA.load("examples/endsWbb.json")
         self.assertFalse(nfa.is_deterministic())
@@ -101,12 +192,131 @@ class TestNFA(unittest.TestCase):
         self.assertTrue(nfa.is_deterministic())
         self.nfa_test(nfa, true_cases, false_cases)
 
+    def test_parallel_determinization(self) -> None:
+        for name in ("endsWbb", "bad_case"):
+            nfa = NFA.load("examples/" + name + ".json")
+            dfa = copy.deepcopy(nfa)
+            dfa.determinize()
+            for workers in (1, 3):
+                parallel = parallel_determinize(nfa, workers)
+                self.assertTrue(parallel.is_deterministic())
+                self.assertEqual(sorted(parallel.states), sorted(dfa.states))
+                self.assertTrue(parallel.is_equal(nfa))
+        with self.assertRaises(BudgetExceeded):
+            parallel_determinize(nfa, 2, budget=Budget(max_states=1))
+
+    def test_reduce(self) -> None:
+        # a|b, with a copy of each path
+        nfa = NFA({"S", "A", "B", "C", "D"}, {"a", "b"}, {
+            ("S", "a"): {"A", "B"}, ("S", "b"): {"C", "D"},
+            ("A", "a"): {"A"}, ("B", "a"): {"B"}
+        }, "S", {"A", "B", "C", "D"})
+        reduced = copy.deepcopy(nfa)
+        stats = Stats()
+        reduced.reduce(backward=False, stats=stats)
+        # forward: A and B are the same, C and D too
+        self.assertEqual(len(reduced.states), 3)
+        self.assertEqual(len(reduced.transition("S", "a")), 1)
+        self.assertEqual(stats.counters["states_merged"], 2)
+        reduced.reduce()
+        # backward: A and C are reached by different symbols
+        self.assertEqual(len(reduced.states), 3)
+        self.assertTrue(reduced.is_equal(nfa))
+
+        # ab|ac, A and B are only reached by the same strings (backward)
+        nfa = NFA({"S", "A", "B", "C", "D"}, {"a", "b", "c"}, {
+            ("S", "a"): {"A", "B"}, ("A", "b"): {"C"}, ("B", "c"): {"D"}
+        }, "S", {"C", "D"})
+        reduced = copy.deepcopy(nfa)
+        reduced.reduce(backward=False)
+        self.assertEqual(len(reduced.states), 4)
+        reduced.reduce()
+        self.assertEqual(len(reduced.states), 3)
+        self.assertTrue(reduced.is_deterministic())
+        self.assertTrue(reduced.is_equal(nfa))
+
+        nfa = NFA.load("examples/bad_case.json")
+        reduced = copy.deepcopy(nfa)
+        reduced.reduce()
+        self.assertTrue(reduced.is_equal(nfa))
+
+        # no state is built, but a cancel stops the reduction
+        token = CancelToken()
+        token.cancel()
+        with self.assertRaises(BudgetExceeded):
+            copy.deepcopy(nfa).reduce(budget=Budget(cancel=token))
+        with self.assertRaises(BudgetExceeded):
+            canonical_form(nfa, budget=Budget(cancel=token))
+        copy.deepcopy(nfa).reduce(budget=Budget(max_states=1))
+
     def test_dead_removal(self) -> None:
         nfa = NFA.load("examples/one1.json")
         self.assertEqual(nfa.states, ['A', 'B', 'C', 'D', 'E', 'F'])
         nfa.remove_dead()
         self.assertEqual(nfa.states, ['A', 'B', 'C', 'D', 'E'])
 
+    def test_state_names(self) -> None:
+        nfa = NFA({"q0", "q1", "q0q1"}, {"a"}, {
+            ("q0", "a"): {"q0", "q1"},
+            ("q1", "a"): {"q0q1"}
+        }, "q0", {"q0q1"})
+        nfa.determinize()
+        # subsets are named after their states once the unreachable ones
+        # (here q1 and q0q1) are gone, so there is no clash to prime
+        self.assertTrue(nfa.has_state("q0q1"))
+        self.assertEqual(nfa.transition("q0", "a"), {"q0q1"})
+        self.assertEqual(nfa.transition("q0q1", "a"), {"q0q0q1q1"})
+        self.assertTrue(nfa.is_final("q0q0q1q1"))
+
+        # numbered in the order of the actual names, q0q0q1q1 < q0q1
+        nfa.beautify_qn(1)
+        self.assertEqual(nfa.states, ['q1', 'q2', 'q3'])
+        self.assertEqual(nfa.transition_table, {
+            ("q1", "a"): {"q3"}, ("q3", "a"): {"q2"}, ("q2", "a"): {"q2"}})
+        self.assertEqual(nfa.final_states, {"q2"})
+        nfa.add_state("q2")
+        self.assertEqual(len(nfa.states), 3)
+        nfa.beautify_abc()
+        self.assertEqual(nfa.states, ['S', 'A', 'B'])
+        self.assertTrue(nfa.accept("aaa"))
+        self.assertFalse(nfa.accept("a"))
+
+    def test_word_counting(self) -> None:
+        nfa = NFA.load("examples/div3.json")
+        words = [
+            word for length in range(7) for word in map("".join,
+                itertools.product(nfa.alphabet, repeat=length))
+            if nfa.accept(word)]
+        self.assertEqual(nfa.count_words(6), len(words))
+        self.assertEqual(list(nfa.words(6)), words)
+        self.assertEqual(
+            list(itertools.islice(nfa.words(), len(words))), words)
+
+        finite = regex_to_dfa("ab|ba|a(b|&)a")
+        self.assertEqual(list(finite.words()), ["aa", "ab", "ba", "aba"])
+        self.assertEqual(finite.count_words(1), 0)
+        self.assertEqual(finite.count_words(100), 4)
+        # counted exactly, even when it does not fit in a machine word
+        self.assertEqual(regex_to_dfa("(a|b)*").count_words(100), 2**101 - 1)
+
+    def test_from_words(self) -> None:
+        rng = random.Random(0)
+        words = [
+            "".join(rng.choice("abc") for _ in range(rng.randrange(8)))
+            for _ in range(200)]
+        nfa = NFA.from_words(words)
+        self.assertEqual(set(nfa.words()), set(words))
+        minimal = regex_to_dfa("|".join(word or "&" for word in words))
+        minimal.minimize()
+        self.assertEqual(len(nfa.states), len(minimal.states))
+        self.assertEqual(
+            canonical_form(NFA.from_words(sorted(words), is_sorted=True)),
+            canonical_form(nfa))
+        with self.assertRaises(RuntimeError):
+            NFA.from_words(["b", "a"], is_sorted=True)
+        self.assertEqual(list(NFA.from_words([""]).words()), [""])
+        self.assertTrue(NFA.from_words([]).is_empty())
+
     def test_union(self) -> None:
         first_nfa = NFA.load("examples/aa.json")
         second_nfa = NFA.load("examples/endsWbb.json")
@@ -115,6 +325,36 @@ class TestNFA(unittest.TestCase):
         self.nfa_test(
             first_nfa, {"aa", "abb", "abbaabb"}, {"abbaab", "ab", "aaa"})
 
+    def test_epsilon(self) -> None:
+        first_nfa = regex_to_dfa("ab")
+        first_nfa.concatenation(regex_to_dfa("a*"))
+        self.assertTrue(first_nfa.has_epsilon())
+        self.assertFalse(first_nfa.is_deterministic())
+        self.nfa_test(first_nfa, {"ab", "abaa"}, {"", "a", "abb"})
+        first_nfa.star()
+        self.nfa_test(first_nfa, {"", "ab", "abaab"}, {"a", "aab"})
+        self.assertFalse(first_nfa.is_finite())
+
+        # the closures follow the changes of the epsilon transitions
+        self.assertEqual(
+            first_nfa.epsilon_closure("qinitial"), {"qinitial", "q0"})
+        first_nfa.set_transition("qinitial", "&", set())
+        self.assertEqual(first_nfa.epsilon_closure("qinitial"), {"qinitial"})
+        self.assertFalse(first_nfa.accept("ab"))
+
+        second_nfa = regex_to_dfa("ab|b")
+        second_nfa.union(regex_to_dfa("a"))
+        second_nfa.union(regex_to_dfa("&"))
+        self.assertTrue(second_nfa.is_finite())
+        self.assertEqual(list(second_nfa.words()), ["", "a", "b", "ab"])
+        file = io.StringIO()
+        second_nfa.dump(file)
+        self.assertTrue(NFA.read(io.StringIO(file.getvalue())).has_epsilon())
+
+        second_nfa.remove_epsilon()
+        self.assertFalse(second_nfa.has_epsilon())
+        self.nfa_test(second_nfa, {"", "a", "b", "ab"}, {"aa", "ba"})
+
     def test_complement(self) -> None:
         nfa = NFA.load("examples/endsWbb.json")
 
@@ -122,6 +362,20 @@ class TestNFA(unittest.TestCase):
         self.nfa_test(
             nfa, {"ab", "babbaab"}, {"abb", "aaabb"})
 
+        # a sparse automaton stays sparse
+        symbols = {str(i) for i in range(100)}
+        nfa = NFA({"q0", "q1"}, symbols, {("q0", "7"): {"q1"}}, "q0", {"q1"})
+        nfa.complement()
+        self.nfa_test(nfa, {"", "8", "77", "0123"}, {"7", "a"})
+        self.assertFalse(nfa.is_empty())
+        self.assertTrue(nfa.contains(regex_to_dfa("(1|2)*")))
+        self.assertFalse(nfa.contains(regex_to_dfa("7")))
+        nfa.intersection(regex_to_dfa("7*"))
+        self.nfa_test(nfa, {"", "77"}, {"7"})
+        nfa.complement()
+        nfa.complement()
+        self.assertEqual(set(nfa.states), {"q0", "q1", "q2"})
+
     def test_intersection(self) -> None:
         first_nfa = NFA.load("examples/aaORbb.json")
         second_nfa = NFA.load("examples/aa.json")
@@ -140,6 +394,25 @@ class TestNFA(unittest.TestCase):
         first_nfa.intersection(second_nfa)
         self.assertTrue(first_nfa.is_empty())
 
+    def test_n_ary(self) -> None:
+        automata = [
+            regex_to_dfa("(a|b)*a(a|b)*"), regex_to_dfa("(a|b)*b"),
+            regex_to_dfa("(a|b)(a|b)(a|b)(a|b)*")]
+        automata[2].complement()
+        stats = Stats()
+        nfa = NFA.intersect_all(automata, stats)
+        self.nfa_test(nfa, {"ab"}, {"", "b", "aab", "ba"})
+        self.assertEqual(len(nfa.states), 3)
+        self.assertIn("tuples_explored", stats.counters)
+        # the automata are left unchanged
+        self.nfa_test(automata[2], {"", "b", "ab"}, {"aba"})
+
+        nfa = NFA.union_all(automata[1:] + [NFA.load("examples/aa.json")])
+        self.nfa_test(nfa, {"", "a", "aa", "bab"}, {"aba", "bba"})
+        self.assertTrue(NFA.union_all([]).is_empty())
+        with self.assertRaises(ValueError):
+            NFA.intersect_all([])
+
     def test_containment(self) -> None:
         first_nfa = NFA.load("examples/aaORbb.json")
         second_nfa = NFA.load("examples/aa.json")
@@ -156,6 +429,233 @@ class TestNFA(unittest.TestCase):
         self.assertTrue(first_nfa.is_equal(first_nfa))
         self.assertTrue(second_nfa.is_equal(second_nfa))
 
+    def test_canonical_form(self) -> None:
+        same = ["(a|b)*", "(a*b*)*", "(b|a)*(a|&)"]
+        forms = [canonical_form(regex_to_dfa(regex)) for regex in same]
+        self.assertEqual(forms[0], forms[1])
+        self.assertEqual(forms[0], forms[2])
+        self.assertEqual(forms[0], (("a", "b"), ((("a", 0), ("b", 0)),), (0,)))
+
+        # the alphabet and the dead state do not matter
+        nfa = NFA.load("examples/aaORbb.json")
+        complement = copy.deepcopy(nfa)
+        complement.complement()
+        complement.complement()
+        complement.add_symbol("c")
+        self.assertEqual(
+            fingerprint(canonical_form(nfa)),
+            fingerprint(canonical_form(complement)))
+        dfa = canonical_dfa(nfa)
+        minimal = copy.deepcopy(nfa)
+        minimal.determinize()
+        minimal.minimize()
+        self.assertEqual(len(dfa.states), len(minimal.states))
+        self.assertTrue(dfa.is_equal(nfa))
+
+        cache = EquivalenceCache()
+        automata = [NFA.load("examples/" + name + ".json") for name in (
+            "aa", "aaORbb", "one1", "endsWbb", "bad_case")]
+        for first, second in itertools.product(automata, repeat=2):
+            self.assertEqual(
+                cache.is_equal(first, second), first.is_equal(second))
+            self.assertEqual(
+                cache.contains(first, second), first.contains(second))
+        self.assertEqual(len(cache), len(automata))
+        keys = [cache.add(automaton) for automaton in automata]
+        misses = cache.misses
+        self.assertTrue(cache.contains(keys[1], keys[0]))
+        self.assertFalse(cache.is_equal(keys[1], keys[0]))
+        self.assertEqual(cache.misses, misses)
+
+
+class TestSerialization(unittest.TestCase):
+    """ Tests the streaming JSON and JSONL readers and writers """
+
+    def test_save_format(self) -> None:
+        nfa = NFA.load("examples/endsWbb.json")
+        data = {
+            "states": sorted(nfa.states),
+            "alphabet": nfa.alphabet,
+            "transitions": [
+                [k[0], k[1], sorted(v)]
+                for k, v in nfa.transition_table.items()],
+            "initial_state": nfa.initial_state,
+            "final_states": sorted(nfa.final_states)
+        }
+        for indent in (4, None):
+            output = io.StringIO()
+            nfa.dump(output, indent)
+            self.assertEqual(
+                output.getvalue(), json.dumps(data, indent=indent))
+
+        output = io.StringIO()
+        NFA(initial_state="q0", states={"q0"}).dump(output, 4)
+        self.assertEqual(json.loads(output.getvalue())["transitions"], [])
+
+    def test_stream_reader(self) -> None:
+        with open("examples/bad_case.json") as automata_file:
+            expected = json.load(automata_file)
+        with open("examples/bad_case.json") as automata_file:
+            reader = JSONStreamReader(automata_file, chunk_size=7)
+            members = {}
+            for key, value in reader.members({"transitions"}):
+                members[key] = list(value) if key == "transitions" else value
+        self.assertEqual(members, expected)
+
+        reader = JSONStreamReader(io.StringIO('{"a": [1, 2'))
+        with self.assertRaises(json.JSONDecodeError):
+            for _, value in reader.members({"a"}):
+                list(value)
+
+    def test_load_save(self) -> None:
+        nfa = NFA.load("examples/div5.json")
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "div5.json")
+            nfa.save(path, indent=None)
+            loaded = NFA.load(path)
+            self.assertEqual(loaded.transition_table, nfa.transition_table)
+            self.assertEqual(loaded.final_states, nfa.final_states)
+            self.assertEqual(
+                len(list(NFA.iter_transitions(path))),
+                len(nfa.transition_table))
+
+    def test_jsonl(self) -> None:
+        names = ["aa", "bb", "div3", "endsWbb"]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "corpus.jsonl")
+            NFA.save_jsonl(
+                (NFA.load("examples/{}.json".format(name))
+                 for name in names), path)
+            with open(path) as corpus:
+                self.assertEqual(len(corpus.readlines()), len(names))
+            for name, nfa in zip(names, NFA.load_jsonl(path)):
+                original = NFA.load("examples/{}.json".format(name))
+                self.assertEqual(
+                    nfa.transition_table, original.transition_table)
+                self.assertEqual(nfa.initial_state, original.initial_state)
+
+
+class TestStats(unittest.TestCase):
+    """ Tests the instrumentation of the algorithms """
+
+    def test_determinize_stats(self) -> None:
+        events = []
+        stats = Stats(lambda event, _: events.append(event))
+        nfa = NFA.load("examples/bad_case.json")
+        nfa.determinize(stats)
+        self.assertEqual(
+            events, [
+                "determinize:start", "determinize:end",
+                "remove_unreachable:start", "remove_unreachable:end"])
+        self.assertGreater(stats.counters["states_created"], 0)
+        self.assertGreaterEqual(
+            stats.counters["subsets_explored"],
+            stats.counters["states_created"])
+        self.assertGreater(stats.counters["transitions_visited"], 0)
+        self.assertGreaterEqual(stats.peaks["states"], len(nfa.states))
+        self.assertIn("determinize", stats.phases)
+
+    def test_minimize_stats(self) -> None:
+        stats = Stats()
+        nfa = NFA.load("examples/div5.json")
+        nfa.determinize()
+        nfa.minimize(stats)
+        self.assertGreaterEqual(stats.counters["refinement_rounds"], 1)
+        self.assertEqual(
+            set(stats.phases), {
+                "minimize", "remove_unreachable", "remove_dead",
+                "merge_equivalent"})
+
+    def test_regex_stats(self) -> None:
+        stats = Stats()
+        nfa = regex_to_dfa("(a|b)*a(a|b)(a|b)", stats)
+        self.assertEqual(stats.counters["states_created"], len(nfa.states))
+        self.assertGreater(
+            stats.counters["up_cache_hits"] +
+            stats.counters["up_cache_misses"], 0)
+        self.assertEqual(
+            set(stats.phases), {"parse", "thread", "construction"})
+
+
+class TestBudget(unittest.TestCase):
+    """ Tests resource limits and cancellation """
+
+    def test_determinize_budget(self) -> None:
+        nfa = NFA.load("examples/bad_case.json")
+        states = set(nfa.states)
+        transitions = dict(nfa.transition_table)
+
+        with self.assertRaises(BudgetExceeded) as context:
+            nfa.determinize(budget=Budget(max_states=8))
+        self.assertGreater(context.exception.stats["states"], 8)
+        self.assertIn("subsets_explored", context.exception.stats)
+        self.assertEqual(set(nfa.states), states)
+        self.assertEqual(nfa.transition_table, transitions)
+
+        with self.assertRaises(BudgetExceeded):
+            nfa.determinize(budget=Budget(max_transitions=12))
+        self.assertEqual(set(nfa.states), states)
+
+        nfa.determinize(budget=Budget(max_states=100, timeout=60))
+        self.assertTrue(nfa.is_deterministic())
+
+    def test_cancel(self) -> None:
+        token = CancelToken()
+        token.cancel()
+        nfa = NFA.load("examples/bad_case.json")
+        with self.assertRaises(BudgetExceeded):
+            nfa.contains(NFA.load("examples/endsWbb.json"),
+                         budget=Budget(cancel=token))
+        with self.assertRaises(BudgetExceeded):
+            regex_to_dfa("(a|b)*", budget=Budget(cancel=token))
+        with self.assertRaises(BudgetExceeded):
+            regex_to_dfa("a", budget=Budget(timeout=-1))
+
+        nfa = NFA.load("examples/div5.json")
+        nfa.determinize()
+        states = set(nfa.states)
+        with self.assertRaises(BudgetExceeded):
+            nfa.merge_equivalent(budget=Budget(cancel=token))
+        self.assertEqual(set(nfa.states), states)
+
+        # the unreachable and dead states are not removed either
+        nfa = NFA.load("examples/one1.json")
+        states = nfa.states
+        transitions = nfa.transition_table
+        with self.assertRaises(BudgetExceeded):
+            nfa.minimize(budget=Budget(cancel=token))
+        self.assertEqual(nfa.states, states)
+        self.assertEqual(nfa.transition_table, transitions)
+        nfa.minimize(budget=Budget(timeout=60))
+        self.assertEqual(len(nfa.states), 2)
+
+    def test_cancel_minimize(self) -> None:
+        # as the editor does: the cancel arrives while the phases run, here
+        # once the unreachable and dead states are removed
+        token = CancelToken()
+
+        def report(event: str, _: Stats) -> None:
+            if event == "merge_equivalent:start":
+                token.cancel()
+
+        nfa = NFA.load("examples/one1.json")
+        states = nfa.states
+        transitions = nfa.transition_table
+        with self.assertRaises(BudgetExceeded):
+            nfa.minimize(Stats(report), Budget(cancel=token))
+        self.assertEqual(nfa.states, states)
+        self.assertEqual(nfa.transition_table, transitions)
+
+    def test_regex_budget(self) -> None:
+        regex = "(a|b)*a" + "(a|b)" * 8
+        with self.assertRaises(BudgetExceeded) as context:
+            regex_to_dfa(regex, budget=Budget(max_states=100))
+        self.assertGreater(context.exception.stats["states"], 100)
+        # caught as any other conversion error
+        with self.assertRaises(RuntimeError):
+            regex_to_dfa(regex, budget=Budget(max_transitions=100))
+        self.assertEqual(len(regex_to_dfa("(a|b)*a(a|b)").states), 4)
+
 
 class TestRG(unittest.TestCase):
     """ Tests NFA <-> regular grammar conversions """
@@ -213,6 +713,48 @@ class TestRG(unittest.TestCase):
         false_cases = {"aa", "cc", "bbb", "babcb"}
         test_nfa.nfa_test(nfa, true_cases, false_cases)
 
+    def test_indexed_grammar(self) -> None:
+        for example in ("div3", "endsWbb", "one1"):
+            nfa = NFA.load("examples/{}.json".format(example))
+            grammar = IndexedGrammar.from_nfa(nfa)
+            expected = RegularGrammar.from_nfa(nfa)
+            self.assertEqual(
+                grammar.initial_symbol, expected.initial_symbol())
+            self.assertEqual(
+                grammar.to_regular_grammar().productions(),
+                expected.productions())
+
+            parsed = IndexedGrammar.parse(grammar.lines())
+            self.assertEqual(list(parsed.lines()), list(grammar.lines()))
+            self.assertTrue(parsed.to_nfa().is_equal(nfa))
+
+        grammar = IndexedGrammar.parse([
+            "S -> aA | bB | c",
+            "",
+            "A -> aA | a",
+            "B -> bB | bC",
+            "C -> cB",
+            "D -> d"])
+        self.assertEqual(grammar.initial_symbol, "S")
+        self.assertFalse(grammar.is_empty())
+        grammar.remove_useless()
+        self.assertEqual(grammar.non_terminals, ["S", "A"])
+        self.assertEqual(list(grammar.lines()), ["S -> aA | c", "A -> a | aA"])
+        TestNFA().nfa_test(
+            grammar.to_nfa(), {"c", "aa", "aaaa"}, {"", "a", "bb", "d"})
+
+        grammar = IndexedGrammar.parse(["S -> aS | bA", "A -> bS"])
+        self.assertTrue(grammar.is_empty())
+        grammar.remove_useless()
+        self.assertEqual(grammar.non_terminals, ["S"])
+
+        grammar = IndexedGrammar.parse(["S' -> aS | &", "S -> aS | a"])
+        TestNFA().nfa_test(grammar.to_nfa(), {"", "aa", "aaa"}, {"a", "b"})
+
+        for text in (["S -> Ab"], ["S => a"], ["s -> a"], []):
+            with self.assertRaises(RuntimeError):
+                IndexedGrammar.parse(text)
+
 
 class TestRegex(unittest.TestCase):
     """ Tests the regular expression to DFA conversion """
@@ -222,9 +764,12 @@ class TestRegex(unittest.TestCase):
         def test_regex(
                 regex: str, true_cases: Set[str], false_cases: Set[str]) \
                 -> None:
-            automata = regex_to_dfa(regex)
-            self.assertTrue(automata.is_deterministic())
-            test_nfa.nfa_test(automata, true_cases, false_cases)
+            for engine in ENGINES:
+                automata = regex_to_dfa(regex, engine=engine)
+                self.assertTrue(automata.is_deterministic())
+                test_nfa.nfa_test(automata, true_cases, false_cases)
+            self.assertTrue(regex_to_dfa(regex, engine="derivatives")
+                            .is_equal(regex_to_dfa(regex)))
 
         def test_bad_regex(regex: str) -> None:
             with self.assertRaises(RuntimeError):
@@ -253,5 +798,202 @@ class TestRegex(unittest.TestCase):
         test_bad_regex("((((a|&")
         test_bad_regex("(a)))")
 
+    def test_syntax_tree(self) -> None:
+        tree = RegExpParser("ab|c*").parse()
+        # END, a, b, the concatenation, c, the star and the alternation
+        self.assertEqual(tree.symbols, ["$", "a", "b", ".", "c", "*", "|"])
+        self.assertEqual(tree.root, 6)
+        tree.thread()
+        # in order: a . b | c * END
+        self.assertEqual(list(tree.rights), [-1, 3, 6, 2, 5, 0, 5])
+        self.assertEqual(tree.down(tree.root), {1, 4, 0})
+        self.assertEqual(tree.up(tree.rights[1]), {2})
+        self.assertEqual(tree.up(tree.rights[4]), {4, 0})
+
+    def test_concurrent_compilation(self) -> None:
+        regexes = [
+            "(a|b)*a(a|b)(a|b)", "1?(01)*0?", "(a(ba)*a|ba)*(ab)*", "a|b|&"]
+        jobs = [(regex, engine) for regex in regexes for engine in ENGINES]
+        expected = [
+            regex_to_dfa(regex, engine=engine).transition_table
+            for regex, engine in jobs]
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)  # switch threads as often as possible
+        try:
+            with ThreadPoolExecutor(8) as pool:
+                results = list(pool.map(
+                    lambda job: regex_to_dfa(job[0], engine=job[1]),
+                    jobs * 8))
+        finally:
+            sys.setswitchinterval(interval)
+        self.assertEqual(
+            [dfa.transition_table for dfa in results], expected * 8)
+
+    def test_thompson(self) -> None:
+        rng = random.Random(0)
+        for regex in ["1?(01)*0?", "(a(ba)*a|ba)*(ab)*", "a|b|&", "(&)*a?"]:
+            program = Program(regex)
+            dfa = regex_to_dfa(regex)
+            for length in range(8):
+                string = "".join(
+                    rng.choice("01ab") for _ in range(length))
+                self.assertEqual(program.accept(string), dfa.accept(string))
+
+        # its DFA would have 2^31 states
+        program = Program("(a|b)*a" + "(a|b)" * 30)
+        self.assertEqual(len(program), 4 * 31 + 4)
+        self.assertTrue(program.accept("b" * 100 + "a" + "b" * 30))
+        self.assertFalse(program.accept("a" * 100 + "b" * 31))
+        with self.assertRaises(RuntimeError):
+            Program("(a|b")
+
+    def test_sampling(self) -> None:
+        dfa = regex_to_dfa("(a(ba)*a|ba)*(ab)*")
+        sampler = WordSampler(dfa, 10, random.Random(0))
+        self.assertEqual(sampler.count(), dfa.count_words(10))
+        words = set(dfa.words(6)) - set(dfa.words(5))
+        self.assertEqual(sampler.count(6), len(words))
+
+        samples = list(sampler.samples(2000, 6))
+        self.assertEqual(set(samples), words)
+        self.assertTrue(all(
+            len(word) <= 10 and dfa.accept(word)
+            for word in sampler.samples(100)))
+        with self.assertRaises(RuntimeError):
+            sampler.sample(5)  # all its strings have even length
+        with self.assertRaises(RuntimeError):
+            sampler.sample(11)
+
+    def test_derivatives(self) -> None:
+        terms = Terms()
+        even_a = regex_to_term("(b*ab*a)*b*", terms)
+        ends_b = regex_to_term("(a|b)*b", terms)
+        self.assertIs(ends_b, regex_to_term("(a|b)*b", terms))
+
+        test_nfa = TestNFA()
+        both = terms.to_dfa(terms.intersection(even_a, ends_b))
+        test_nfa.nfa_test(both, {"b", "aab", "abab"}, {"", "ab", "aaba"})
+        neither = terms.to_dfa(
+            terms.complement(terms.union(even_a, ends_b)))
+        test_nfa.nfa_test(
+            neither, {"a", "aaa", "baaba"}, {"", "b", "aa", "aba"})
+
+        with self.assertRaises(ValueError):
+            regex_to_dfa("a", engine="thompson")
+        with self.assertRaises(BudgetExceeded):
+            regex_to_dfa(
+                "(a|b)*a(a|b)(a|b)(a|b)(a|b)", budget=Budget(max_states=8),
+                engine="derivatives")
+
+
+class TestService(unittest.TestCase):
+
+    def test_service(self) -> None:
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self._test_service())
+        finally:
+            loop.close()
+
+    async def _test_service(self) -> None:
+        service = AutomatonService("examples", workers=1)
+        directory = tempfile.TemporaryDirectory()
+        path = os.path.join(directory.name, "simone.sock")
+        await service.start(path)
+        reader, writer = await asyncio.open_unix_connection(path)
+
+        async def call(method: str, **params: object) -> dict:
+            writer.write(json.dumps({
+                "jsonrpc": "2.0", "id": 0, "method": method,
+                "params": params}).encode() + b"\n")
+            return json.loads(await reader.readline())
+
+        try:
+            self.assertIn("result", await call("load", name="div3"))
+            self.assertIn("result", await call("load", name="div5"))
+            self.assertEqual(
+                (await call("load", name="../div3"))["error"]["code"],
+                -32000)
+            self.assertEqual(
+                (await call("load", name="missing"))["error"]["message"],
+                "No such file or directory: '{}'".format(
+                    os.path.join("examples", "missing.json")))
+            self.assertEqual(
+                (await call("accept", name="aa", string="0"))["error"]
+                ["message"], "Automaton aa is not loaded")
+            self.assertEqual(
+                (await call("unknown"))["error"]["code"], -32601)
+            self.assertEqual(
+                (await call("load", name=5))["error"]["code"], -32602)
+            with open(os.path.join(directory.name, "bad.json"), "w") as file:
+                file.write("{")
+            other = AutomatonService(directory.name, workers=1)
+            self.assertEqual((await other.call(
+                b'{"method": "load", "params": ["bad"]}'))["error"]["code"],
+                -32000)
+            await other.close()
+
+            # concurrent calls, the answers may come in any order
+            div3 = NFA.load("examples/div3.json")
+            strings = [bin(n)[2:] for n in range(50)]
+            for i, string in enumerate(strings):
+                writer.write(json.dumps({
+                    "jsonrpc": "2.0", "id": i, "method": "accept",
+                    "params": {"name": "div3", "string": string}
+                }).encode() + b"\n")
+            answers = {}
+            for _ in strings:
+                response = json.loads(await reader.readline())
+                answers[response["id"]] = response["result"]
+            self.assertEqual(
+                answers, {i: div3.accept(s) for i, s in enumerate(strings)})
+            self.assertEqual(
+                (await call("accept_many", name="div3", strings=strings))
+                ["result"], [div3.accept(string) for string in strings])
+
+            self.assertFalse(
+                (await call("is_equal", first="div3", second="div5"))
+                ["result"])
+            minimized = copy.deepcopy(div3)
+            minimized.minimize()
+            self.assertEqual(
+                (await call("minimize", name="div3"))["result"],
+                {"states": len(minimized.states)})
+
+            metrics = (await call("metrics"))["result"]
+            self.assertEqual(metrics["automata"], ["div3", "div5"])
+            self.assertEqual(metrics["methods"]["accept"]["count"], 51)
+            # the concurrent calls were matched in fewer batches
+            self.assertLess(metrics["batch_sizes"]["count"], 50)
+
+            # an automaton unloaded during its minimization stays unloaded
+            for i, method in enumerate(("minimize", "unload")):
+                writer.write(json.dumps({
+                    "jsonrpc": "2.0", "id": i, "method": method,
+                    "params": {"name": "div5"}}).encode() + b"\n")
+            responses = [json.loads(await reader.readline()) for _ in "ab"]
+            self.assertEqual(
+                sorted(response["id"] for response in responses
+                       if "error" in response), [0])
+            self.assertEqual(
+                (await call("metrics"))["result"]["automata"], ["div3"])
+
+            # a bad string does not hold up the calls batched with it
+            for i, string in enumerate((None, "11")):
+                writer.write(json.dumps({
+                    "jsonrpc": "2.0", "id": i, "method": "accept",
+                    "params": {"name": "div3", "string": string}
+                }).encode() + b"\n")
+            responses = {}
+            for _ in range(2):
+                response = json.loads(await reader.readline())
+                responses[response["id"]] = response
+            self.assertEqual(responses[0]["error"]["code"], -32602)
+            self.assertTrue(responses[1]["result"])
+        finally:
+            writer.close()
+            await service.close()
+            directory.cleanup()
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,272 @@
+from typing import Callable, Dict, Iterable, Optional, Set
+from tools.nfa import NFA
+
+
+class LanguageAnalysis():
+    """
+        Keeps the emptiness and finiteness of the language of an automaton
+        up to date while it is edited.
+
+        The edits must go through this object, which applies them to the
+        automaton and updates the reachable set (states reachable from the
+        initial state) and the co-reachable set (states that reach a final
+        state). An added edge only explores the states that become
+        (co-)reachable, and a removed one only revisits the states that were
+        (co-)reachable through it. The language is empty when the initial
+        state is not co-reachable, and infinite when there is a cycle through
+        useful (reachable and co-reachable) states. The cycle check is cached
+        and only redone after an edit that may have changed its answer.
+    """
+
+    def __init__(self, nfa: NFA) -> None:
+        self._nfa = nfa
+        # multigraph of the automaton, the symbols are irrelevant here
+        self._successors = {}  # type: Dict[str, Dict[str, int]]
+        self._predecessors = {}  # type: Dict[str, Dict[str, int]]
+        for state in nfa.states if nfa.initial_state else []:
+            self._successors[state] = {}
+            self._predecessors[state] = {}
+        for (state, _), next_states in nfa.transition_table.items():
+            for next_state in next_states:
+                self._count_edge(state, next_state, 1)
+
+        self._reachable = set()  # type: Set[str]
+        if nfa.initial_state:
+            self._extend(
+                self._reachable, [nfa.initial_state], self._successors)
+        self._coreachable = set()  # type: Set[str]
+        self._extend(self._coreachable, nfa.final_states, self._predecessors)
+        self._finite = None  # type: Optional[bool]
+
+    @property
+    def nfa(self) -> NFA:
+        return self._nfa
+
+    def is_empty(self) -> bool:
+        """ Checks if the language of the automaton is empty """
+        return self._nfa.initial_state not in self._coreachable
+
+    def is_finite(self) -> bool:
+        """ Checks if the language of the automaton is finite """
+        if self._finite is None:
+            self._finite = not self._has_cycle()
+        return self._finite
+
+    def add_state(self, state: str) -> None:
+        if not state or state in self._successors:
+            return
+        self._nfa.add_state(state)
+        self._successors[state] = {}
+        self._predecessors[state] = {}
+        if state == self._nfa.initial_state:
+            self._reachable.add(state)
+
+    def remove_state(self, state: str) -> None:
+        if state not in self._successors or \
+                state == self._nfa.initial_state:
+            return
+        if self._nfa.is_final(state):
+            self.toggle_final_state(state)
+        for next_state, count in list(self._successors[state].items()):
+            self._remove_edge(state, next_state, count)
+        for previous_state, count in list(self._predecessors[state].items()):
+            self._remove_edge(previous_state, state, count)
+        self._nfa.remove_state(state)
+        del self._successors[state]
+        del self._predecessors[state]
+
+    def toggle_final_state(self, state: str) -> None:
+        if state not in self._successors:
+            return
+        self._nfa.toggle_final_state(state)
+        if self._nfa.is_final(state):
+            if state not in self._coreachable:
+                grown = self._extend(
+                    self._coreachable, [state], self._predecessors)
+                self._grown(grown)
+        else:
+            was_useful = self._is_useful(state)
+            self._retract(
+                self._coreachable, state, self._predecessors,
+                self._successors, self._nfa.is_final)
+            self._shrunk(was_useful)
+
+    def add_symbol(self, symbol: str) -> None:
+        self._nfa.add_symbol(symbol)
+
+    def remove_symbol(self, symbol: str) -> None:
+        for state in list(self._successors):
+            self.set_transition(state, symbol, set())
+        self._nfa.remove_symbol(symbol)
+
+    def set_transition(
+            self, state: str, symbol: str, next_states: Set[str]) -> None:
+        """ Same as NFA.set_transition, raises KeyError for unknown states """
+        old_states = self._nfa.transition(state, symbol)
+        self._nfa.set_transition(state, symbol, next_states)
+        for next_state in next_states - old_states:
+            self._add_edge(state, next_state)
+        for next_state in old_states - next_states:
+            self._remove_edge(state, next_state)
+
+    def _count_edge(self, state: str, next_state: str, amount: int) -> int:
+        """ Updates the edge multiplicity, returns the new one """
+        count = self._successors[state].get(next_state, 0) + amount
+        if count:
+            self._successors[state][next_state] = count
+            self._predecessors[next_state][state] = count
+        else:
+            del self._successors[state][next_state]
+            del self._predecessors[next_state][state]
+        return count
+
+    def _add_edge(self, state: str, next_state: str) -> None:
+        if self._count_edge(state, next_state, 1) > 1:
+            return
+        grown = set()  # type: Set[str]
+        if state in self._reachable and next_state not in self._reachable:
+            grown |= self._extend(
+                self._reachable, [next_state], self._successors)
+        if next_state in self._coreachable and \
+                state not in self._coreachable:
+            grown |= self._extend(
+                self._coreachable, [state], self._predecessors)
+
+        self._grown(grown)
+        if self._finite and self._is_useful(state) and \
+                self._is_useful(next_state) and \
+                self._reaches(next_state, state):
+            # the new edge closes a cycle through useful states
+            self._finite = False
+
+    def _remove_edge(
+            self, state: str, next_state: str, count: int=1) -> None:
+        was_useful = self._is_useful(state) and self._is_useful(next_state)
+        if self._count_edge(state, next_state, -count) > 0:
+            return
+        if state in self._reachable and next_state in self._reachable:
+            self._retract(
+                self._reachable, next_state, self._successors,
+                self._predecessors, self._is_initial)
+        if state in self._coreachable and next_state in self._coreachable:
+            self._retract(
+                self._coreachable, state, self._predecessors,
+                self._successors, self._nfa.is_final)
+        self._shrunk(was_useful)
+
+    def _is_initial(self, state: str) -> bool:
+        return state == self._nfa.initial_state
+
+    def _is_useful(self, state: str) -> bool:
+        return state in self._reachable and state in self._coreachable
+
+    def _grown(self, grown: Set[str]) -> None:
+        """ Some states became (co-)reachable, cycles may have appeared """
+        if self._finite and any(map(self._is_useful, grown)):
+            self._finite = None
+
+    def _shrunk(self, was_useful: bool) -> None:
+        """ An edge or final state is gone, cycles may have disappeared """
+        if self._finite is False and was_useful:
+            self._finite = None
+
+    @staticmethod
+    def _extend(
+            region: Set[str], seeds: Iterable[str],
+            adjacency: Dict[str, Dict[str, int]]) -> Set[str]:
+        """
+            Adds to the region everything reachable from the seeds through
+            the adjacency, returns the states added
+        """
+        added = set(seeds) - region
+        region |= added
+        to_visit = list(added)
+        while to_visit:
+            state = to_visit.pop()
+            for next_state in adjacency[state]:
+                if next_state not in region:
+                    region.add(next_state)
+                    added.add(next_state)
+                    to_visit.append(next_state)
+        return added
+
+    def _retract(
+            self, region: Set[str], start: str,
+            forward: Dict[str, Dict[str, int]],
+            backward: Dict[str, Dict[str, int]],
+            is_root: Callable[[str], bool]) -> Set[str]:
+        """
+            The region is everything reachable from the roots through the
+            forward adjacency, and start may have lost its support. Removes
+            what depended on start and puts back what is still supported by
+            the rest of the region. Returns the states removed.
+        """
+        if is_root(start):
+            return set()
+        # everything that may have been in the region only through start
+        affected = self._region_from(start, forward, region, is_root)
+        region -= affected
+
+        supported = [
+            state for state in affected
+            if any(other in region for other in backward[state])]
+        self._extend(region, supported, forward)
+        return affected - region
+
+    @staticmethod
+    def _region_from(
+            start: str, forward: Dict[str, Dict[str, int]],
+            region: Set[str], is_root: Callable[[str], bool]) -> Set[str]:
+        """ States of the region reachable from start, avoiding the roots """
+        found = {start}
+        to_visit = [start]
+        while to_visit:
+            state = to_visit.pop()
+            for next_state in forward[state]:
+                if next_state in region and not is_root(next_state) and \
+                        next_state not in found:
+                    found.add(next_state)
+                    to_visit.append(next_state)
+        return found
+
+    def _reaches(self, source: str, target: str) -> bool:
+        """
+            Checks if there is a path of useful states from source to target
+        """
+        found = {source}
+        to_visit = [source]
+        while to_visit:
+            state = to_visit.pop()
+            if state == target:
+                return True
+            for next_state in self._successors[state]:
+                if next_state not in found and self._is_useful(next_state):
+                    found.add(next_state)
+                    to_visit.append(next_state)
+        return False
+
+    def _has_cycle(self) -> bool:
+        """ Checks if there is a cycle through useful states """
+        finished = set()  # type: Set[str]
+        for root in self._reachable & self._coreachable:
+            if root in finished:
+                continue
+            in_path = {root}
+            path = [(root, iter(self._successors[root]))]
+            while path:
+                state, next_states = path[-1]
+                for next_state in next_states:
+                    if not self._is_useful(next_state) or \
+                            next_state in finished:
+                        continue
+                    if next_state in in_path:
+                        return True
+                    in_path.add(next_state)
+                    path.append(
+                        (next_state, iter(self._successors[next_state])))
+                    break
+                else:
+                    path.pop()
+                    in_path.remove(state)
+                    finished.add(state)
+        return False
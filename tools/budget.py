@@ -0,0 +1,81 @@
+from typing import Any, Dict, Optional
+import threading
+import time
+
+
+class CancelToken():
+    """ Flag shared with a running algorithm to ask it to stop """
+
+    def __init__(self) -> None:
+        self._event = threading.Event()
+
+    def cancel(self) -> None:
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+
+class BudgetExceeded(RuntimeError):
+    """
+        Raised when an algorithm goes over its budget or is cancelled. The
+        automaton it was working on is left as it was before the call, or
+        with the same language where the method says so (determinize may
+        leave it without epsilon transitions, for instance).
+        `stats` holds the partial statistics at the moment of the abort.
+    """
+
+    def __init__(self, message: str, stats: Dict[str, Any]) -> None:
+        super().__init__(message)
+        self.stats = stats
+
+
+class Budget():
+    """
+        Resource limits of an algorithm run: maximum number of states and
+        transitions built, a timeout in seconds (the deadline is counted from
+        the creation of the budget) and a cancel token. Any of them may be
+        None, meaning no limit.
+    """
+
+    # the clock is only read every CLOCK_INTERVAL checks
+    CLOCK_INTERVAL = 64
+
+    def __init__(
+            self,
+            max_states: Optional[int]=None,
+            max_transitions: Optional[int]=None,
+            timeout: Optional[float]=None,
+            cancel: Optional[CancelToken]=None) -> None:
+        self.max_states = max_states
+        self.max_transitions = max_transitions
+        self.start = time.monotonic()
+        self.deadline = self.start + timeout if timeout is not None else None
+        self.cancel = cancel
+        self._checks = 0
+
+    def check(self, states: int, transitions: int) -> None:
+        """ Raises BudgetExceeded if the given counts are over the limits """
+        message = ""
+        if self.max_states is not None and states > self.max_states:
+            message = "Too many states (limit is {})".format(self.max_states)
+        elif self.max_transitions is not None and \
+                transitions > self.max_transitions:
+            message = "Too many transitions (limit is {})".format(
+                self.max_transitions)
+        elif self.cancel is not None and self.cancel.cancelled:
+            message = "Cancelled"
+        else:
+            self._checks += 1
+            if self.deadline is not None and \
+                    self._checks % self.CLOCK_INTERVAL == 1 and \
+                    time.monotonic() > self.deadline:
+                message = "Time limit exceeded"
+
+        if message:
+            raise BudgetExceeded(message, {
+                "states": states,
+                "transitions": transitions,
+                "elapsed": time.monotonic() - self.start
+            })
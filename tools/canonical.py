@@ -0,0 +1,246 @@
+from typing import Dict, List, Set, Tuple, Union
+import copy
+import hashlib
+import json
+from tools.nfa import NFA
+from tools.stats import Stats, phase
+from tools.budget import Budget
+
+# symbols, (symbol, next state) edges of each state and final states, the
+# states are numbered in breadth first order from the initial state (0)
+CanonicalForm = Tuple[
+    Tuple[str, ...], Tuple[Tuple[Tuple[str, int], ...], ...], Tuple[int, ...]]
+
+
+def canonical_form(
+        nfa: NFA, stats: Stats=None, budget: Budget=None) -> CanonicalForm:
+    """
+        Canonical form of the minimal DFA of the language: two automata
+        have the same form if and only if they accept the same strings.
+
+        The automaton (a copy of it) is reduced, determinized and trimmed,
+        its states are merged with Hopcroft's partition refinement and the
+        blocks are numbered in breadth first order, following the symbols
+        in alphabetical order. The dead state and the symbols without
+        transitions are left out, so the alphabet does not matter.
+    """
+    dfa = copy.deepcopy(nfa)
+    if not dfa.is_deterministic():
+        dfa.reduce(stats=stats, budget=budget)
+        dfa.determinize(stats, budget)
+
+    with phase(stats, "canonical_form"):
+        dfa.remove_unreachable()
+        dfa.remove_dead()
+        states = dfa.states
+        symbols = dfa.alphabet
+        ids = {state: i for i, state in enumerate(states)}
+        # complete DFA, the last state is the dead one
+        dead = len(states)
+        delta = [[dead] * (dead + 1) for _ in symbols]
+        for a, symbol in enumerate(symbols):
+            for state in states:
+                for next_state in dfa.transition(state, symbol):
+                    delta[a][ids[state]] = ids[next_state]
+        final_states = dfa.final_states
+        finals = [state in final_states for state in states] + [False]
+
+        blocks = _hopcroft(delta, finals)
+        form = _number(delta, finals, blocks, symbols)
+
+    if stats is not None:
+        stats.count("blocks", len(form[1]))
+    return form
+
+
+def _hopcroft(delta: List[List[int]], finals: List[bool]) -> List[int]:
+    """
+        Coarsest partition of the states of a complete DFA that keeps final
+        and non-final states apart, delta[a][q] is the state reached from q
+        by the a-th symbol. Returns the block of each state.
+    """
+    n = len(finals)
+    inverse = [
+        [[] for _ in range(n)] for _ in delta]  # type: List[List[List[int]]]
+    for a, row in enumerate(delta):
+        for state, next_state in enumerate(row):
+            inverse[a][next_state].append(state)
+
+    block_of = [int(final) for final in finals]
+    blocks = [
+        {state for state in range(n) if not finals[state]},
+        {state for state in range(n) if finals[state]}]
+    if not blocks[1] or not blocks[0]:
+        return [0] * n
+    smaller = 0 if len(blocks[0]) <= len(blocks[1]) else 1
+    pending = {(smaller, a) for a in range(len(delta))}
+
+    while pending:
+        splitter, a = pending.pop()
+        # predecessors of the splitter, grouped by their blocks
+        touched = {}  # type: Dict[int, Set[int]]
+        for state in blocks[splitter]:
+            for previous_state in inverse[a][state]:
+                touched.setdefault(
+                    block_of[previous_state], set()).add(previous_state)
+
+        for block, inside in touched.items():
+            if len(inside) == len(blocks[block]):
+                continue
+            blocks[block] -= inside
+            new_block = len(blocks)
+            blocks.append(inside)
+            for state in inside:
+                block_of[state] = new_block
+            for b in range(len(delta)):
+                if (block, b) in pending:
+                    pending.add((new_block, b))
+                elif len(inside) <= len(blocks[block]):
+                    pending.add((new_block, b))
+                else:
+                    pending.add((block, b))
+    return block_of
+
+
+def _number(
+        delta: List[List[int]], finals: List[bool], blocks: List[int],
+        symbols: List[str]) -> CanonicalForm:
+    """ Numbers the blocks in breadth first order, see CanonicalForm """
+    dead_block = blocks[-1]
+    # a state of each block
+    representatives = {}  # type: Dict[int, int]
+    for state, block in enumerate(blocks):
+        representatives.setdefault(block, state)
+
+    numbers = {blocks[0]: 0}
+    to_visit = [blocks[0]]
+    table = []  # type: List[Tuple[Tuple[str, int], ...]]
+    used = set()  # type: Set[str]
+    for block in to_visit:
+        state = representatives[block]
+        edges = []  # type: List[Tuple[str, int]]
+        for a, symbol in enumerate(symbols):
+            next_block = blocks[delta[a][state]]
+            if next_block == dead_block:
+                continue
+            if next_block not in numbers:
+                numbers[next_block] = len(numbers)
+                to_visit.append(next_block)
+            edges.append((symbol, numbers[next_block]))
+            used.add(symbol)
+        table.append(tuple(edges))
+
+    final_numbers = tuple(
+        numbers[block] for block in to_visit
+        if finals[representatives[block]])
+    return tuple(sorted(used)), tuple(table), final_numbers
+
+
+def canonical_dfa(
+        nfa: NFA, stats: Stats=None, budget: Budget=None) -> NFA:
+    """ Minimal DFA of the language, with its states named q0, q1, ... """
+    return form_to_dfa(canonical_form(nfa, stats, budget))
+
+
+def form_to_dfa(form: CanonicalForm) -> NFA:
+    """ Builds the DFA of a canonical form """
+    symbols, table, final_states = form
+    states = ["q" + str(i) for i in range(len(table))]
+    transitions = {
+        (states[i], symbol): {states[next_state]}
+        for i, edges in enumerate(table) for symbol, next_state in edges}
+    return NFA(
+        set(states), set(symbols), transitions, states[0],
+        {states[i] for i in final_states})
+
+
+def fingerprint(form: CanonicalForm) -> str:
+    """
+        Stable hash of a canonical form, the same across runs and
+        machines, e.g. to deduplicate a corpus of automata
+    """
+    return hashlib.sha256(
+        json.dumps(form, separators=(",", ":")).encode()).hexdigest()
+
+
+class EquivalenceCache():
+    """
+        Answers is_equal and contains by the fingerprints of the languages.
+
+        Automata are given directly or as the fingerprints returned by add,
+        which are cheaper to reuse: fingerprinting costs a determinization
+        and a minimization, and automata may change, so they are
+        fingerprinted again every time they are given. Equal fingerprints
+        mean equal languages, so is_equal needs no product at all, and
+        contains is computed on the minimal DFAs and remembered for the
+        pair.
+    """
+
+    def __init__(self) -> None:
+        self._forms = {}  # type: Dict[str, CanonicalForm]
+        self._dfas = {}  # type: Dict[str, NFA]
+        self._contains = {}  # type: Dict[Tuple[str, str], bool]
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        """ Number of distinct languages seen """
+        return len(self._forms)
+
+    def add(self, nfa: NFA, stats: Stats=None, budget: Budget=None) -> str:
+        """ Returns the fingerprint of the language of the automaton """
+        form = canonical_form(nfa, stats, budget)
+        key = fingerprint(form)
+        if self._forms.setdefault(key, form) != form:
+            raise RuntimeError("Fingerprint collision")
+        return key
+
+    def is_equal(
+            self, nfa: Union[NFA, str], automaton: Union[NFA, str],
+            stats: Stats=None, budget: Budget=None) -> bool:
+        """ Same as NFA.is_equal, for automata or their fingerprints """
+        return self._key(nfa, stats, budget) == \
+            self._key(automaton, stats, budget)
+
+    def contains(
+            self, nfa: Union[NFA, str], automaton: Union[NFA, str],
+            stats: Stats=None, budget: Budget=None) -> bool:
+        """ Same as NFA.contains, for automata or their fingerprints """
+        key = (
+            self._key(nfa, stats, budget),
+            self._key(automaton, stats, budget))
+        if key[0] == key[1]:
+            return True
+
+        contained = self._contains.get(key)
+        if contained is None:
+            self.misses += 1
+            contained = self._dfa(key[0]).contains(
+                self._dfa(key[1]), stats, budget)
+            self._contains[key] = contained
+        else:
+            self.hits += 1
+            if stats is not None:
+                stats.count("cache_hits")
+        return contained
+
+    def _key(
+            self, nfa: Union[NFA, str], stats: Stats=None,
+            budget: Budget=None) -> str:
+        if isinstance(nfa, str):
+            if nfa not in self._forms:
+                raise KeyError("Unknown fingerprint " + nfa)
+            return nfa
+        return self.add(nfa, stats, budget)
+
+    def _dfa(self, key: str) -> NFA:
+        dfa = self._dfas.get(key)
+        if dfa is None:
+            dfa = form_to_dfa(self._forms[key])
+            self._dfas[key] = dfa
+        return dfa
+
+    def clear(self) -> None:
+        self._forms.clear()
+        self._dfas.clear()
+        self._contains.clear()
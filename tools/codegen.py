@@ -0,0 +1,91 @@
+from typing import Callable, List
+from functools import lru_cache
+from tools.nfa import NFA
+from tools.canonical import CanonicalForm, canonical_form
+from tools.regex import regex_to_dfa
+
+MODULE_TEMPLATE = '''"""
+    Matcher of a regular language, generated from its minimal DFA ({states}
+    states over {symbols}), depends on nothing.
+"""
+
+
+def _rows():
+    """ One dictionary per state, from symbol to the next state's """
+    rows = [{{}} for _ in range({states})]
+{rows}
+    return rows[0]
+
+
+def {name}(string, _initial=_rows()):
+    """ Checks if the whole string is in the language """
+    state = _initial
+    try:
+        for symbol in string:
+            state = state[symbol]
+    except KeyError:  # a symbol without transition goes to the dead state
+        return False
+    return "" in state  # final states have an extra "" key
+'''
+
+
+def matcher_source(nfa: NFA, name: str="match") -> str:
+    """
+        Python source of a module defining name(string) -> bool, the same
+        as nfa.accept(string), see compile_matcher
+    """
+    return _source(canonical_form(nfa), name)
+
+
+def compile_matcher(nfa: NFA, name: str="match") -> Callable[[str], bool]:
+    """
+        Generates, compiles and returns a function that accepts the same
+        strings as the automaton, with the lowest cost per symbol.
+
+        The minimal DFA is turned into a dictionary per state that maps the
+        symbols to the dictionaries of the next states, so matching is a
+        single lookup per symbol, with no state numbers to translate. The
+        functions are cached by language, so automata that accept the same
+        strings share the same function.
+    """
+    return _compile(canonical_form(nfa), name)
+
+
+@lru_cache(maxsize=256)
+def regex_matcher(regex: str) -> Callable[[str], bool]:
+    """ compile_matcher of a RegExp, cached by RegExp """
+    return compile_matcher(regex_to_dfa(regex))
+
+
+def export_matcher(nfa: NFA, path: str, name: str="match") -> None:
+    """ Saves the matcher of the automaton as a standalone module """
+    with open(path, "w") as module_file:
+        module_file.write(matcher_source(nfa, name))
+
+
+@lru_cache(maxsize=256)
+def _compile(form: CanonicalForm, name: str) -> Callable[[str], bool]:
+    namespace = {}  # type: dict
+    exec(compile(_source(form, name), "<matcher>", "exec"), namespace)
+    return namespace[name]
+
+
+def _source(form: CanonicalForm, name: str) -> str:
+    if not name.isidentifier():
+        raise ValueError("Invalid function name: {}".format(name))
+    symbols, table, final_states = form
+    rows = []  # type: List[str]
+    for state, edges in enumerate(table):
+        # strings are matched symbol by symbol, so only the symbols of one
+        # character can be taken
+        items = [
+            "{!r}: rows[{}]".format(symbol, next_state)
+            for symbol, next_state in edges if len(symbol) == 1]
+        if state in final_states:
+            items.append('"": True')
+        if items:
+            rows.append("    rows[{}].update({{{}}})".format(
+                state, ", ".join(items)))
+    return MODULE_TEMPLATE.format(
+        states=len(table), symbols=", ".join(symbols) or "no symbols",
+        rows="\n".join(rows), name=name)
@@ -0,0 +1,228 @@
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from tools.nfa import NFA
+from tools.stats import Stats, phase
+from tools.budget import Budget
+
+EMPTY = "empty"  # the empty language
+EPSILON = "epsilon"
+SYMBOL = "symbol"
+CONCAT = "concat"
+STAR = "star"
+UNION = "union"
+INTERSECTION = "intersection"
+COMPLEMENT = "complement"
+
+
+class Term():
+    """
+        Regular expression term. Terms are hash-consed by their Terms
+        factory, so two equal terms are the same object and can be compared
+        and hashed by identity.
+    """
+
+    __slots__ = ("kind", "symbol", "children", "nullable", "id")
+
+    def __init__(
+            self, kind: str, symbol: str, children: Tuple['Term', ...],
+            nullable: bool, id: int) -> None:
+        self.kind = kind
+        self.symbol = symbol
+        self.children = children
+        self.nullable = nullable
+        self.id = id
+
+    def __repr__(self) -> str:
+        if self.kind == SYMBOL:
+            return self.symbol
+        if self.kind in (EMPTY, EPSILON):
+            return self.kind
+        return "{}({})".format(
+            self.kind, ", ".join(map(repr, self.children)))
+
+
+class Terms():
+    """
+        Factory of canonical terms and of their Brzozowski derivatives.
+
+        The constructors normalize the terms (unions and intersections are
+        flattened, deduplicated and sorted, i.e. associative, commutative and
+        idempotent, and the trivial cases are simplified), which makes the
+        set of derivatives of a term finite. Each factory keeps its own
+        tables, so different factories may be used from different threads.
+    """
+
+    def __init__(self) -> None:
+        self._table = {}  # type: Dict[Tuple, Term]
+        self._derivatives = {}  # type: Dict[Tuple[int, str], Term]
+        self.derivative_hits = 0
+        self.empty = self._make(EMPTY, "", (), False)
+        self.epsilon = self._make(EPSILON, "", (), True)
+        self.universal = self._make(COMPLEMENT, "", (self.empty,), True)
+
+    def _make(
+            self, kind: str, symbol: str, children: Tuple[Term, ...],
+            nullable: bool) -> Term:
+        key = (kind, symbol, tuple(child.id for child in children))
+        term = self._table.get(key)
+        if term is None:
+            term = Term(kind, symbol, children, nullable, len(self._table))
+            self._table[key] = term
+        return term
+
+    def symbol(self, symbol: str) -> Term:
+        return self._make(SYMBOL, symbol, (), False)
+
+    def concat(self, left: Term, right: Term) -> Term:
+        if left is self.empty or right is self.empty:
+            return self.empty
+        if left is self.epsilon:
+            return right
+        if right is self.epsilon:
+            return left
+        if left.kind == CONCAT:  # keep concatenations right associative
+            return self.concat(
+                left.children[0], self.concat(left.children[1], right))
+        return self._make(
+            CONCAT, "", (left, right), left.nullable and right.nullable)
+
+    def star(self, term: Term) -> Term:
+        if term.kind == STAR:
+            return term
+        if term is self.empty or term is self.epsilon:
+            return self.epsilon
+        return self._make(STAR, "", (term,), True)
+
+    def optional(self, term: Term) -> Term:
+        return self.union(self.epsilon, term)
+
+    def union(self, *terms: Term) -> Term:
+        children = self._flatten(UNION, terms) - {self.empty}
+        if self.universal in children:
+            return self.universal
+        return self._associative(UNION, children, self.empty)
+
+    def intersection(self, *terms: Term) -> Term:
+        children = self._flatten(INTERSECTION, terms) - {self.universal}
+        if self.empty in children:
+            return self.empty
+        return self._associative(INTERSECTION, children, self.universal)
+
+    def complement(self, term: Term) -> Term:
+        if term.kind == COMPLEMENT:
+            return term.children[0]
+        return self._make(COMPLEMENT, "", (term,), not term.nullable)
+
+    @staticmethod
+    def _flatten(kind: str, terms: Iterable[Term]) -> Set[Term]:
+        flat = set()  # type: Set[Term]
+        for term in terms:
+            if term.kind == kind:
+                flat.update(term.children)
+            else:
+                flat.add(term)
+        return flat
+
+    def _associative(
+            self, kind: str, children: Set[Term], neutral: Term) -> Term:
+        if not children:
+            return neutral
+        if len(children) == 1:
+            return next(iter(children))
+        ordered = tuple(sorted(children, key=lambda term: term.id))
+        if kind == UNION:
+            nullable = any(term.nullable for term in ordered)
+        else:
+            nullable = all(term.nullable for term in ordered)
+        return self._make(kind, "", ordered, nullable)
+
+    def derivative(self, term: Term, symbol: str) -> Term:
+        """ Returns the term of { w | symbol + w in L(term) } """
+        key = (term.id, symbol)
+        derivative = self._derivatives.get(key)
+        if derivative is not None:
+            self.derivative_hits += 1
+            return derivative
+
+        kind = term.kind
+        if kind == SYMBOL:
+            derivative = self.epsilon if term.symbol == symbol else self.empty
+        elif kind == CONCAT:
+            left, right = term.children
+            derivative = self.concat(self.derivative(left, symbol), right)
+            if left.nullable:
+                derivative = self.union(
+                    derivative, self.derivative(right, symbol))
+        elif kind == STAR:
+            derivative = self.concat(
+                self.derivative(term.children[0], symbol), term)
+        elif kind == UNION:
+            derivative = self.union(*(
+                self.derivative(child, symbol) for child in term.children))
+        elif kind == INTERSECTION:
+            derivative = self.intersection(*(
+                self.derivative(child, symbol) for child in term.children))
+        elif kind == COMPLEMENT:
+            derivative = self.complement(
+                self.derivative(term.children[0], symbol))
+        else:  # EMPTY or EPSILON
+            derivative = self.empty
+
+        self._derivatives[key] = derivative
+        return derivative
+
+    def alphabet(self, term: Term) -> Set[str]:
+        """ Symbols that appear in the term """
+        symbols = set()  # type: Set[str]
+        visited = set()  # type: Set[Term]
+        to_visit = [term]
+        while to_visit:
+            term = to_visit.pop()
+            if term.kind == SYMBOL:
+                symbols.add(term.symbol)
+            for child in term.children:
+                if child not in visited:
+                    visited.add(child)
+                    to_visit.append(child)
+        return symbols
+
+    def to_dfa(
+            self, term: Term, alphabet: Optional[Iterable[str]]=None,
+            stats: Stats=None, budget: Budget=None) -> NFA:
+        """
+            Builds the DFA whose states are the distinct derivatives of the
+            term. The alphabet defaults to the symbols of the term, it
+            matters for complements. Transitions to the empty term are left
+            out, as the other constructions do.
+        """
+        symbols = sorted(
+            alphabet if alphabet is not None else self.alphabet(term))
+        hits = self.derivative_hits
+
+        with phase(stats, "derivatives"):
+            names = {term: "q0"}  # type: Dict[Term, str]
+            transitions = {}  # type: Dict[Tuple[str, str], Set[str]]
+            to_visit = [term]  # type: List[Term]
+            while to_visit:
+                if budget is not None:
+                    budget.check(len(names), len(transitions))
+                current = to_visit.pop()
+                for symbol in symbols:
+                    derivative = self.derivative(current, symbol)
+                    if derivative is self.empty:
+                        continue
+                    if derivative not in names:
+                        names[derivative] = "q" + str(len(names))
+                        to_visit.append(derivative)
+                    transitions[names[current], symbol] = \
+                        {names[derivative]}
+
+        if stats is not None:
+            stats.count("states_created", len(names))
+            stats.count("transitions_created", len(transitions))
+            stats.count("derivative_cache_hits", self.derivative_hits - hits)
+            stats.peak("states", len(names))
+
+        final_states = {name for term, name in names.items() if term.nullable}
+        return NFA(
+            set(names.values()), set(symbols), transitions, "q0",
+            final_states)
@@ -1,4 +1,8 @@
-from typing import Dict, Set
+from typing import (
+    Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple)
+import re
+import copy
+from tools.nfa import NFA
 
 
 class RegularGrammar():
@@ -38,7 +42,12 @@ class RegularGrammar():
             Returns a regular grammar that generates the language of the given
             NFA
         """
+        if nfa.has_epsilon():
+            nfa = copy.deepcopy(nfa)
+            nfa.remove_epsilon()
+
         initial_symbol = nfa.initial_state
+        final_states = nfa.final_states
         productions = {}  # type: Dict[str, Set[str]]
 
         # if delta(A, a) = B, then add the production A -> aB to the grammar
@@ -48,14 +57,270 @@ class RegularGrammar():
                 if k[0] not in productions:
                     productions[k[0]] = set()
                 productions[k[0]].add(k[1] + state)
-                if state in nfa.final_states:
+                if state in final_states:
                     productions[k[0]].add(k[1])
 
         # if the NFA accepts epsilon, add epsilon to the grammar
-        if nfa.initial_state in nfa.final_states:
+        if nfa.initial_state in final_states:
             new_initial_symbol = initial_symbol + "'"
             productions[new_initial_symbol] = \
                 productions.get(initial_symbol, set()) | {"&"}
             initial_symbol = new_initial_symbol
 
         return RegularGrammar(initial_symbol, productions)
+
+
+class Production(NamedTuple):
+    """
+        Production of an IndexedGrammar: a terminal followed by an optional
+        non-terminal, given by its id. The empty production is ("&", None).
+    """
+    terminal: str
+    non_terminal: Optional[int]
+
+
+EPSILON = "&"
+PRODUCTION_PATTERN = re.compile(r"^([a-z0-9&])([A-Z]'?)?$")
+NON_TERMINAL_PATTERN = re.compile(r"^[A-Z]'?$")
+
+
+class IndexedGrammar():
+    """
+        Regular grammar whose non-terminals are integer ids, with their names
+        kept in a side table, and whose productions are Production tuples.
+
+        Unlike RegularGrammar, nothing has to be parsed from strings after
+        construction, so the analyses and the conversions from and to
+        automata are linear in the size of the grammar. Non-terminal 0 is the
+        initial symbol.
+    """
+
+    def __init__(self) -> None:
+        self._names = []  # type: List[str]
+        self._ids = {}  # type: Dict[str, int]
+        self._productions = []  # type: List[Set[Production]]
+
+    @property
+    def initial_symbol(self) -> str:
+        return self._names[0] if self._names else ""
+
+    @property
+    def non_terminals(self) -> List[str]:
+        """ Names of the non-terminals, the initial symbol first """
+        return list(self._names)
+
+    def non_terminal(self, name: str) -> int:
+        """ Returns the id of a non-terminal, creating it if needed """
+        if name not in self._ids:
+            self._ids[name] = len(self._names)
+            self._names.append(name)
+            self._productions.append(set())
+        return self._ids[name]
+
+    def name(self, non_terminal: int) -> str:
+        return self._names[non_terminal]
+
+    def productions(self, non_terminal: int) -> Set[Production]:
+        return self._productions[non_terminal]
+
+    def add_production(
+            self, non_terminal: int, terminal: str,
+            next_non_terminal: Optional[int]=None) -> None:
+        self._productions[non_terminal].add(
+            Production(terminal, next_non_terminal))
+
+    def is_empty(self) -> bool:
+        """ Checks if the grammar generates no sentence """
+        return not self._names or 0 not in self._productive()
+
+    def remove_useless(self) -> None:
+        """
+            Removes the non-terminals that derive no sentence and then the
+            ones that can not be reached from the initial symbol. The initial
+            symbol is always kept.
+        """
+        productive = self._productive()
+        reachable = {0} if self._names else set()
+        to_visit = list(reachable)
+        while to_visit:
+            non_terminal = to_visit.pop()
+            for _, next_non_terminal in self._productions[non_terminal]:
+                if next_non_terminal in productive and \
+                        next_non_terminal not in reachable:
+                    reachable.add(next_non_terminal)
+                    to_visit.append(next_non_terminal)
+
+        # renumber the kept non-terminals, keeping their order
+        kept = [i for i in range(len(self._names)) if i in reachable]
+        new_ids = {old: new for new, old in enumerate(kept)}
+        self._productions = [
+            {Production(terminal, new_ids[next_non_terminal]
+                        if next_non_terminal is not None else None)
+             for terminal, next_non_terminal in self._productions[old]
+             if next_non_terminal is None or next_non_terminal in new_ids}
+            for old in kept]
+        self._names = [self._names[old] for old in kept]
+        self._ids = {name: i for i, name in enumerate(self._names)}
+
+    def _productive(self) -> Set[int]:
+        """ Non-terminals that derive some sentence """
+        # producers[B] are the non-terminals with a production aB
+        producers = [[] for _ in self._names]  # type: List[List[int]]
+        productive = set()  # type: Set[int]
+        for non_terminal, productions in enumerate(self._productions):
+            for _, next_non_terminal in productions:
+                if next_non_terminal is None:
+                    productive.add(non_terminal)
+                else:
+                    producers[next_non_terminal].append(non_terminal)
+
+        to_visit = list(productive)
+        while to_visit:
+            for non_terminal in producers[to_visit.pop()]:
+                if non_terminal not in productive:
+                    productive.add(non_terminal)
+                    to_visit.append(non_terminal)
+        return productive
+
+    def lines(self) -> Iterator[str]:
+        """
+            Yields the text of the grammar, e.g. "B -> aB | bC | a", the
+            initial symbol first and the others sorted by name
+        """
+        order = sorted(
+            range(1, len(self._names)), key=self._names.__getitem__)
+        for non_terminal in ([0] if self._names else []) + order:
+            if not self._productions[non_terminal]:
+                continue
+            name = self._names[non_terminal]
+            productions = sorted(
+                terminal + (self._names[next_non_terminal]
+                            if next_non_terminal is not None else "")
+                for terminal, next_non_terminal in
+                self._productions[non_terminal])
+            yield "{} -> {}".format(name, " | ".join(productions))
+
+    @staticmethod
+    def parse(lines: Iterable[str]) -> 'IndexedGrammar':
+        """
+            Parses the text of a grammar, one line at a time, so a large
+            grammar file can be read without loading it whole. The first
+            non-terminal is the initial symbol. Raises RuntimeError if the
+            grammar is not regular.
+        """
+        grammar = IndexedGrammar()
+        for line in lines:
+            line = line.replace(" ", "").strip()
+            if not line:
+                continue
+            head, arrow, body = line.partition("->")
+            if not arrow or not NON_TERMINAL_PATTERN.match(head):
+                raise RuntimeError("Grammar is not regular")
+            non_terminal = grammar.non_terminal(head)
+            for production in body.split("|"):
+                match = PRODUCTION_PATTERN.match(production)
+                if not match:
+                    raise RuntimeError("Grammar is not regular")
+                terminal, next_name = match.groups()
+                grammar.add_production(
+                    non_terminal, terminal,
+                    grammar.non_terminal(next_name) if next_name else None)
+
+        if not grammar._names:
+            raise RuntimeError("Grammar is not regular")
+        return grammar
+
+    @staticmethod
+    def load(path: str) -> 'IndexedGrammar':
+        """ Reads a grammar from a text file, one non-terminal per line """
+        with open(path, 'r') as grammar_file:
+            return IndexedGrammar.parse(grammar_file)
+
+    @staticmethod
+    def from_regular_grammar(grammar: RegularGrammar) -> 'IndexedGrammar':
+        indexed = IndexedGrammar()
+        productions = grammar.productions()
+        if grammar.initial_symbol():
+            indexed.non_terminal(grammar.initial_symbol())
+        for name in productions:
+            non_terminal = indexed.non_terminal(name)
+            for production in productions[name]:
+                indexed.add_production(
+                    non_terminal, production[0],
+                    indexed.non_terminal(production[1:])
+                    if len(production) > 1 else None)
+        return indexed
+
+    def to_regular_grammar(self) -> RegularGrammar:
+        return RegularGrammar(self.initial_symbol, {
+            name: {
+                terminal + (self._names[next_non_terminal]
+                            if next_non_terminal is not None else "")
+                for terminal, next_non_terminal in self._productions[i]}
+            for i, name in enumerate(self._names) if self._productions[i]})
+
+    @staticmethod
+    def from_nfa(nfa: NFA) -> 'IndexedGrammar':
+        """
+            Returns the grammar of the language of the NFA, in time linear in
+            the number of transitions, see RegularGrammar.from_nfa
+        """
+        if nfa.has_epsilon():
+            nfa = copy.deepcopy(nfa)
+            nfa.remove_epsilon()
+
+        grammar = IndexedGrammar()
+        final_states = nfa.final_states
+        accepts_epsilon = nfa.initial_state in final_states
+        # if the NFA accepts epsilon, the initial symbol is a copy of the
+        # initial state's non-terminal that also derives epsilon
+        initial = grammar.non_terminal(
+            nfa.initial_state + "'" if accepts_epsilon else nfa.initial_state)
+        state = grammar.non_terminal(nfa.initial_state)
+
+        for (state_name, symbol), next_states in \
+                nfa.transition_table.items():
+            non_terminal = grammar.non_terminal(state_name)
+            for next_state in next_states:
+                grammar.add_production(
+                    non_terminal, symbol, grammar.non_terminal(next_state))
+                if next_state in final_states:
+                    grammar.add_production(non_terminal, symbol)
+
+        if accepts_epsilon:
+            grammar._productions[initial] = \
+                grammar._productions[state] | {Production(EPSILON, None)}
+        return grammar
+
+    def to_nfa(self) -> NFA:
+        """
+            Returns an NFA that recognizes the language of the grammar, in
+            time linear in the number of productions. The non-terminals are
+            the states, plus a final state for the productions without a
+            non-terminal.
+        """
+        final_state = "X"
+        while final_state in self._ids:
+            final_state += "'"
+
+        states = set(self._names) | {final_state}
+        alphabet = set()  # type: Set[str]
+        transitions = {}  # type: Dict[Tuple[str, str], Set[str]]
+        final_states = {final_state}
+
+        for non_terminal, productions in enumerate(self._productions):
+            name = self._names[non_terminal]
+            for terminal, next_non_terminal in productions:
+                if terminal == EPSILON:
+                    # only allowed on the initial symbol
+                    if non_terminal == 0:
+                        final_states.add(name)
+                    continue
+                next_state = self._names[next_non_terminal] \
+                    if next_non_terminal is not None else final_state
+                transitions.setdefault((name, terminal), set()).add(
+                    next_state)
+                alphabet.add(terminal)
+
+        return NFA(
+            states, alphabet, transitions, self.initial_symbol, final_states)
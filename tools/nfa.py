@@ -1,10 +1,19 @@
-from typing import Any, Dict, FrozenSet, List, Set, Tuple
-from itertools import combinations
-import json
+from typing import (
+    Any, Dict, FrozenSet, Iterable, Iterator, List, Optional, Set, TextIO,
+    Tuple, Union)
+from itertools import combinations, product
 import copy
+import io
+from tools.stream import JSONStreamReader, write_automaton
+from tools.stats import Stats, phase
+from tools.budget import Budget, BudgetExceeded
 
 
 DEAD_STATE = "qdead"
+EPSILON = "&"
+
+# how the name of a state is built, see NFA._name
+Recipe = Union[str, Tuple[int, ...]]
 
 
 class NFA():
@@ -16,6 +25,27 @@ class NFA():
         function (delta) is represented as a dictionary that maps
         (state, symbol) -> Set[state], it is deterministic if all transitions
         take to only one state.
+
+        Internally, states are interned as integer ids and their names are
+        kept in a side table, only for display and saving. The states an
+        algorithm creates (e.g. the subsets of determinize) get a recipe
+        instead of a name, which is only built (and primed if it clashes
+        with another name) when the name is first needed, and renaming all
+        the states only rewrites the table. The public methods still take
+        and return names.
+
+        Epsilon transitions use the EPSILON symbol, which is never part of
+        the alphabet. The epsilon closures are computed when needed and
+        cached until the epsilon transitions change, and the algorithms that
+        need an automaton without them (e.g. determinize) remove them first.
+
+        A missing transition goes to an implicit dead state. complement only
+        flips a flag on the DFA, after which the strings over its alphabet
+        that end in a non-final state or in the dead state are the accepted
+        ones, so no transitions are added. The complement is made explicit
+        (completed, with the final states flipped) when the automaton is
+        edited, read through its properties or used by an algorithm that
+        needs it.
     """
 
     def __init__(
@@ -25,17 +55,41 @@ class NFA():
             transitions: Dict[Tuple[str, str], Set[str]]=None,
             initial_state: str="",
             final_states: Set[str]=None) -> None:
-        self._states = states if states else set()
+        self._names = {}  # type: Dict[int, str]
+        self._ids = {}  # type: Dict[str, int]
+        # recipes of the names not built yet: a name to prime if it is
+        # taken, or the states whose sorted names are joined (a subset)
+        self._pending = {}  # type: Dict[int, Recipe]
+        # removed states whose names may still be needed by a recipe
+        self._ghosts = set()  # type: Set[int]
+        self._next_id = 0
+
+        intern = self._intern
+        self._states = {intern(state) for state in states or ()}
         self._alphabet = alphabet if alphabet else set()
-        self._transitions = transitions if transitions else {}
-        self._initial_state = initial_state
-        self._final_states = final_states if final_states else set()
+        self._transitions = {
+            (intern(state), symbol): {
+                intern(next_state) for next_state in next_states}
+            for (state, symbol), next_states in (transitions or {}).items()
+        }  # type: Dict[Tuple[int, str], Set[int]]
+        self._initial_state = \
+            intern(initial_state) if initial_state else None
+        self._final_states = {intern(state) for state in final_states or ()}
+        self._closures = {}  # type: Dict[int, FrozenSet[int]]
+        self._complemented = False
 
     @property
     def states(self) -> List[str]:
-        """ Returns an ordered list of states """
-        return [self._initial_state] + \
-            sorted(self._states - {self._initial_state})
+        """
+            Returns an ordered list of states, built on every access: read
+            it once out of loops
+        """
+        self._materialize()
+        self._name_all()
+        names = self._names
+        return [self.initial_state] + sorted(
+            names[state] for state in self._states
+            if state != self._initial_state)
 
     @property
     def alphabet(self) -> List[str]:
@@ -44,38 +98,83 @@ class NFA():
 
     @property
     def transition_table(self) -> Dict[Tuple[str, str], Set[str]]:
-        """ Returns the transition function, a dictionary """
-        return self._transitions
+        """
+            Returns a copy of the transition function, a dictionary built
+            on every access: read it once out of loops, or see transition
+            to look up only a few transitions
+        """
+        self._materialize()
+        self._name_all()
+        names = self._names
+        return {
+            (names[state], symbol): {
+                names[next_state] for next_state in next_states}
+            for (state, symbol), next_states in self._transitions.items()}
 
     @property
     def initial_state(self) -> str:
         """ Returns the initial state """
-        return self._initial_state
+        if self._initial_state is None:
+            return ""
+        return self._name(self._initial_state)
 
     @property
     def final_states(self) -> Set[str]:
-        """ Returns the set of final states """
-        return self._final_states
+        """
+            Returns a copy of the set of final states, built on every
+            access: read it once out of loops, or see is_final
+        """
+        self._materialize()
+        return {self._name(state) for state in self._final_states}
+
+    def transition(self, state: str, symbol: str) -> Set[str]:
+        """ Returns the states reached from a state by a symbol """
+        self._materialize()
+        return {
+            self._name(next_state) for next_state in
+            self._transitions.get((self._id(state), symbol), ())}
+
+    def is_final(self, state: str) -> bool:
+        """ Checks if a state is final """
+        self._materialize()
+        return self._id(state) in self._final_states
+
+    def has_state(self, state: str) -> bool:
+        """ Checks if a state exists """
+        return self._id(state) in self._states
+
+    def has_symbol(self, symbol: str) -> bool:
+        """ Checks if a symbol is in the alphabet """
+        return symbol in self._alphabet
 
     def add_state(self, state: str) -> None:
         """ Adds a state """
-        if not self._initial_state:
-            self._initial_state = state
-        self._states.add(state)
+        state_id = self._intern(state)
+        if self._initial_state is None:
+            self._initial_state = state_id
+        self._states.add(state_id)
 
     def remove_state(self, state: str) -> None:
         """ Removes a state """
+        self._materialize()
+        state_id = self._id(state)
+        if state_id is not None:
+            self._remove_state(state_id)
+
+    def _remove_state(self, state: int) -> None:
         # may not remove initial state
-        if state != self._initial_state:
+        if state != self._initial_state and state in self._states:
             self._states.discard(state)
             self._final_states.discard(state)
+            self._closures.clear()
+            self._forget(state)
 
-            for symbol in self._alphabet:
+            for symbol in self._alphabet | {EPSILON}:
                 # remove useless transitions that come from the removed state
                 if (state, symbol) in self._transitions:
                     del self._transitions[state, symbol]
 
-            empty_transitions = set()  # type Set[Tuple[str, str]]
+            empty_transitions = set()  # type Set[Tuple[int, str]]
             for actual_state, next_state in self._transitions.items():
                 # remove transitions that go to the removed state
                 next_state.discard(state)
@@ -87,18 +186,23 @@ class NFA():
 
     def toggle_final_state(self, state: str) -> None:
         """ Toggle a state to be final or not """
-        if state in self._states:
-            if state in self._final_states:
-                self._final_states.remove(state)
+        self._materialize()
+        state_id = self._id(state)
+        if state_id in self._states:
+            if state_id in self._final_states:
+                self._final_states.remove(state_id)
             else:
-                self._final_states.add(state)
+                self._final_states.add(state_id)
 
     def add_symbol(self, symbol: str) -> None:
-        """ Adds a symbol """
-        self._alphabet.add(symbol)
+        """ Adds a symbol, epsilon is not a symbol """
+        self._materialize()
+        if symbol != EPSILON:
+            self._alphabet.add(symbol)
 
     def remove_symbol(self, symbol: str) -> None:
         """ Removes a symbol """
+        self._materialize()
         self._alphabet.discard(symbol)
         for state in self._states:
             # remove transitions by the removed symbol
@@ -108,80 +212,261 @@ class NFA():
     def set_transition(
             self, state: str, symbol: str, next_states: Set[str]) -> None:
         """ Set the transition function for a given state and symbol """
+        self._materialize()
+        ids = {name: self._id(name) for name in next_states | {state}}
+        unknown = [
+            name for name, state_id in ids.items()
+            if state_id not in self._states]
+        if unknown:
+            raise KeyError(
+                "State(s) {} do not exist".format(", ".join(sorted(unknown))))
+
+        if symbol == EPSILON:
+            self._closures.clear()
         if not next_states:
             # assert transition won't exist
-            self._transitions.pop((state, symbol), set())
-        elif next_states <= self._states:
-            self._transitions[state, symbol] = next_states
+            self._transitions.pop((ids[state], symbol), set())
         else:
-            states = ", ".join(next_states - self._states)
-            raise KeyError("State(s) {} do not exist".format(states))
+            self._transitions[ids[state], symbol] = {
+                ids[name] for name in next_states}
 
     def accept(self, string: str) -> bool:
         """
             Checks if a given string is member of the language recognized by
             the NFA. Using non-deterministic transitions.
         """
-        current_state = {self._initial_state}
+        if self._complemented:
+            state = self._initial_state
+            for position, symbol in enumerate(string):
+                next_states = self._transitions.get((state, symbol))
+                if not next_states:
+                    # the dead state accepts the rest if it is in the alphabet
+                    return set(string[position:]) <= self._alphabet
+                state = next(iter(next_states))
+            return state not in self._final_states
+
+        current_state = set(self._epsilon_closure(self._initial_state))
 
         for symbol in string:
-            next_state = set()  # type Set[str]
+            next_state = set()  # type Set[int]
             for state in current_state:
-                next_state.update(
-                    self._transitions.get((state, symbol), set()))
+                for reached in self._transitions.get((state, symbol), ()):
+                    next_state.update(self._epsilon_closure(reached))
             current_state = next_state
 
         return bool(current_state.intersection(self._final_states))
 
-    def minimize(self) -> None:
+    def has_epsilon(self) -> bool:
+        """ Checks if there are epsilon transitions """
+        return any(symbol == EPSILON for _, symbol in self._transitions)
+
+    def epsilon_closure(self, state: str) -> FrozenSet[str]:
+        """ States reachable from the given one by epsilon transitions """
+        state_id = self._id(state)
+        if state_id is None:
+            return frozenset((state,))
+        return frozenset(
+            self._name(reached) for reached in
+            self._epsilon_closure(state_id))
+
+    def _epsilon_closure(self, state: Optional[int]) -> FrozenSet[int]:
+        closure = self._closures.get(state)
+        if closure is None:
+            found = {state}
+            to_visit = [state]
+            while to_visit:
+                for next_state in self._transitions.get(
+                        (to_visit.pop(), EPSILON), ()):
+                    if next_state not in found:
+                        found.add(next_state)
+                        to_visit.append(next_state)
+            closure = frozenset(found)
+            self._closures[state] = closure
+        return closure
+
+    def remove_epsilon(self, stats: Stats=None) -> None:
+        """
+            Removes the epsilon transitions, a state gets the transitions
+            and finality of the states in its epsilon closure
+        """
+        if not self.has_epsilon():
+            return
+
+        with phase(stats, "remove_epsilon"):
+            transitions = {}  # type: Dict[Tuple[int, str], Set[int]]
+            for state in self._states:
+                closure = self._epsilon_closure(state)
+                if closure & self._final_states:
+                    self._final_states.add(state)
+                for symbol in self._alphabet:
+                    next_states = set()  # type: Set[int]
+                    for closure_state in closure:
+                        next_states.update(self._transitions.get(
+                            (closure_state, symbol), ()))
+                    if next_states:
+                        transitions[state, symbol] = next_states
+            self._transitions = transitions
+            self._closures.clear()
+
+        self.remove_unreachable(stats)
+
+    def minimize(
+            self, stats: Stats=None, budget: Budget=None,
+            engine: str="table") -> None:
         """
             Transforms the automaton in the correspondent minimal automaton,
-            that is, without dead, unreachable and equivalent states
+            that is, without dead, unreachable and equivalent states.
+
+            The engine is either "table", which merges the equivalent states
+            of a DFA (it raises RuntimeError for a NFA), or "brzozowski",
+            which takes a NFA too and determinizes its reverse twice. Its
+            states are new, each named after the states of the automaton it
+            comes from. If a budget is given and it is exceeded,
+            BudgetExceeded is raised and the automaton is left unchanged (but
+            for "brzozowski", without epsilon transitions and with its
+            complement, if any, made explicit).
         """
+        if engine == "brzozowski":
+            self._materialize()
+            self.remove_epsilon(stats)
+            with phase(stats, "minimize"):
+                explored = self._minimize_brzozowski(budget)
+            if stats is not None:
+                stats.count("subsets_explored", explored)
+                stats.count("states_created", len(self._states))
+            return
+        elif engine != "table":
+            raise ValueError("Unknown engine: {}".format(engine))
+
         if not self.is_deterministic():
             raise RuntimeError("Automata is non-deterministic")
 
-        self.remove_unreachable()
-        self.remove_dead()
-        self.merge_equivalent()
-
-    def remove_unreachable(self) -> None:
+        # the merge may exceed the budget, so the states are only removed
+        # from a copy, which replaces the automaton once it is minimal
+        dfa = copy.deepcopy(self) if budget is not None else self
+        dfa._materialize()
+        with phase(stats, "minimize"):
+            dfa.remove_unreachable(stats)
+            dfa.remove_dead(stats)
+            dfa.merge_equivalent(stats, budget)
+        if dfa is not self:
+            vars(self).update(vars(dfa))
+
+    def remove_unreachable(self, stats: Stats=None) -> None:
         """ Removes the states that the automaton will never be in """
-        reachable = set()  # type: Set[str]
-        new_reachable = {self._initial_state}
-        while not new_reachable <= reachable:
-            reachable |= new_reachable
-            new_reachable_copy = new_reachable.copy()
-            new_reachable = set()
-            for state in new_reachable_copy:
-                for symbol in self._alphabet:
-                    new_reachable.update(
-                        self._transitions.get((state, symbol), set()))
+        with phase(stats, "remove_unreachable"):
+            reachable, visited = self._reachable_states()
+            unreachable = self._states - reachable
+            for unreachable_state in unreachable:
+                self._remove_state(unreachable_state)
 
-        for unreachable_state in self._states - reachable:
-            self.remove_state(unreachable_state)
+        if stats is not None:
+            stats.count("transitions_visited", visited)
+            stats.count("states_removed", len(unreachable))
 
-    def remove_dead(self) -> None:
+    def remove_dead(self, stats: Stats=None) -> None:
         """ Removes states that never reach a final state """
-        alive = set()  # type: Set[str]
-        new_alive = self._final_states.copy()
-        while not new_alive <= alive:
-            alive |= new_alive
-            new_alive = set()
-            for (state, _), next_states in self._transitions.items():
-                if any(next_state in alive for next_state in next_states):
-                    new_alive.add(state)
-
-        for dead_state in self._states - alive:
-            self.remove_state(dead_state)
-
-    def merge_equivalent(self) -> None:
-        """ Merges equivalent states """
+        self._materialize()
+        with phase(stats, "remove_dead"):
+            alive, visited = self._alive_states()
+            dead = self._states - alive
+            for dead_state in dead:
+                self._remove_state(dead_state)
+
+        if stats is not None:
+            stats.count("transitions_visited", visited)
+            stats.count("states_removed", len(dead))
+
+    def _reachable_states(self) -> Tuple[Set[int], int]:
+        """
+            Returns the states reachable from the initial state and the
+            number of transitions visited to find them
+        """
+        visited = 0
+        reachable = {self._initial_state}
+        to_visit = [self._initial_state]
+        while to_visit:
+            state = to_visit.pop()
+            for symbol in self._alphabet | {EPSILON}:
+                next_states = self._transitions.get((state, symbol))
+                if next_states:
+                    visited += 1
+                    for next_state in next_states - reachable:
+                        reachable.add(next_state)
+                        to_visit.append(next_state)
+        return reachable, visited
+
+    def _alive_states(self) -> Tuple[Set[int], int]:
+        """
+            Returns the states that reach a final state and the number of
+            transitions visited to find them
+        """
+        predecessors = {}  # type: Dict[int, Set[int]]
+        for (state, _), next_states in self._transitions.items():
+            for next_state in next_states:
+                predecessors.setdefault(next_state, set()).add(state)
+
+        alive = self._final_states & self._states
+        to_visit = list(alive)
+        while to_visit:
+            state = to_visit.pop()
+            for previous_state in predecessors.get(state, set()) - alive:
+                alive.add(previous_state)
+                to_visit.append(previous_state)
+        return alive, len(self._transitions)
+
+    def merge_equivalent(
+            self, stats: Stats=None, budget: Budget=None) -> None:
+        """
+            Merges equivalent states. If a budget is given and it is
+            exceeded, BudgetExceeded is raised before any state is merged.
+        """
         if not self.is_deterministic():
             raise RuntimeError("Automata is non-deterministic")
 
+        self._materialize()
+        with phase(stats, "merge_equivalent"):
+            rounds = self._merge_equivalent(budget)
+
+        if stats is not None:
+            stats.count("refinement_rounds", rounds)
+
+    def _minimize_brzozowski(self, budget: Budget=None) -> int:
+        """
+            Replaces the automaton, without epsilon transitions, by the DFA
+            of the reverse of the DFA of its reverse, which is minimal.
+            Returns the number of subsets explored.
+        """
+        subsets, transitions, final_states = _reverse_subsets(
+            self._transitions, self._initial_state,
+            self._final_states & self._states, budget)
+        classes, class_transitions, class_final_states = _reverse_subsets(
+            {key: {next_state} for key, next_state in transitions.items()},
+            0, final_states, budget)
+
+        old_states = self._states | {self._initial_state} - {None}
+        new_states = []  # type: List[int]
+        for members in classes:
+            states = set().union(*(subsets[i] for i in members))
+            new_states.append(self._new_id(
+                tuple(states) if states else "qinitial"))
+        self._states = set(new_states)
+        self._transitions = {
+            (new_states[i], symbol): {new_states[j]}
+            for (i, symbol), j in class_transitions.items()}
+        self._initial_state = new_states[0]
+        self._final_states = {new_states[i] for i in class_final_states}
+        self._closures.clear()
+        for state in old_states:
+            self._forget(state)
+        return len(subsets) + len(classes)
+
+    def _merge_equivalent(self, budget: Budget=None) -> int:
+        """ Merges equivalent states, returns the number of rounds """
+        rounds = 0
+
         # pairs of undistinguishable states
-        undistinguishable = set()  # type: Set[FrozenSet[str]]
+        undistinguishable = set()  # type: Set[FrozenSet[int]]
 
         # initially, you can't distinguish final and non-final states
         for pair in combinations(self._states - self._final_states, 2):
@@ -191,9 +476,12 @@ class NFA():
 
         # find new distinguishable states
         while True:
+            rounds += 1
             new_distinguishable_found = False
             undistinguishable_copy = undistinguishable.copy()
             for state_a, state_b in undistinguishable_copy:
+                if budget is not None:
+                    budget.check(len(self._states), len(self._transitions))
                 if not self._are_undistinguishable(
                         state_a, state_b, undistinguishable_copy):
                     undistinguishable.remove(frozenset((state_a, state_b)))
@@ -204,25 +492,27 @@ class NFA():
         for state_a, state_b in undistinguishable:
             self._merge_states(state_a, state_b)
 
+        return rounds
+
     def _are_undistinguishable(
-            self, state_a: str, state_b: str,
-            undistinguishable: Set[FrozenSet[str]]) -> bool:
+            self, state_a: int, state_b: int,
+            undistinguishable: Set[FrozenSet[int]]) -> bool:
         """
             State a and b are distinguishable if they go to distinguishable
-            states for some input symbol.
+            states for some input symbol (None is the dead state).
         """
         for symbol in self._alphabet:
-            transition_a = \
-                list(self._transitions.get((state_a, symbol), {""}))[0]
-            transition_b = \
-                list(self._transitions.get((state_b, symbol), {""}))[0]
+            transition_a = next(iter(
+                self._transitions.get((state_a, symbol), (None,))))
+            transition_b = next(iter(
+                self._transitions.get((state_b, symbol), (None,))))
             if transition_a != transition_b and \
                     frozenset((transition_a, transition_b)) not in \
                     undistinguishable:
                 return False
         return True
 
-    def _merge_states(self, state_a: str, state_b: str):
+    def _merge_states(self, state_a: int, state_b: int):
         """ Merges state b into a, making them one state """
         state_to_be_removed = state_b
         state_to_be_kept = state_a
@@ -235,52 +525,235 @@ class NFA():
         for actual_state, next_state in self._transitions.items():
             if next_state == {state_to_be_removed}:
                 self._transitions[actual_state] = {state_to_be_kept}
-        self.remove_state(state_to_be_removed)
+        self._remove_state(state_to_be_removed)
 
-    def determinize(self) -> None:
+    def reduce(
+            self, backward: bool=True, stats: Stats=None,
+            budget: Budget=None) -> None:
+        """
+            Merges bisimilar states, without determinizing. Forward bisimilar
+            states (both final or not, and every transition of one matched
+            by a transition of the other by the same symbol to a bisimilar
+            state) accept the same strings, backward bisimilar ones (the
+            same with the initial state and the incoming transitions) are
+            reached by the same strings. The two quotients are taken in
+            turns until neither merges a state, so the language is kept with
+            fewer states to determinize or to search in a product. Merging
+            backward bisimilar states may make a DFA non-deterministic.
+
+            The budget is checked every refinement round, for its time limit
+            and cancel token only, since no state is added. If it is
+            exceeded, BudgetExceeded is raised and the states merged by the
+            previous quotients stay merged, the language is the same.
+        """
+        self._materialize()
+        with phase(stats, "reduce"):
+            directions = 2 if backward else 1
+            forward = True
+            idle = 0  # quotients in a row that merged nothing
+            rounds = 0
+            merged = 0
+            while idle < directions:
+                blocks, refinements = self._bisimulation(forward, budget)
+                rounds += refinements
+                removed = self._quotient(blocks)
+                merged += removed
+                idle = 0 if removed else idle + 1
+                forward = forward != backward
+
+        if stats is not None:
+            stats.count("refinement_rounds", rounds)
+            stats.count("states_merged", merged)
+
+    def _bisimulation(
+            self, forward: bool,
+            budget: Budget=None) -> Tuple[Dict[int, int], int]:
+        """
+            Coarsest forward (or backward) bisimulation, as the block of
+            each state, and the number of refinement rounds.
+
+            Blocks are split by the signatures of their states, the (symbol,
+            block) pairs of their transitions (reversed if backward). Only
+            the states with a transition to a state that changed block are
+            looked at again, and the largest part of a split block keeps its
+            number, so a state changes block at most log n times.
+        """
+        edges = {
+            state: [] for state in self._states
+        }  # type: Dict[int, List[Tuple[str, int]]]
+        dependents = {
+            state: [] for state in self._states}  # type: Dict[int, List[int]]
+        for (state, symbol), next_states in self._transitions.items():
+            for next_state in next_states:
+                source, target = (state, next_state) if forward else \
+                    (next_state, state)
+                edges[source].append((symbol, target))
+                dependents[target].append(source)
+
+        marked = self._final_states if forward else {self._initial_state}
+        blocks = {state: int(state in marked) for state in self._states}
+        members = [set(), set()]  # type: List[Set[int]]
+        for state, block in blocks.items():
+            members[block].add(state)
+        # signature shared by the states of each block that are not dirty
+        signatures = [None, None]  # type: List[Optional[FrozenSet[Any]]]
+
+        dirty = set(self._states)
+        rounds = 0
+        while dirty:
+            if budget is not None:
+                budget.check(0, 0)
+            rounds += 1
+            groups = {}  # type: Dict[int, Dict[FrozenSet[Any], List[int]]]
+            for state in dirty:
+                signature = frozenset(
+                    (symbol, blocks[target])
+                    for symbol, target in edges[state])
+                groups.setdefault(blocks[state], {}).setdefault(
+                    signature, []).append(state)
+
+            dirty = set()
+            for block, by_signature in groups.items():
+                checked = [
+                    state for states in by_signature.values()
+                    for state in states]
+                clean = len(members[block]) - len(checked)
+                if clean:
+                    by_signature.setdefault(signatures[block], [])
+                sizes = {
+                    signature: len(states) + (
+                        clean if signature == signatures[block] else 0)
+                    for signature, states in by_signature.items()}
+                keep = max(sizes, key=sizes.__getitem__)
+                if clean and keep != signatures[block]:
+                    by_signature[signatures[block]].extend(
+                        members[block].difference(checked))
+
+                for signature, states in by_signature.items():
+                    if signature == keep or not states:
+                        continue
+                    new_block = len(members)
+                    members.append(set(states))
+                    signatures.append(signature)
+                    members[block].difference_update(states)
+                    for state in states:
+                        blocks[state] = new_block
+                        dirty.update(dependents[state])
+                signatures[block] = keep
+
+        return blocks, rounds
+
+    def _quotient(self, blocks: Dict[int, int]) -> int:
+        """
+            Merges the states of each block into one of them (the initial
+            state if it is there), returns the number of states removed
+        """
+        representatives = {}  # type: Dict[int, int]
+        if self._initial_state is not None:
+            representatives[blocks[self._initial_state]] = \
+                self._initial_state
+        for state in sorted(self._states):
+            representatives.setdefault(blocks[state], state)
+        if len(representatives) == len(self._states):
+            return 0
+
+        merged_into = {
+            state: representatives[block] for state, block in blocks.items()}
+        transitions = {}  # type: Dict[Tuple[int, str], Set[int]]
+        for (state, symbol), next_states in self._transitions.items():
+            transitions.setdefault(
+                (merged_into[state], symbol), set()).update(
+                    merged_into[next_state] for next_state in next_states)
+        self._transitions = transitions
+        self._final_states = {
+            merged_into[state] for state in self._final_states
+            if state in merged_into}
+        kept = set(representatives.values())
+        for state in self._states - kept:
+            self._forget(state)
+        removed = len(self._states) - len(kept)
+        self._states = kept
+        self._closures.clear()
+        return removed
+
+    def determinize(self, stats: Stats=None, budget: Budget=None) -> None:
         """
             Given the actual NFA, determinizes it, appending the new
             transitions and states to the actual ones of the NFA.
-        """
-        original_transitions = self._transitions.copy()
-
-        # create necessary states
-        for next_state in original_transitions.values():
-            if len(next_state) > 1:
-                self._determinize_state(next_state)
-
-        # rewrite transitions
-        self._transitions = {
-            actual: {"".join(sorted(next_state))}
-            for actual, next_state in self._transitions.items()
-        }
-
-        self.remove_unreachable()
 
-    def _determinize_state(self, states_set: Set[str]) -> None:
+            If a budget is given and it is exceeded, BudgetExceeded is raised
+            and the automaton is left unchanged (but without epsilon
+            transitions).
         """
-            For a given set of states, verify whether they pertains to the
-            actual states of the FA. In negative case, add it and insert
-            the transitions properly
+        self.remove_epsilon(stats)
+        with phase(stats, "determinize"):
+            explored, names = self._determinize_states(budget)
+            # rewrite transitions
+            self._transitions = {
+                actual: {names[frozenset(next_state)]}
+                if len(next_state) > 1 else next_state
+                for actual, next_state in self._transitions.items()
+            }
+
+        if stats is not None:
+            stats.count("subsets_explored", explored)
+            stats.count("states_created", len(names))
+            stats.peak("states", len(self._states))
+
+        self.remove_unreachable(stats)
+
+    def _determinize_states(self, budget: Budget=None) \
+            -> Tuple[int, Dict[FrozenSet[int], int]]:
         """
-        name = "".join(sorted(states_set))
-        if name and name not in self._states:
-            self.add_state(name)
-            if states_set.intersection(self._final_states):
-                self._final_states.add(name)
-            for symbol in self._alphabet:
-                reachable = self._find_reachable(states_set, symbol)
-                if reachable:
-                    self._transitions[name, symbol] = reachable
-                    self._determinize_state(reachable)
+            Creates a state for every set of states reachable from a
+            non-deterministic transition, inserting its transitions properly.
+            Returns the number of sets explored and the state created for
+            each set, named by joining the names of its states.
+        """
+        explored = 0
+        names = {}  # type: Dict[FrozenSet[int], int]
+        # sets of states that may not pertain to the actual states of the FA
+        pending = [
+            next_states for next_states in self._transitions.values()
+            if len(next_states) > 1]
+        try:
+            while pending:
+                if budget is not None:
+                    budget.check(len(self._states), len(self._transitions))
+                states_set = pending.pop()
+                explored += 1
+                key = frozenset(states_set)
+                if len(key) > 1 and key not in names:
+                    name = self._new_id(tuple(key))
+                    names[key] = name
+                    self._states.add(name)
+                    if states_set.intersection(self._final_states):
+                        self._final_states.add(name)
+                    for symbol in self._alphabet:
+                        reachable = self._find_reachable(states_set, symbol)
+                        if reachable:
+                            self._transitions[name, symbol] = reachable
+                            pending.append(reachable)
+        except BudgetExceeded as error:
+            # roll back, the created states were only appended
+            for name in names.values():
+                self._states.discard(name)
+                self._final_states.discard(name)
+                del self._pending[name]
+                for symbol in self._alphabet:
+                    self._transitions.pop((name, symbol), None)
+            error.stats["subsets_explored"] = explored
+            error.stats["states_created"] = len(names)
+            raise
+        return explored, names
 
-    def _find_reachable(self, states: Set[str], symbol: str) -> Set[str]:
+    def _find_reachable(self, states: Set[int], symbol: str) -> Set[int]:
         """
             Given a set of states, applies a depth search algorithm
             to find the reachable states of them through transitions of the
             given symbol
         """
-        found = set()  # type: Set[str]
+        found = set()  # type: Set[int]
         for state in states:
             if (state, symbol) in self._transitions:
                 found.update(self._transitions[state, symbol])
@@ -289,158 +762,652 @@ class NFA():
     def is_deterministic(self) -> bool:
         """ Checks if the automaton is deterministic """
         return all(
-            len(transition) == 1 for transition in self._transitions.values())
+            len(next_states) == 1 and symbol != EPSILON
+            for (_, symbol), next_states in self._transitions.items())
 
-    def is_empty(self) -> bool:
+    def is_empty(self, stats: Stats=None) -> bool:
         """ Checks if the language defined by the automaton is empty """
-        nfa = copy.deepcopy(self)
-        nfa.remove_unreachable()
-        return len(nfa.final_states) == 0
-
-    def is_finite(self) -> bool:
+        with phase(stats, "is_empty"):
+            reachable, _ = self._reachable_states()
+            if self._complemented:
+                # empty if no string leaves the final states, dead included
+                return reachable <= self._final_states and all(
+                    (state, symbol) in self._transitions
+                    for state in reachable for symbol in self._alphabet)
+            return not reachable & self._final_states
+
+    def is_finite(self, stats: Stats=None) -> bool:
         """ Checks if the language defined by the automaton is finite """
-        nfa = copy.deepcopy(self)
-        nfa.remove_dead()
-        return not nfa._has_recursion(self._initial_state, set())
-
-    def _has_recursion(self, to_visit: str, visited: Set[str]) -> bool:
+        if self.has_epsilon() or self._complemented:
+            # epsilon cycles do not make the language infinite
+            automaton = copy.deepcopy(self)
+            automaton._materialize()
+            automaton.remove_epsilon(stats)
+            return automaton.is_finite(stats)
+
+        with phase(stats, "is_finite"):
+            useful = self._reachable_states()[0] & self._alive_states()[0]
+            return not self._has_recursion(useful)
+
+    def _has_recursion(self, states: Set[int]) -> bool:
         """
-            Checks if the automata has recursive states, using a depth
-            first search approach.
+            Checks if there is a cycle through the given states reachable
+            from the initial state, using an iterative depth first search.
         """
-        if to_visit in visited:
-                return True
+        if self._initial_state not in states:
+            return False
 
-        visited.add(to_visit)
-        reachable = set()  # type: Set[str]
+        def successors(state: int) -> Iterator[int]:
+            for symbol in self._alphabet:
+                for next_state in self._transitions.get((state, symbol), ()):
+                    if next_state in states:
+                        yield next_state
+
+        finished = set()  # type: Set[int]
+        in_path = {self._initial_state}
+        path = [(self._initial_state, successors(self._initial_state))]
+        while path:
+            state, next_states = path[-1]
+            for next_state in next_states:
+                if next_state in in_path:
+                    return True
+                if next_state not in finished:
+                    in_path.add(next_state)
+                    path.append((next_state, successors(next_state)))
+                    break
+            else:
+                path.pop()
+                in_path.remove(state)
+                finished.add(state)
+        return False
 
-        # Find the reachable through all symbols
-        for symbol in self._alphabet:
-            reachable.update(self._find_reachable({to_visit}, symbol))
+    def count_words(self, n: int) -> int:
+        """
+            Returns the number of strings of length <= n in the language, by
+            counting the paths of the trimmed DFA length by length
+        """
+        successors, final_states = self._trimmed_dfa()
+        paths = {self._initial_state: 1}  # paths of the actual length
+        total = 0
+        for length in range(n + 1):
+            total += sum(
+                count for state, count in paths.items()
+                if state in final_states)
+            if length == n:
+                break
+            next_paths = {}  # type: Dict[Optional[int], int]
+            for state, count in paths.items():
+                for _, next_state in successors[state]:
+                    next_paths[next_state] = \
+                        next_paths.get(next_state, 0) + count
+            if not next_paths:
+                break
+            paths = next_paths
+        return total
 
-        for state in reachable:
-            if self._has_recursion(state, copy.deepcopy(visited)):
-                return True
+    def words(self, max_length: Optional[int]=None) -> Iterator[str]:
+        """
+            Lazily yields the strings of the language in shortlex order
+            (shorter first, then alphabetically), up to max_length if given.
+            Only the prefixes that can still be completed to a string of the
+            length being listed are explored.
+        """
+        successors, final_states = self._trimmed_dfa()
+        # completes[k]: states that reach a final state in exactly k steps
+        completes = [final_states]  # type: List[Set[int]]
+        length = 0
+        while max_length is None or length <= max_length:
+            while len(completes) <= length:
+                completes.append({
+                    state for state, edges in successors.items()
+                    if any(next_state in completes[-1]
+                           for _, next_state in edges)})
+            if not completes[length]:
+                return  # nothing is longer, the language is finite
+            if self._initial_state in completes[length]:
+                yield from self._words_of_length(
+                    successors, completes, length)
+            length += 1
+
+    def _words_of_length(
+            self, successors: Dict[Optional[int], List[Tuple[str, int]]],
+            completes: List[Set[int]], length: int) -> Iterator[str]:
+        prefix = []  # type: List[str]
+        path = [iter(successors[self._initial_state])]
+        while path:
+            if len(path) > length:
+                yield "".join(prefix)
+                path.pop()
+                if prefix:
+                    prefix.pop()
+                continue
+            for symbol, next_state in path[-1]:
+                if next_state in completes[length - len(path)]:
+                    prefix.append(symbol)
+                    path.append(iter(successors[next_state]))
+                    break
+            else:
+                path.pop()
+                if prefix:
+                    prefix.pop()
 
-        return False
+    def _trimmed_dfa(self) \
+            -> Tuple[Dict[Optional[int], List[Tuple[str, int]]], Set[int]]:
+        """
+            Determinizes and trims (see remove_unreachable and remove_dead) a
+            copy of the automaton. Returns its (symbol, next state) edges by
+            state, sorted by symbol, and its final states.
+        """
+        dfa = copy.deepcopy(self)
+        if not dfa.is_deterministic():
+            dfa.determinize()
+        dfa.remove_unreachable()
+        dfa.remove_dead()
+        successors = {
+            state: [] for state in dfa._states | {dfa._initial_state}
+        }  # type: Dict[Optional[int], List[Tuple[str, int]]]
+        for (state, symbol), next_states in sorted(dfa._transitions.items()):
+            successors[state].append((symbol, next(iter(next_states))))
+        return successors, dfa._final_states
 
     def beautify_qn(self, begin_at: int=0) -> None:
         """ Transforms all states to q1,q2,...,qn """
-        beautiful_states = {self._initial_state: "q" + str(begin_at)}
-
-        beautiful_states.update({
-            state: "q" + str(begin_at + number + 1) for number, state in
-            enumerate(sorted(self._states - {self._initial_state}))})
-
-        self._beautify(beautiful_states)
+        self._relabel(
+            "q" + str(begin_at + number)
+            for number in range(len(self._states) + 1))
 
     def beautify_abc(self) -> None:
         """ Transforms all states to S,A,B,...,Z """
         if len(self._states) > 26:
             raise RuntimeError("Too many states")
 
-        beautiful_states = {self._initial_state: "S"}
-        number = 0
-        for state in sorted(self._states - {self._initial_state}):
-            beautiful_states[state] = chr(ord('A') + number)
-            if number == 17:  # skip "S", the initial state
-                number += 1
-            number += 1
-        self._beautify(beautiful_states)
-
-    def _beautify(self, beautiful_states: Dict[str, str]) -> None:
-        self._initial_state = beautiful_states[self._initial_state]
-        self._states = set(beautiful_states.values())
-
-        self._transitions = {
-            (beautiful_states[actual_state], symbol):
-            {beautiful_states[state] for state in value}
-            for (actual_state, symbol), value in self._transitions.items()
-        }
-
-        self._final_states = {
-            beautiful_states[state] for state in self._final_states
-        }
+        self._relabel(
+            "S" + "ABCDEFGHIJKLMNOPQRTUVWXYZ")  # skip "S", the initial state
 
-    def union(self, automaton: 'NFA') -> None:
+    def _relabel(self, new_names: Iterable[str]) -> None:
         """
-            Makes the union of two automata, without epsilon transitions,
-            and saves it on the actual object.
+            Gives the new names to the initial state and then to the other
+            states in the order of their actual names. Only the name table
+            is rewritten, the transitions are left as they are.
         """
-        self._alphabet.update(automaton._alphabet)
-        self._complete()
-        self.beautify_qn()
-
-        automaton._alphabet.update(self._alphabet)
-        automaton._complete()
-        automaton.beautify_qn(len(self._states))
-
-        new_state = "qinitial"
-        self._states.add(new_state)
-
-        # Merge states
-        self._states.update(automaton._states)
-        self._final_states.update(automaton._final_states)
-        self._transitions.update(automaton._transitions)
-        if any(
-                initial_state in self._final_states
-                for initial_state in
-                {self._initial_state, automaton._initial_state}):
+        self._name_all()
+        order = sorted(
+            self._states - {self._initial_state},
+            key=self._names.__getitem__)
+        if self._initial_state is not None:
+            order.insert(0, self._initial_state)
+        self._names = dict(zip(order, new_names))
+        self._ids = {name: state for state, name in self._names.items()}
+
+    def union(self, automaton: 'NFA', stats: Stats=None) -> None:
+        """
+            Makes the union of two automata and saves it on the actual
+            object: a new initial state with epsilon transitions to both
+            initial states. The given automaton is left unchanged.
+        """
+        with phase(stats, "union"):
+            self._materialize()
+            names = self._add_apart(automaton)
+            new_state = self._new_id("qinitial")
+            self._states.add(new_state)
+            self._transitions[new_state, EPSILON] = {
+                state for state in (
+                    self._initial_state, names.get(automaton._initial_state))
+                if state is not None}
+            self._initial_state = new_state
+            self._closures.clear()
+
+        if stats is not None:
+            stats.peak("states", len(self._states))
+
+    def concatenation(self, automaton: 'NFA', stats: Stats=None) -> None:
+        """
+            Makes the concatenation of the actual automaton with the given
+            one (left unchanged) and saves it on the actual object
+        """
+        with phase(stats, "concatenation"):
+            self._materialize()
+            final_states = set(self._final_states)
+            names = self._add_apart(automaton)
+            self._final_states = {
+                names[state] for state in automaton._final_states}
+            if automaton._initial_state is not None:
+                for state in final_states:
+                    self._transitions.setdefault(
+                        (state, EPSILON), set()).add(
+                            names[automaton._initial_state])
+            self._closures.clear()
+
+        if stats is not None:
+            stats.peak("states", len(self._states))
+
+    def star(self, stats: Stats=None) -> None:
+        """ Makes the Kleene star of the automaton """
+        self._materialize()
+        with phase(stats, "star"):
+            new_state = self._new_id("qinitial")
+            self._states.add(new_state)
             self._final_states.add(new_state)
-
-        # Creates transitions of the new initial state
-        for symbol in self._alphabet:
-            self.set_transition(
-                new_state, symbol,
-                self._transitions.get(
-                    (self._initial_state, symbol), set()) |
-                automaton.transition_table.get(
-                    (automaton._initial_state, symbol), set()))
-
-        self._initial_state = new_state
-
-    def complement(self) -> None:
+            if self._initial_state is not None:
+                for state in self._final_states:
+                    self._transitions.setdefault(
+                        (state, EPSILON), set()).add(self._initial_state)
+            self._initial_state = new_state
+            self._closures.clear()
+
+    def reverse(self, stats: Stats=None) -> None:
+        """
+            Makes the automaton of the reversed strings: the transitions are
+            reversed, the initial state becomes the only final one and the
+            final one the initial state, or if there are several, a new
+            initial state has epsilon transitions to them
+        """
+        self._materialize()
+        with phase(stats, "reverse"):
+            transitions = {}  # type: Dict[Tuple[int, str], Set[int]]
+            for (state, symbol), next_states in self._transitions.items():
+                for next_state in next_states:
+                    transitions.setdefault(
+                        (next_state, symbol), set()).add(state)
+            final_states = self._final_states & self._states
+            if len(final_states) == 1:
+                initial_state = next(iter(final_states))
+            else:
+                initial_state = self._new_id("qinitial")
+                self._states.add(initial_state)
+                if final_states:
+                    transitions[initial_state, EPSILON] = final_states
+
+            self._final_states = set() if self._initial_state is None \
+                else {self._initial_state}
+            self._initial_state = initial_state
+            self._transitions = transitions
+            self._closures.clear()
+
+    def _add_apart(self, automaton: 'NFA') -> Dict[int, int]:
+        """
+            Adds the states, transitions and final states of the automaton
+            as new states, whose names are primed if they clash with the
+            existing ones. Returns the new state of each of its states.
+        """
+        if automaton._complemented:
+            automaton = copy.deepcopy(automaton)
+            automaton._materialize()
+
+        names = {
+            state: self._new_id(automaton._name(state))
+            for state in automaton._states | {automaton._initial_state}
+            if state is not None}
+        self._states.update(names.values())
+        self._alphabet.update(automaton._alphabet)
+        self._final_states.update(
+            names[state] for state in automaton._final_states)
+        for (state, symbol), next_states in list(
+                automaton._transitions.items()):
+            self._transitions[names[state], symbol] = {
+                names[next_state] for next_state in next_states}
+        return names
+
+    def complement(self, stats: Stats=None, budget: Budget=None) -> None:
         """
             Finds the automaton which recognizes the language that is the
-            complement of the actual automaton
+            complement of the actual automaton. Once it is deterministic,
+            this only flips the complement flag.
         """
-        self.determinize()
-        self._complete()
-        for state in self._states:
-            self.toggle_final_state(state)
+        if not self.is_deterministic():
+            self.determinize(stats, budget)
+        with phase(stats, "complement"):
+            self._complemented = not self._complemented
 
-    def intersection(self, automaton: 'NFA') -> None:
+    def intersection(
+            self, automaton: 'NFA', stats: Stats=None,
+            budget: Budget=None) -> None:
         """
             Finds the automaton which recognizes the language that is the
-            intersection of the actual automaton with the given one.
+            intersection of the actual automaton with the given one (left
+            unchanged), building only the pairs of states reachable in both
+            of them that can still reach a pair of final states
         """
-        automaton.complement()
-        self.complement()
-        self.union(automaton)
-        self.complement()
+        self.remove_epsilon(stats)
+        if automaton.has_epsilon():
+            automaton = copy.deepcopy(automaton)
+            automaton.remove_epsilon(stats)
+
+        with phase(stats, "intersection"):
+            explored, transitions, final_states = NFA._product(
+                [self, automaton], budget)
+            self._set_product(
+                self._alphabet | automaton._alphabet, explored, transitions,
+                final_states)
+
+        if stats is not None:
+            stats.count("pairs_explored", explored)
+            stats.peak("states", explored)
 
-    def contains(self, automaton: 'NFA') -> bool:
+    @staticmethod
+    def union_all(automata: Iterable['NFA'], stats: Stats=None) -> 'NFA':
         """
-            Checks if the actual automaton contains another one.
+            Returns the union of the automata (left unchanged) in a single
+            pass: a new initial state with epsilon transitions to the
+            initial states of all of them. The empty ones are left out.
         """
-        first_nfa = copy.deepcopy(self)
-        second_nfa = copy.deepcopy(automaton)
-        first_nfa.complement()
-        second_nfa.intersection(first_nfa)
-        return second_nfa.is_empty()
+        nfa = NFA()
+        with phase(stats, "union_all"):
+            new_state = nfa._new_id("qinitial")
+            nfa._states.add(new_state)
+            nfa._initial_state = new_state
+            initial_states = set()  # type: Set[int]
+            for automaton in automata:
+                if automaton.is_empty():
+                    nfa._alphabet.update(automaton._alphabet)
+                    continue
+                names = nfa._add_apart(automaton)
+                initial_states.add(names[automaton._initial_state])
+            if initial_states:
+                nfa._transitions[new_state, EPSILON] = initial_states
 
-    def is_equal(self, automaton: 'NFA') -> bool:
+        if stats is not None:
+            stats.peak("states", len(nfa._states))
+        return nfa
+
+    @staticmethod
+    def intersect_all(
+            automata: Iterable['NFA'], stats: Stats=None,
+            budget: Budget=None) -> 'NFA':
+        """
+            Returns the intersection of the automata (left unchanged) as a
+            single product of all of them, instead of one product after
+            another: only the tuples of states reachable in all of them are
+            built, and a tuple is dropped as soon as one of its states can
+            not reach a final state
+        """
+        members = []  # type: List[NFA]
+        for automaton in automata:
+            if automaton.has_epsilon():
+                automaton = copy.deepcopy(automaton)
+                automaton.remove_epsilon(stats)
+            members.append(automaton)
+        if not members:
+            raise ValueError("No automata to intersect")
+
+        nfa = NFA()
+        with phase(stats, "intersect_all"):
+            explored, transitions, final_states = NFA._product(
+                members, budget)
+            nfa._set_product(
+                set().union(*(member._alphabet for member in members)),
+                explored, transitions, final_states)
+
+        if stats is not None:
+            stats.count("tuples_explored", explored)
+            stats.peak("states", explored)
+        return nfa
+
+    @staticmethod
+    def _product(
+            automata: List['NFA'], budget: Budget=None
+            ) -> Tuple[int, Dict[Tuple[int, str], Set[int]], Set[int]]:
+        """
+            Explores the product of automata without epsilon transitions
+            from the tuple of their initial states, numbered 0. Returns the
+            number of tuples found, the transitions and the final tuples.
+            The tuples with a state that can not accept are not explored.
+        """
+        # None if any state may accept, as in a complement
+        alive = [
+            None if automaton._complemented
+            else automaton._alive_states()[0]
+            for automaton in automata]  # type: List[Optional[Set[int]]]
+        # a symbol missing from an alphabet has no transition
+        alphabet = sorted(set.intersection(
+            *(automaton._alphabet for automaton in automata)))
+        members = list(zip(automata, alive))
+
+        initial_tuple = tuple(
+            automaton._initial_state for automaton in automata)
+        names = {initial_tuple: 0}  # type: Dict[Tuple[Any, ...], int]
+        transitions = {}  # type: Dict[Tuple[int, str], Set[int]]
+        final_states = set()  # type: Set[int]
+        to_visit = []  # type: List[Tuple[Any, ...]]
+        if all(states is None or state in states
+               for state, (_, states) in zip(initial_tuple, members)):
+            to_visit.append(initial_tuple)
+        while to_visit:
+            if budget is not None:
+                budget.check(len(names), len(transitions))
+            states = to_visit.pop()
+            if all(automaton._accepts(state)
+                   for state, (automaton, _) in zip(states, members)):
+                final_states.add(names[states])
+            for symbol in alphabet:
+                choices = []  # type: List[Iterable[Any]]
+                for state, (automaton, alive_states) in zip(states, members):
+                    next_states = automaton._next_states(state, symbol, False)
+                    if alive_states is not None:
+                        next_states = [
+                            next_state for next_state in next_states
+                            if next_state in alive_states]
+                    if not next_states:
+                        break
+                    choices.append(next_states)
+                else:
+                    next_ids = set()  # type: Set[int]
+                    for next_tuple in product(*choices):
+                        if next_tuple not in names:
+                            names[next_tuple] = len(names)
+                            to_visit.append(next_tuple)
+                        next_ids.add(names[next_tuple])
+                    transitions[names[states], symbol] = next_ids
+        return len(names), transitions, final_states
+
+    def _set_product(
+            self, alphabet: Set[str], explored: int,
+            transitions: Dict[Tuple[int, str], Set[int]],
+            final_states: Set[int]) -> None:
+        """
+            Replaces the automaton by a product found by _product, without
+            the tuples that can not accept
+        """
+        self._states = set(range(explored))
+        self._alphabet = set(alphabet)
+        self._transitions = transitions
+        self._initial_state = 0
+        self._final_states = final_states
+        self._closures.clear()
+        self._complemented = False
+        alive, _ = self._alive_states()
+        self._states = alive | {self._initial_state}
+        self._transitions = {
+            (state, symbol): next_states & alive
+            for (state, symbol), next_states in transitions.items()
+            if state in alive and next_states & alive}
+        # the tuples are named by their discovery order
+        self._names = {state: "q" + str(state) for state in self._states}
+        self._ids = {name: state for state, name in self._names.items()}
+        self._pending = {}
+        self._ghosts = set()
+        self._next_id = explored
+
+    def contains(
+            self, automaton: 'NFA', stats: Stats=None,
+            budget: Budget=None) -> bool:
+        """
+            Checks if the actual automaton contains another one, by looking
+            for a pair of states reachable in both of them (the actual one
+            reduced and determinized) where only the given one accepts. The
+            search stops at the first such pair.
+        """
+        dfa = self
+        if not self.is_deterministic():
+            dfa = copy.deepcopy(self)
+            dfa.reduce(stats=stats, budget=budget)
+            dfa.determinize(stats, budget)
+        elif self._complemented and \
+                not automaton._alphabet <= self._alphabet:
+            # its dead state would have to reject the other symbols
+            dfa = copy.deepcopy(self)
+            dfa._materialize()
+        if automaton.has_epsilon():
+            automaton = copy.deepcopy(automaton)
+            automaton.remove_epsilon(stats)
+
+        with phase(stats, "contains"):
+            alphabet = automaton._alphabet | dfa._alphabet
+            initial_pair = (automaton._initial_state, dfa._initial_state)
+            found = {initial_pair}  # type: Set[Tuple[Any, Any]]
+            to_visit = [initial_pair]
+            contained = True
+            while to_visit:
+                if budget is not None:
+                    budget.check(len(found), 0)
+                pair = to_visit.pop()
+                if automaton._accepts(pair[0]) and not dfa._accepts(pair[1]):
+                    contained = False
+                    break
+                for symbol in alphabet:
+                    for next_pair in automaton._product_step(
+                            dfa, pair, symbol, True):
+                        if next_pair not in found:
+                            found.add(next_pair)
+                            to_visit.append(next_pair)
+
+        if stats is not None:
+            stats.count("pairs_explored", len(found))
+        return contained
+
+    def is_equal(
+            self, automaton: 'NFA', stats: Stats=None,
+            budget: Budget=None) -> bool:
         """
             Checks if two automata are equivalent.
         """
-        return self.contains(automaton) and automaton.contains(self)
+        return self.contains(automaton, stats, budget) and \
+            automaton.contains(self, stats, budget)
 
-    def _complete(self) -> None:
-        self.add_state(DEAD_STATE)
-        for state in self._states:
+    def _accepts(self, state: Optional[int]) -> bool:
+        """ Checks if a state is accepting, None is the dead state """
+        return (state is not None and state in self._final_states) != \
+            self._complemented
+
+    def _next_states(
+            self, state: Optional[int], symbol: str,
+            keep_dead: bool) -> Iterable[Optional[int]]:
+        """
+            States reached by the symbol, the dead state (None) is only
+            returned if it matters, that is, if it accepts or keep_dead.
+            The dead state of a complement only accepts over its alphabet.
+        """
+        if state is not None:
+            next_states = self._transitions.get((state, symbol))
+            if next_states:
+                return next_states
+        if self._complemented:
+            return (None,) if symbol in self._alphabet else ()
+        return (None,) if keep_dead else ()
+
+    def _product_step(
+            self, automaton: 'NFA', pair: Tuple[Any, Any], symbol: str,
+            keep_dead: bool) -> Iterator[Tuple[Any, Any]]:
+        """
+            Pairs reached by the symbol in the product with the automaton,
+            keep_dead tells if the dead state of the automaton matters
+        """
+        second_states = automaton._next_states(pair[1], symbol, keep_dead)
+        if not second_states:
+            return
+        for first in self._next_states(pair[0], symbol, False):
+            for second in second_states:
+                yield first, second
+
+    def _materialize(self) -> None:
+        """
+            Makes a complement explicit: adds the dead state, if it is
+            reachable, and flips the final states
+        """
+        if not self._complemented:
+            return
+        self._complemented = False
+        missing = [
+            (state, symbol) for state in self._states
+            for symbol in self._alphabet
+            if (state, symbol) not in self._transitions]
+        if missing:
+            dead_state = self._new_id(DEAD_STATE)
+            self._states.add(dead_state)
+            for key in missing:
+                self._transitions[key] = {dead_state}
             for symbol in self._alphabet:
-                if (state, symbol) not in self._transitions:
-                    self._transitions[state, symbol] = {DEAD_STATE}
+                self._transitions[dead_state, symbol] = {dead_state}
+        self._final_states = self._states - self._final_states
+
+    def _new_id(self, recipe: 'Recipe') -> int:
+        """ Returns a new state id, see _name for the recipe of its name """
+        state = self._next_id
+        self._next_id += 1
+        self._pending[state] = recipe
+        return state
+
+    def _intern(self, name: str) -> int:
+        """ Returns the id of the state with the given name, or a new one """
+        state = self._id(name)
+        if state is None:
+            state = self._next_id
+            self._next_id += 1
+            self._names[state] = name
+            self._ids[name] = state
+        return state
+
+    def _id(self, name: str) -> Optional[int]:
+        """ Returns the id of the state with the given name, if any """
+        if self._pending:
+            self._name_all()
+        return self._ids.get(name)
+
+    def _name(self, state: int) -> str:
+        """
+            Returns the name of a state, building it from its recipe if it
+            has no name yet: the name, or the sorted names of the states of
+            the recipe joined, primed until no other state has it
+        """
+        name = self._names.get(state)
+        if name is None:
+            recipe = self._pending.pop(state)
+            if isinstance(recipe, tuple):
+                name = "".join(sorted(map(self._name, recipe)))
+            else:
+                name = recipe
+            while name in self._ids:
+                name += "'"
+            self._names[state] = name
+            if state not in self._ghosts:
+                self._ids[name] = state
+        return name
+
+    def _name_all(self) -> None:
+        """ Names the states that have a recipe, in creation order """
+        if not self._pending:
+            return
+        for state in list(self._pending):
+            if state in self._pending and state not in self._ghosts:
+                self._name(state)
+        # no recipe needs the names of the removed states anymore
+        for state in self._ghosts:
+            self._names.pop(state, None)
+        self._pending = {}
+        self._ghosts = set()
+
+    def _forget(self, state: int) -> None:
+        """
+            Frees the name of a removed state, it is kept as long as a
+            recipe may need it
+        """
+        name = self._names.get(state)
+        if name is not None:
+            del self._ids[name]
+        if self._pending:
+            self._ghosts.add(state)
+        elif name is not None:
+            del self._names[state]
 
     @staticmethod
     def from_regular_grammar(grammar) -> 'NFA':
@@ -468,27 +1435,296 @@ class NFA():
 
         return NFA(states, alphabet, transitions, initial_state, final_states)
 
-    def save(self, path: str) -> None:
-        """ Saves the automaton to a JSON file """
-        data = {}  # type: Dict[str, Any]
-        data["states"] = sorted(self._states)
-        data["alphabet"] = sorted(self._alphabet)
-        data["transitions"] = \
-            [(k[0], k[1], sorted(v)) for k, v in self._transitions.items()]
-        data["initial_state"] = self._initial_state
-        data["final_states"] = sorted(self._final_states)
+    @staticmethod
+    def from_words(
+            words: Iterable[str], is_sorted: bool=False,
+            stats: Stats=None) -> 'NFA':
+        """
+            Minimal DFA of a finite set of words, built incrementally with
+            the algorithms of Daciuk et al.: equivalent states are merged as
+            soon as they can not change anymore, so only the minimal
+            automaton (and the path of a word) is ever kept in memory.
+
+            Sorted words are cheaper to add, pass is_sorted if they are
+            (RuntimeError is raised if they turn out not to be). Otherwise,
+            the states shared with other words are cloned before a word is
+            added below them.
+        """
+        with phase(stats, "from_words"):
+            graph = _WordGraph()
+            if is_sorted:
+                graph.add_sorted(words)
+            else:
+                for word in words:
+                    graph.add(word)
+            automaton = graph.to_nfa()
+
+        if stats is not None:
+            stats.count("states_created", graph.created)
+            stats.peak("states", graph.peak)
+        return automaton
+
+    def save(self, path: str, indent: Optional[int]=4) -> None:
+        """
+            Saves the automaton to a JSON file, use indent=None for a
+            compact output
+        """
         with open(path, 'w') as automata_file:
-            json.dump(data, automata_file, indent=4)
+            self.dump(automata_file, indent)
+
+    def dump(self, automata_file: TextIO, indent: Optional[int]=None) \
+            -> None:
+        """ Writes the automaton to an open file, streaming the transitions """
+        self._materialize()
+        self._name_all()
+        names = self._names
+        write_automaton(
+            automata_file,
+            sorted(names[state] for state in self._states),
+            sorted(self._alphabet),
+            ((names[k[0]], k[1], sorted(names[state] for state in v))
+             for k, v in self._transitions.items()),
+            self.initial_state,
+            sorted(names[state] for state in self._final_states),
+            indent)
 
     @staticmethod
     def load(path: str) -> 'NFA':
         """ Loads the automaton from a JSON file """
         with open(path, 'r') as automata_file:
-            data = json.load(automata_file)
-        states = set(data["states"])
-        alphabet = set(data["alphabet"])
-        transitions = {(v[0], v[1]): set(v[2]) for v in data["transitions"]}
-        initial_state = data["initial_state"]
-        final_states = set(data["final_states"])
+            return NFA.read(automata_file)
+
+    @staticmethod
+    def read(automata_file: TextIO) -> 'NFA':
+        """
+            Reads an automaton from an open JSON file, the transitions are
+            decoded one at a time instead of loading the whole document
+        """
+        data = {}  # type: Dict[str, Any]
+        transitions = {}  # type: Dict[Tuple[str, str], Set[str]]
+        reader = JSONStreamReader(automata_file)
+        for key, value in reader.members({"transitions"}):
+            if key == "transitions":
+                for v in value:
+                    transitions[v[0], v[1]] = set(v[2])
+            else:
+                data[key] = value
+        return NFA(
+            set(data["states"]), set(data["alphabet"]), transitions,
+            data["initial_state"], set(data["final_states"]))
+
+    @staticmethod
+    def iter_transitions(path: str) -> Iterator[Tuple[str, str, List[str]]]:
+        """
+            Iterates over the transitions of a JSON automaton file without
+            building the automaton
+        """
+        with open(path, 'r') as automata_file:
+            reader = JSONStreamReader(automata_file)
+            for key, value in reader.members({"transitions"}):
+                if key == "transitions":
+                    for v in value:
+                        yield v[0], v[1], v[2]
+                    return
+
+    @staticmethod
+    def save_jsonl(automata: Iterable['NFA'], path: str) -> None:
+        """ Saves many automata to a JSONL file, one automaton per line """
+        with open(path, 'w') as automata_file:
+            for automaton in automata:
+                automaton.dump(automata_file)
+                automata_file.write("\n")
+
+    @staticmethod
+    def load_jsonl(path: str) -> Iterator['NFA']:
+        """
+            Lazily loads the automata of a JSONL file, only one of them is
+            kept in memory at a time
+        """
+        with open(path, 'r') as automata_file:
+            for line in automata_file:
+                if line.strip():
+                    yield NFA.read(io.StringIO(line))
+
+
+class _WordGraph():
+    """
+        Minimal acyclic DFA under construction, see NFA.from_words. States
+        are registered by their finality and edges, and a state is only in
+        the register while no word is being added below it.
+    """
+
+    def __init__(self) -> None:
+        self._final = {0: False}  # type: Dict[int, bool]
+        self._edges = {0: {}}  # type: Dict[int, Dict[str, int]]
+        self._in_degree = {0: 0}  # type: Dict[int, int]
+        self._register = {}  # type: Dict[Tuple[Any, ...], int]
+        self.created = 1
+        self.peak = 1
+
+    def add_sorted(self, words: Iterable[str]) -> None:
+        """ Adds words in lexicographical order """
+        previous = None  # type: Optional[str]
+        path = [0]  # states of the previous word
+        for word in words:
+            if previous is not None:
+                if word <= previous:
+                    if word == previous:
+                        continue
+                    raise RuntimeError("The words are not sorted")
+                prefix = _common_prefix(previous, word)
+                # the previous word has no more words below its suffix
+                for depth in range(len(previous), prefix, -1):
+                    self._replace_or_register(
+                        path[depth - 1], previous[depth - 1])
+                del path[prefix + 1:]
+            else:
+                prefix = 0
+            self._add_suffix(path, word[prefix:])
+            previous = word
+
+        if previous is not None:
+            for depth in range(len(previous), 0, -1):
+                self._replace_or_register(
+                    path[depth - 1], previous[depth - 1])
+
+    def add(self, word: str) -> None:
+        """ Adds a word, in any order """
+        path = [0]
+        for symbol in word:
+            next_state = self._edges[path[-1]].get(symbol)
+            if next_state is None:
+                break
+            path.append(next_state)
+        prefix = len(path) - 1
+        if prefix == len(word) and self._final[path[-1]]:
+            return
+
+        # the path changes: its states leave the register, and the ones
+        # from the first state shared with other words on are cloned
+        confluence = next((
+            depth for depth in range(1, len(path))
+            if self._in_degree[path[depth]] > 1), len(path))
+        for state in path[:confluence]:
+            if self._register.get(self._signature(state)) == state:
+                del self._register[self._signature(state)]
+        for depth in range(confluence, len(path)):
+            clone = self._new_state(self._final[path[depth]])
+            self._edges[clone] = dict(self._edges[path[depth]])
+            for next_state in self._edges[clone].values():
+                self._in_degree[next_state] += 1
+            self._in_degree[path[depth]] -= 1
+            self._edges[path[depth - 1]][word[depth - 1]] = clone
+            self._in_degree[clone] = 1
+            path[depth] = clone
+
+        self._add_suffix(path, word[prefix:])
+        for depth in range(len(word), 0, -1):
+            self._replace_or_register(path[depth - 1], word[depth - 1])
+
+    def _add_suffix(self, path: List[int], suffix: str) -> None:
+        """ Adds new states for the suffix after the end of the path """
+        state = path[-1]
+        for symbol in suffix:
+            next_state = self._new_state(False)
+            self._edges[state][symbol] = next_state
+            self._in_degree[next_state] = 1
+            path.append(next_state)
+            state = next_state
+        self._final[state] = True
+
+    def _new_state(self, final: bool) -> int:
+        state = self.created
+        self.created += 1
+        self._final[state] = final
+        self._edges[state] = {}
+        self._in_degree[state] = 0
+        if len(self._final) > self.peak:
+            self.peak = len(self._final)
+        return state
+
+    def _signature(self, state: int) -> Tuple[Any, ...]:
+        return self._final[state], tuple(sorted(self._edges[state].items()))
+
+    def _replace_or_register(self, parent: int, symbol: str) -> None:
+        """
+            Replaces the state reached from parent by symbol with an
+            equivalent registered one, or registers it if there is none
+        """
+        state = self._edges[parent][symbol]
+        registered = self._register.setdefault(self._signature(state), state)
+        if registered != state:
+            self._edges[parent][symbol] = registered
+            self._in_degree[registered] += 1
+            for next_state in self._edges.pop(state).values():
+                self._in_degree[next_state] -= 1
+            del self._final[state]
+            del self._in_degree[state]
+
+    def to_nfa(self) -> NFA:
+        """ The automaton, states named q0, q1, ... in breadth first order """
+        names = {0: "q0"}
+        transitions = {}  # type: Dict[Tuple[str, str], Set[str]]
+        alphabet = set()  # type: Set[str]
+        to_visit = [0]
+        for state in to_visit:
+            for symbol, next_state in sorted(self._edges[state].items()):
+                if next_state not in names:
+                    names[next_state] = "q" + str(len(names))
+                    to_visit.append(next_state)
+                transitions[names[state], symbol] = {names[next_state]}
+                alphabet.add(symbol)
         return NFA(
-            states, alphabet, transitions, initial_state, final_states)
+            set(names.values()), alphabet, transitions, "q0",
+            {name for state, name in names.items() if self._final[state]})
+
+
+def _reverse_subsets(
+        transitions: Dict[Tuple[int, str], Set[int]], initial_state: Any,
+        final_states: Set[int], budget: Optional[Budget]) \
+        -> Tuple[List[FrozenSet[int]], Dict[Tuple[int, str], int], Set[int]]:
+    """
+        Subset construction of the reverse of an automaton without epsilon
+        transitions, from the set of its final states. Returns the subsets
+        reached (the initial one first), the transitions between their
+        indexes and the indexes of the subsets with the initial state.
+    """
+    predecessors = {}  # type: Dict[int, Dict[str, Set[int]]]
+    for (state, symbol), next_states in transitions.items():
+        for next_state in next_states:
+            predecessors.setdefault(next_state, {}).setdefault(
+                symbol, set()).add(state)
+
+    subsets = [frozenset(final_states)]
+    indexes = {subsets[0]: 0}
+    subset_transitions = {}  # type: Dict[Tuple[int, str], int]
+    for index, subset in enumerate(subsets):
+        if budget is not None:
+            budget.check(len(subsets), len(subset_transitions))
+        by_symbol = {}  # type: Dict[str, Set[int]]
+        for state in subset:
+            for symbol, previous_states in predecessors.get(
+                    state, {}).items():
+                by_symbol.setdefault(symbol, set()).update(previous_states)
+        for symbol, states in by_symbol.items():
+            key = frozenset(states)
+            next_index = indexes.get(key)
+            if next_index is None:
+                next_index = len(subsets)
+                indexes[key] = next_index
+                subsets.append(key)
+            subset_transitions[index, symbol] = next_index
+
+    return subsets, subset_transitions, {
+        index for index, subset in enumerate(subsets)
+        if initial_state in subset}
+
+
+def _common_prefix(first: str, second: str) -> int:
+    """ Length of the longest common prefix of two strings """
+    length = 0
+    for a, b in zip(first, second):
+        if a != b:
+            break
+        length += 1
+    return length
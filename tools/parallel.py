@@ -0,0 +1,194 @@
+from typing import Dict, List, Optional, Set, Tuple
+from multiprocessing.connection import Connection
+import copy
+import multiprocessing
+import os
+from tools.nfa import NFA
+from tools.stats import Stats, phase
+from tools.budget import Budget, BudgetExceeded
+
+# subsets (bit masks of NFA states) sent to the worker that owns them, with
+# the (source DFA state, symbol index) transitions that reach them
+Inbox = Dict[int, List[Tuple[int, int]]]
+
+
+def parallel_determinize(
+        nfa: NFA, workers: Optional[int]=None, stats: Stats=None,
+        budget: Budget=None) -> NFA:
+    """
+        Determinizes with the subset construction spread over worker
+        processes (one per CPU by default) and returns the DFA, whose states
+        are the reachable subsets, named as determinize names them.
+
+        Subsets are bit masks of NFA states, each one owned by the worker
+        given by its hash. The frontier is explored in rounds: every worker
+        expands the new subsets of its inbox and batches the subsets they
+        reach by owner, then the batches are exchanged through this process
+        to form the next inboxes, until no subset is sent. A worker numbers
+        its subsets on its own (local index * workers + worker), so only the
+        subsets and the transitions that reach them travel between
+        processes. If the budget is exceeded, the workers are stopped and
+        BudgetExceeded is raised.
+    """
+    automaton = copy.deepcopy(nfa)
+    automaton.remove_epsilon()
+    if not automaton.initial_state:
+        return automaton
+
+    workers = workers or os.cpu_count() or 1
+    states = automaton.states
+    symbols = automaton.alphabet
+    ids = {state: i for i, state in enumerate(states)}
+    # successors[a][i]: mask of the states reached from the i-th by symbol a
+    successors = [[
+        sum(1 << ids[next_state]
+            for next_state in automaton.transition(state, symbol))
+        for state in states] for symbol in symbols]
+
+    context = multiprocessing.get_context()
+    connections = []  # type: List[Connection]
+    processes = []  # type: List[multiprocessing.process.BaseProcess]
+    for shard in range(workers):
+        parent, child = context.Pipe()
+        process = context.Process(
+            target=_explore, args=(child, shard, workers, successors),
+            daemon=True)
+        process.start()
+        child.close()
+        connections.append(parent)
+        processes.append(process)
+
+    results = None
+    with phase(stats, "parallel_determinize"):
+        try:
+            rounds, explored, results = _run_rounds(
+                connections, workers, 1 << ids[automaton.initial_state],
+                budget)
+        finally:
+            for process in processes:
+                if process.is_alive() and results is None:
+                    process.terminate()
+                process.join()
+        dfa = _merge(
+            results, workers, states, symbols,
+            automaton.final_states, 1 << ids[automaton.initial_state])
+
+    if stats is not None:
+        stats.count("rounds", rounds)
+        stats.count("subsets_explored", explored)
+        states_created = len(dfa.states)
+        stats.count("states_created", states_created)
+        stats.peak("states", states_created)
+    return dfa
+
+
+def _run_rounds(
+        connections: List[Connection], workers: int, initial: int,
+        budget: Optional[Budget]) \
+        -> Tuple[int, int, List[Tuple[List[int], List[Tuple[int, int, int]]]]]:
+    """
+        Exchanges the batches until the frontier is empty, returns the
+        number of rounds, of subsets sent and the results of each worker:
+        its subsets and transitions (source, symbol index, target)
+    """
+    inboxes = [{} for _ in range(workers)]  # type: List[Inbox]
+    inboxes[hash(initial) % workers][initial] = []
+    rounds = 0
+    explored = 0
+    while any(inboxes):
+        rounds += 1
+        explored += sum(map(len, inboxes))
+        for connection, inbox in zip(connections, inboxes):
+            connection.send(inbox)
+        inboxes = [{} for _ in range(workers)]
+        n_states = 0
+        n_transitions = 0
+        for connection in connections:
+            outboxes, worker_states, worker_transitions = connection.recv()
+            n_states += worker_states
+            n_transitions += worker_transitions
+            for inbox, outbox in zip(inboxes, outboxes):
+                for mask, sources in outbox.items():
+                    inbox.setdefault(mask, []).extend(sources)
+        if budget is not None:
+            try:
+                budget.check(n_states, n_transitions)
+            except BudgetExceeded as error:
+                error.stats["subsets_explored"] = explored
+                raise
+
+    for connection in connections:
+        connection.send(None)
+    return rounds, explored, [
+        connection.recv() for connection in connections]
+
+
+def _explore(
+        connection: Connection, shard: int, workers: int,
+        successors: List[List[int]]) -> None:
+    """ Worker of parallel_determinize, owns the subsets of its shard """
+    numbers = {}  # type: Dict[int, int]
+    masks = []  # type: List[int]
+    transitions = []  # type: List[Tuple[int, int, int]]
+    while True:
+        inbox = connection.recv()  # type: Optional[Inbox]
+        if inbox is None:
+            break
+        outboxes = [{} for _ in range(workers)]  # type: List[Inbox]
+        for mask, sources in inbox.items():
+            number = numbers.get(mask)
+            if number is None:
+                number = len(masks) * workers + shard
+                numbers[mask] = number
+                masks.append(mask)
+                members = [
+                    i for i in range(mask.bit_length()) if mask >> i & 1]
+                for symbol, table in enumerate(successors):
+                    next_mask = 0
+                    for i in members:
+                        next_mask |= table[i]
+                    if next_mask:
+                        outboxes[hash(next_mask) % workers].setdefault(
+                            next_mask, []).append((number, symbol))
+            for source, symbol in sources:
+                transitions.append((source, symbol, number))
+        connection.send((outboxes, len(masks), len(transitions)))
+    connection.send((masks, transitions))
+    connection.close()
+
+
+def _merge(
+        results: List[Tuple[List[int], List[Tuple[int, int, int]]]],
+        workers: int, states: List[str], symbols: List[str],
+        final_states: Set[str], initial: int) -> NFA:
+    """ Builds the DFA of the subsets and transitions of the workers """
+    final_mask = sum(
+        1 << i for i, state in enumerate(states) if state in final_states)
+    subsets = {}  # type: Dict[int, int]
+    for shard, (masks, _) in enumerate(results):
+        for index, mask in enumerate(masks):
+            subsets[index * workers + shard] = mask
+
+    # single states keep their names, the others are their joined names
+    names = {}  # type: Dict[int, str]
+    taken = set()  # type: Set[str]
+    for number, mask in sorted(
+            subsets.items(), key=lambda item: bin(item[1]).count("1")):
+        name = "".join(sorted(
+            states[i] for i in range(mask.bit_length()) if mask >> i & 1))
+        while name in taken:
+            name += "'"
+        taken.add(name)
+        names[number] = name
+
+    transitions = {}  # type: Dict[Tuple[str, str], Set[str]]
+    for _, shard_transitions in results:
+        for source, symbol, target in shard_transitions:
+            transitions[names[source], symbols[symbol]] = {names[target]}
+    initial_number = next(
+        number for number, mask in subsets.items() if mask == initial)
+    return NFA(
+        set(names.values()), set(symbols), transitions,
+        names[initial_number], {
+            names[number] for number, mask in subsets.items()
+            if mask & final_mask})
@@ -1,8 +1,11 @@
-from typing import Any, Dict, FrozenSet, List, Set, Tuple
-from functools import lru_cache
+from typing import Dict, FrozenSet, List, Set, Tuple
+from array import array
 from collections import defaultdict
 import re
 from tools.nfa import NFA
+from tools.stats import Stats, phase
+from tools.budget import Budget
+from tools.derivatives import Term, Terms
 
 END = "$"
 EPSILON = "&"
@@ -10,64 +13,98 @@ OPERATORS = {"|", ".", "*", "?"}
 TERMINALS_PATTERN = re.compile(r"[A-z0-9&]")
 
 
-class Node():
-    """ Node of the syntax tree generated by the RegExpParser class """
-
-    _n_nodes = 0  # number of nodes built
-
-    def __init__(self, symbol: str, left, right) -> None:
-        self.symbol = symbol
-        self.left = left
-        self.right = right
-        self._label = Node._n_nodes
-        Node._n_nodes += 1
-
-    def __hash__(self):
-        return self._label
-
-    @lru_cache(maxsize=128)
-    def down(self, visited: FrozenSet[Any]=None) -> Set[Any]:
-        """ Returns the set of reachable nodes by going down on this node """
-        if visited is None:
-            visited = frozenset()
-
-        if self in visited:
-            return {self} if self.symbol not in OPERATORS else set()
-
-        visited |= {self}
-        if self.symbol == '|':
-            return self.left.down(visited) | self.right.down(visited)
-        elif self.symbol == '.':
-            return self.left.down(visited)
-        elif self.symbol == '*' or self.symbol == '?':
-            return self.left.down(visited) | self.right.up(visited)
-        elif self.symbol == EPSILON:
-            return self.right.up(visited)
-        return {self}
-
-    @lru_cache(maxsize=128)
-    def up(self, visited: FrozenSet[Any]=None) -> Set[Any]:
-        """ Returns the set of reachable nodes by going up on this node """
-        if visited is None:
-            visited = frozenset()
-
-        if self.symbol == '|':
-            # skip the whole right sub tree
-            node = self.right
-            while node.symbol == '.' or node.symbol == '|':
-                node = node.right
-            return node.right.up(visited)
-        elif self.symbol == '.':
-            return self.right.down(visited)
-        elif self.symbol == '*':
-            return self.left.down(visited) | self.right.up(visited)
-        elif self.symbol == '?':
-            return self.right.up(visited)
-        # if self.symbol == END:
-        return {self}
-
-
-END_NODE = Node(END, None, None)
+class SyntaxTree():
+    """
+        Syntax tree generated by the RegExpParser class, as parallel arrays
+        indexed by node: the symbol of each node and the indexes of its
+        children (-1 if missing). Node 0 is the END node, which the last
+        node in order is threaded to.
+    """
+
+    __slots__ = ("symbols", "lefts", "rights", "root")
+
+    def __init__(self) -> None:
+        self.symbols = [END]  # type: List[str]
+        self.lefts = array("i", [-1])
+        self.rights = array("i", [-1])
+        self.root = -1
+
+    def __len__(self) -> int:
+        return len(self.symbols)
+
+    def add(self, symbol: str, left: int=-1, right: int=-1) -> int:
+        """ Adds a node, returns its index """
+        self.symbols.append(symbol)
+        self.lefts.append(left)
+        self.rights.append(right)
+        return len(self.symbols) - 1
+
+    def thread(self) -> None:
+        """
+            Threads the tree in place, making it easy to follow in order
+            from any node: the missing right children become the next
+            ancestor in order (or END)
+        """
+        lefts, rights = self.lefts, self.rights
+        stack = []  # type: List[int]
+        node = self.root
+        # traverse the tree in order
+        while stack or node != -1:
+            if node != -1:
+                stack.append(node)
+                node = lefts[node]
+            else:
+                node = stack.pop()
+                if rights[node] == -1:
+                    rights[node] = stack[-1] if stack else 0
+                    node = -1
+                else:
+                    node = rights[node]
+
+    def down(self, node: int) -> FrozenSet[int]:
+        """ Returns the leaves reachable by going down on the node """
+        return self._leaves(node, True)
+
+    def up(self, node: int) -> FrozenSet[int]:
+        """ Returns the leaves reachable by going up on the node """
+        return self._leaves(node, False)
+
+    def _leaves(self, node: int, down: bool) -> FrozenSet[int]:
+        """
+            Leaves (symbols and END) reachable from the node of a threaded
+            tree, visiting each node at most once in each direction
+        """
+        symbols, lefts, rights = self.symbols, self.lefts, self.rights
+        leaves = set()  # type: Set[int]
+        visited = set()  # type: Set[Tuple[int, bool]]
+        to_visit = [(node, down)]
+        while to_visit:
+            move = to_visit.pop()
+            if move in visited:
+                continue
+            visited.add(move)
+            node, down = move
+            symbol = symbols[node]
+            if symbol == '|':
+                if down:
+                    to_visit.append((lefts[node], True))
+                    to_visit.append((rights[node], True))
+                else:
+                    # skip the whole right sub tree
+                    last = rights[node]
+                    while symbols[last] == '.' or symbols[last] == '|':
+                        last = rights[last]
+                    to_visit.append((rights[last], False))
+            elif symbol == '.':
+                to_visit.append((lefts[node] if down else rights[node], True))
+            elif symbol == '*' or (symbol == '?' and down):
+                to_visit.append((lefts[node], True))
+                to_visit.append((rights[node], False))
+            elif symbol == '?' or (symbol == EPSILON and down):
+                to_visit.append((rights[node], False))
+            else:
+                leaves.add(node)
+        return frozenset(leaves)
 
 
 class RegExpParser():
@@ -76,15 +113,16 @@ class RegExpParser():
     def __init__(self, regex: str) -> None:
         self._input_regex = regex.replace(".", "")
         self._pos = 0  # position of the next symbol
+        self._tree = SyntaxTree()
 
-    def parse(self) -> Node:
-        """ Returns the root node of the regex syntax tree """
-        root = self._regex()
+    def parse(self) -> SyntaxTree:
+        """ Returns the regex syntax tree """
+        self._tree.root = self._regex()
 
         if self._pos != len(self._input_regex):
             raise RuntimeError("Invalid regex")
 
-        return root
+        return self._tree
 
     def _peek(self) -> str:
         return self._input_regex[self._pos] \
@@ -105,34 +143,34 @@ class RegExpParser():
     def _more(self) -> bool:
         return self._pos < len(self._input_regex)
 
-    def _regex(self) -> Node:
+    def _regex(self) -> int:
         # <regex> ::= <term> '|' <regex> | <term>
         term = self._term()
         if self._peek() == '|':
             self._follow()
             regex = self._regex()
-            return Node('|', term, regex)
+            return self._tree.add('|', term, regex)
         return term
 
-    def _term(self) -> Node:
+    def _term(self) -> int:
         # <term> ::= <factor> <term> | <factor>
         factor = self._factor()
         if self._more() and self._peek() != ')' and self._peek() != '|':
             term = self._term()
-            factor = Node('.', factor, term)
+            factor = self._tree.add('.', factor, term)
         return factor
 
-    def _factor(self) -> Node:
+    def _factor(self) -> int:
         # <factor> ::= <base> { '*' } | <base> { '?' }
         base = self._base()
         while self._more() and (self._peek() == '*' or self._peek() == '?'):
-            base = Node(self._follow(), base, None)
+            base = self._tree.add(self._follow(), base)
         return base
 
-    def _base(self) -> Node:
+    def _base(self) -> int:
         # <base> ::= <char> | '(' <regex> ')'
         if TERMINALS_PATTERN.match(self._peek()):
-            return Node(self._follow(), None, None)
+            return self._tree.add(self._follow())
         elif self._peek() == '(':
             self._eat('(')
             regex = self._regex()
@@ -142,76 +180,159 @@ class RegExpParser():
             raise RuntimeError("Invalid regex")
 
 
-def thread_tree(root: Node) -> None:
-    """ Threads the tree, making it easy to follow in order from any node """
-    stack: List[Node] = []
-    node = root
-    # traverse the tree in order
-    while stack or node:
-        if node:
-            stack.append(node)
-            node = node.left
+def regex_to_term(regex: str, terms: Terms) -> Term:
+    """
+        Parses a RegExp into a canonical term of the given factory, which
+        can then be combined with other terms (e.g. intersected or
+        complemented) and turned into a DFA with terms.to_dfa
+    """
+    tree = RegExpParser(regex).parse()
+    return _tree_to_term(tree, tree.root, terms)
+
+
+def _tree_to_term(tree: SyntaxTree, node: int, terms: Terms) -> Term:
+    symbol, left, right = tree.symbols[node], tree.lefts[node], \
+        tree.rights[node]
+    if symbol == '|':
+        return terms.union(
+            _tree_to_term(tree, left, terms),
+            _tree_to_term(tree, right, terms))
+    elif symbol == '.':
+        return terms.concat(
+            _tree_to_term(tree, left, terms),
+            _tree_to_term(tree, right, terms))
+    elif symbol == '*':
+        return terms.star(_tree_to_term(tree, left, terms))
+    elif symbol == '?':
+        return terms.optional(_tree_to_term(tree, left, terms))
+    elif symbol == EPSILON:
+        return terms.epsilon
+    return terms.symbol(symbol)
+
+
+ENGINES = {"simone", "derivatives"}
+
+
+def regex_to_dfa(
+        regex: str, stats: Stats=None, budget: Budget=None,
+        engine: str="simone") -> NFA:
+    """
+        Transforms a RegExp into a DFA. The engine is either "simone", the
+        De Simone/Aho method, or "derivatives", Brzozowski's derivatives,
+        which usually gives a DFA with fewer states. Raises BudgetExceeded if
+        a budget is given and it is exceeded. Compilations share no state,
+        so this is safe to call from several threads at once.
+    """
+    if engine == "derivatives":
+        terms = Terms()
+        with phase(stats, "parse"):
+            term = regex_to_term(regex, terms)
+        return terms.to_dfa(term, stats=stats, budget=budget)
+    elif engine != "simone":
+        raise ValueError("Unknown engine: {}".format(engine))
+
+    with phase(stats, "parse"):
+        tree = RegExpParser(regex).parse()
+    with phase(stats, "thread"):
+        tree.thread()
+    with phase(stats, "construction"):
+        compilation = _Compilation(tree, budget)
+        dfa = compilation.build_dfa()
+
+    if stats is not None:
+        stats.count("up_cache_hits", compilation.up_hits)
+        stats.count("up_cache_misses", compilation.up_misses)
+        states = len(dfa.states)
+        stats.count("states_created", states)
+        stats.count("transitions_created", len(dfa.transition_table))
+        stats.peak("states", states)
+
+    return dfa
+
+
+class _Compilation():
+    """
+        Context of a De Simone compilation: the threaded syntax tree, the
+        budget and the memoized up sets of the leaves. Every call of
+        regex_to_dfa has its own, nothing else is mutated, so patterns can be
+        compiled concurrently from several threads.
+    """
+
+    __slots__ = ("tree", "budget", "up_hits", "_ups")
+
+    def __init__(self, tree: SyntaxTree, budget: Budget=None) -> None:
+        self.tree = tree
+        self.budget = budget
+        self.up_hits = 0
+        # leaves reached by going up on the right of each leaf
+        self._ups = {}  # type: Dict[int, FrozenSet[int]]
+
+    @property
+    def up_misses(self) -> int:
+        return len(self._ups)
+
+    def follow(self, leaf: int) -> FrozenSet[int]:
+        """ Leaves that may come after the leaf """
+        up = self._ups.get(leaf)
+        if up is not None:
+            self.up_hits += 1
         else:
-            node = stack.pop()
-            if node.right is None:
-                node.right = stack[-1] if stack else END_NODE
-                node = None
-            else:
-                node = node.right
-
-
-def regex_to_dfa(regex: str) -> NFA:
-    """ Transforms a RegExp into a DFA using the De Simone/Aho method. """
-    root = RegExpParser(regex).parse()
-    thread_tree(root)
-
-    alphabet: Set[str] = set()
-    transitions: Dict[Tuple[str, str], Set[str]] = {}
-    initial_state = "q0"
-    final_states: Set[str] = set()
-    states = {initial_state}
-
-    initial_nodes = frozenset(root.down())
-    compositions = {initial_nodes: initial_state}
-    if END_NODE in initial_nodes:
-        final_states.add(initial_state)
-
-    new_compositions = {initial_nodes}
-    while new_compositions:
-        symbols: Dict[str, Set[Node]] = defaultdict(set)
-        composition = new_compositions.pop()  # composition of the new state
-
-        # separate nodes of the same symbol
-        for node in composition:
-            if node.symbol != END:
-                symbols[node.symbol].add(node)
-
-        # build the new state transitions
-        for symbol, nodes in symbols.items():
-            # create composition of the new state, that is, the nodes of the
-            # tree you're in, when you're in that state
-            new_state_composition: Set[Node] = set()
-            for node in nodes:
-                new_state_composition.update(node.right.up())
-            frozen_new_composition = frozenset(new_state_composition)
-
-            # if there's a state with the same composition, they're equivalent,
-            # no need to create another one
-            if frozen_new_composition in compositions:
-                new_state = compositions[frozen_new_composition]
-            else:  # else, create the new state
-                new_state = "q" + str(len(compositions))
-                compositions[frozen_new_composition] = new_state
-                new_compositions.add(frozen_new_composition)
-                if END_NODE in frozen_new_composition:
-                    final_states.add(new_state)
-
-            transitions[compositions[composition], symbol] = {new_state}
-
-    for (state, symbol), next_state in transitions.items():
-        states.update({state} | next_state)
-        alphabet.add(symbol)
-
-    Node.up.cache_clear()
-    Node.down.cache_clear()
-    return NFA(states, alphabet, transitions, initial_state, final_states)
+            up = self.tree.up(self.tree.rights[leaf])
+            self._ups[leaf] = up
+        return up
+
+    def build_dfa(self) -> NFA:
+        """ Builds the DFA of the threaded syntax tree """
+        tree, budget = self.tree, self.budget
+        symbols = tree.symbols
+        alphabet: Set[str] = set()
+        transitions: Dict[Tuple[str, str], Set[str]] = {}
+        initial_state = "q0"
+        final_states: Set[str] = set()
+        states = {initial_state}
+
+        initial_nodes = tree.down(tree.root)
+        compositions = {initial_nodes: initial_state}
+        if 0 in initial_nodes:  # END
+            final_states.add(initial_state)
+
+        new_compositions = {initial_nodes}
+        while new_compositions:
+            if budget is not None:
+                budget.check(len(compositions), len(transitions))
+            by_symbol: Dict[str, Set[int]] = defaultdict(set)
+            # composition of the new state
+            composition = new_compositions.pop()
+
+            # separate nodes of the same symbol
+            for node in composition:
+                if node != 0:
+                    by_symbol[symbols[node]].add(node)
+
+            # build the new state transitions
+            for symbol, nodes in by_symbol.items():
+                # create composition of the new state, that is, the nodes of
+                # the tree you're in, when you're in that state
+                new_state_composition: Set[int] = set()
+                for node in nodes:
+                    new_state_composition.update(self.follow(node))
+                frozen_new_composition = frozenset(new_state_composition)
+
+                # if there's a state with the same composition, they're
+                # equivalent, no need to create another one
+                if frozen_new_composition in compositions:
+                    new_state = compositions[frozen_new_composition]
+                else:  # else, create the new state
+                    new_state = "q" + str(len(compositions))
+                    compositions[frozen_new_composition] = new_state
+                    new_compositions.add(frozen_new_composition)
+                    if 0 in frozen_new_composition:
+                        final_states.add(new_state)
+
+                transitions[compositions[composition], symbol] = {new_state}
+
+        for (state, symbol), next_state in transitions.items():
+            states.update({state} | next_state)
+            alphabet.add(symbol)
+
+        return NFA(states, alphabet, transitions, initial_state, final_states)
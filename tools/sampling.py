@@ -0,0 +1,131 @@
+from typing import Iterator, List, Optional, Tuple
+from bisect import bisect_right
+import copy
+import random
+from tools.nfa import NFA
+
+
+class WordSampler():
+    """
+        Draws strings of a regular language uniformly at random, e.g. to
+        generate fuzzer inputs from a RegExp converted with regex_to_dfa.
+
+        The automaton is determinized and trimmed once, then, for every
+        length up to max_length, the number of strings of each length that
+        lead from each state to a final state is counted. A string of length
+        n is then built symbol by symbol in O(n log |alphabet|), choosing
+        each transition with probability proportional to the number of
+        strings it leads to, so there is no rejection at all.
+    """
+
+    def __init__(
+            self, nfa: NFA, max_length: int,
+            rng: Optional[random.Random]=None) -> None:
+        self._rng = rng if rng is not None else random.Random()
+        self._max_length = max_length
+
+        dfa = copy.deepcopy(nfa)
+        if not dfa.is_deterministic():
+            dfa.determinize()
+        dfa.remove_unreachable()
+        dfa.remove_dead()
+
+        # states as indexes, 0 is the initial state
+        states = dfa.states
+        ids = {state: i for i, state in enumerate(states)}
+        edges = [[] for _ in states]  # type: List[List[Tuple[str, int]]]
+        for (state, symbol), next_states in sorted(
+                dfa.transition_table.items()):
+            edges[ids[state]].append((symbol, ids[next(iter(next_states))]))
+
+        # counts[k][i]: number of strings of length k from i to a final state
+        final_states = dfa.final_states
+        self._counts = [[
+            int(state in final_states) for state in states
+        ]]  # type: List[List[int]]
+        # choices[k][i]: cumulative counts, symbols and next states of the
+        # transitions of i that lead to strings of length k
+        self._choices = [
+            []
+        ]  # type: List[List[Tuple[List[int], List[str], List[int]]]]
+        for _ in range(max_length):
+            previous = self._counts[-1]
+            counts = []
+            choices = []
+            for state_edges in edges:
+                total = 0
+                cumulative = []  # type: List[int]
+                symbols = []  # type: List[str]
+                targets = []  # type: List[int]
+                for symbol, next_state in state_edges:
+                    if previous[next_state]:
+                        total += previous[next_state]
+                        cumulative.append(total)
+                        symbols.append(symbol)
+                        targets.append(next_state)
+                counts.append(total)
+                choices.append((cumulative, symbols, targets))
+            self._counts.append(counts)
+            self._choices.append(choices)
+
+    @property
+    def max_length(self) -> int:
+        return self._max_length
+
+    def count(self, length: Optional[int]=None) -> int:
+        """
+            Number of strings of the given length in the language, or of
+            length <= max_length if no length is given
+        """
+        if length is None:
+            return sum(counts[0] for counts in self._counts)
+        self._check_length(length)
+        return self._counts[length][0]
+
+    def sample(self, length: Optional[int]=None) -> str:
+        """
+            Returns a uniformly random string of the given length, or of any
+            length <= max_length if no length is given
+        """
+        return next(self.samples(1, length))
+
+    def samples(self, n: int, length: Optional[int]=None) -> Iterator[str]:
+        """ Lazily yields n independent samples, see sample """
+        if length is not None:
+            self._check_length(length)
+        total = self.count(length)
+        if not total:
+            raise RuntimeError("There are no strings to sample")
+
+        randrange = self._rng.randrange
+        choices = self._choices
+        lengths = []  # type: List[int]
+        cumulative_lengths = []  # type: List[int]
+        if length is None:
+            for k, counts in enumerate(self._counts):
+                if counts[0]:
+                    lengths.append(k)
+                    cumulative_lengths.append(
+                        counts[0] + (cumulative_lengths[-1]
+                                     if cumulative_lengths else 0))
+
+        for _ in range(n):
+            remaining = length
+            if remaining is None:
+                remaining = lengths[bisect_right(
+                    cumulative_lengths, randrange(total))]
+            state = 0
+            word = []
+            while remaining:
+                cumulative, symbols, targets = choices[remaining][state]
+                i = 0 if len(targets) == 1 else \
+                    bisect_right(cumulative, randrange(cumulative[-1]))
+                word.append(symbols[i])
+                state = targets[i]
+                remaining -= 1
+            yield "".join(word)
+
+    def _check_length(self, length: int) -> None:
+        if not 0 <= length <= self._max_length:
+            raise RuntimeError(
+                "Length must be between 0 and {}".format(self._max_length))
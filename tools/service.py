@@ -0,0 +1,388 @@
+"""
+    Local automaton service: keeps compiled DFAs resident and answers
+    JSON-RPC 2.0 requests, one JSON object per line, over a Unix socket.
+
+        python -m tools.service --socket /tmp/simone.sock --directory examples
+
+    Methods (params by name):
+        load(name)                  loads <directory>/<name>.json
+        unload(name)
+        accept(name, string)        concurrent calls are batched
+        accept_many(name, strings)
+        minimize(name)              on the process pool, replaces it
+        is_equal(first, second)     on the process pool
+        contains(first, second)     on the process pool
+        metrics()                   latency of each method and batch sizes
+"""
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import asyncio
+import collections
+import copy
+import json
+import os
+import sys
+import time
+from tools.nfa import NFA
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+SERVER_ERROR = -32000
+
+
+class Matcher():
+    """
+        Compiled DFA of an automaton (a determinized copy of it) as a list
+        of transition dictionaries, one per state, to test many strings in
+        a single call
+    """
+
+    def __init__(self, nfa: NFA) -> None:
+        dfa = copy.deepcopy(nfa)
+        if not dfa.is_deterministic():
+            dfa.determinize()
+        states = dfa.states if dfa.initial_state else []
+        symbols = dfa.alphabet
+        ids = {state: i for i, state in enumerate(states)}
+        self._table = [{
+            symbol: ids[next_state]
+            for symbol in symbols
+            for next_state in dfa.transition(state, symbol)
+        } for state in states] or [{}]  # type: List[Dict[str, int]]
+        final_states = dfa.final_states
+        self._finals = [
+            state in final_states for state in states] or [False]
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    def accept(self, string: str) -> bool:
+        return self.accept_many([string])[0]
+
+    def accept_many(self, strings: List[str]) -> List[bool]:
+        table = self._table
+        finals = self._finals
+        results = []
+        for string in strings:
+            state = 0  # type: Optional[int]
+            for symbol in string:
+                state = table[state].get(symbol)
+                if state is None:
+                    break
+            results.append(state is not None and finals[state])
+        return results
+
+
+class Latency():
+    """ Latency summary of a method, over its last SAMPLES calls """
+
+    SAMPLES = 1024
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._samples = collections.deque(
+            maxlen=self.SAMPLES)  # type: Deque[float]
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self._samples.append(seconds)
+
+    def as_dict(self) -> Dict[str, float]:
+        samples = sorted(self._samples)
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+            "p50": samples[len(samples) // 2] if samples else 0.0,
+            "p99": samples[len(samples) * 99 // 100] if samples else 0.0
+        }
+
+
+def _load(path: str) -> Tuple[NFA, Matcher]:
+    nfa = NFA.load(path)
+    return nfa, Matcher(nfa)
+
+
+def _minimize(nfa: NFA) -> Tuple[NFA, Matcher]:
+    if not nfa.is_deterministic():
+        nfa.determinize()
+    nfa.minimize()
+    return nfa, Matcher(nfa)
+
+
+def _is_equal(first: NFA, second: NFA) -> bool:
+    return first.is_equal(second)
+
+
+def _contains(first: NFA, second: NFA) -> bool:
+    return first.contains(second)
+
+
+class AutomatonService():
+    """
+        Serves the automata of a directory, see the module documentation.
+
+        Cheap requests run in the event loop. The accept calls that arrive
+        for an automaton while a batch is being collected (for batch_delay
+        seconds, or until the loop gets to it if 0) are answered by a
+        single Matcher.accept_many call. The heavy operations run on a
+        process pool, loading and compiling included, so they do not
+        hold up the matching.
+    """
+
+    def __init__(
+            self, directory: str, workers: Optional[int]=None,
+            batch_delay: float=0.0) -> None:
+        self._directory = directory
+        self._batch_delay = batch_delay
+        self._pool = ProcessPoolExecutor(workers)
+        self._automata = {}  # type: Dict[str, NFA]
+        self._matchers = {}  # type: Dict[str, Matcher]
+        # accept calls waiting for the next batch of each automaton
+        self._batches = {
+        }  # type: Dict[str, List[Tuple[str, asyncio.Future]]]
+        self._latencies = collections.defaultdict(
+            Latency)  # type: Dict[str, Latency]
+        self._batch_sizes = Latency()
+        self._server = None  # type: Optional[asyncio.AbstractServer]
+        # open connections and the tasks that serve them
+        self._connections = {
+        }  # type: Dict[asyncio.StreamWriter, asyncio.Task]
+        self._methods = {
+            "load": self.load,
+            "unload": self.unload,
+            "accept": self.accept,
+            "accept_many": self.accept_many,
+            "minimize": self.minimize,
+            "is_equal": self.is_equal,
+            "contains": self.contains,
+            "metrics": self.metrics
+        }  # type: Dict[str, Callable[..., Any]]
+
+    async def start(self, path: str) -> None:
+        """ Starts listening on the Unix socket """
+        self._server = await asyncio.start_unix_server(self._connect, path)
+
+    async def serve_forever(self, path: str) -> None:
+        """ Serves until the service is closed """
+        await self.start(path)
+        await self._server.wait_closed()
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+        for writer in self._connections:
+            writer.close()
+        if self._connections:
+            await asyncio.wait(list(self._connections.values()))
+        if self._server is not None:
+            await self._server.wait_closed()
+        self._pool.shutdown()
+
+    async def load(self, name: str) -> Dict[str, int]:
+        if not isinstance(name, str):
+            raise TypeError("The name of an automaton must be a string")
+        if not name or name.startswith(".") or os.sep in name:
+            raise RuntimeError("Invalid automaton name " + name)
+        nfa, matcher = await self._run(
+            _load, os.path.join(self._directory, name + ".json"))
+        self._set(name, nfa, matcher)
+        return {"states": len(matcher)}
+
+    async def unload(self, name: str) -> None:
+        self._get(name)
+        del self._automata[name]
+        del self._matchers[name]
+
+    async def accept(self, name: str, string: str) -> bool:
+        self._get(name)
+        if not isinstance(string, str):
+            raise TypeError("The string to accept must be a string")
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        batch = self._batches.setdefault(name, [])
+        batch.append((string, future))
+        if len(batch) == 1:
+            loop.call_later(self._batch_delay, self._flush, name)
+        return await future
+
+    async def accept_many(self, name: str, strings: List[str]) -> List[bool]:
+        return self._get(name)[1].accept_many(strings)
+
+    async def minimize(self, name: str) -> Dict[str, int]:
+        original = self._get(name)[0]
+        nfa, matcher = await self._run(_minimize, original)
+        if self._automata.get(name) is not original:
+            # unloaded or loaded again meanwhile, that one is kept
+            raise RuntimeError(
+                "Automaton {} changed while it was minimized".format(name))
+        self._set(name, nfa, matcher)
+        return {"states": len(nfa.states)}
+
+    async def is_equal(self, first: str, second: str) -> bool:
+        return await self._run(
+            _is_equal, self._get(first)[0], self._get(second)[0])
+
+    async def contains(self, first: str, second: str) -> bool:
+        return await self._run(
+            _contains, self._get(first)[0], self._get(second)[0])
+
+    async def metrics(self) -> Dict[str, Any]:
+        return {
+            "methods": {
+                method: latency.as_dict()
+                for method, latency in self._latencies.items()},
+            "batch_sizes": self._batch_sizes.as_dict(),
+            "automata": sorted(self._automata)
+        }
+
+    def _get(self, name: str) -> Tuple[NFA, Matcher]:
+        if name not in self._automata:
+            raise KeyError("Automaton {} is not loaded".format(name))
+        return self._automata[name], self._matchers[name]
+
+    def _set(self, name: str, nfa: NFA, matcher: Matcher) -> None:
+        self._automata[name] = nfa
+        self._matchers[name] = matcher
+
+    def _flush(self, name: str) -> None:
+        """ Answers the accept calls of the batch of an automaton """
+        batch = self._batches.pop(name, [])
+        matcher = self._matchers.get(name)
+        if matcher is None:
+            _fail(batch, KeyError("Automaton {} is not loaded".format(name)))
+            return
+        self._batch_sizes.add(len(batch))
+        try:
+            results = matcher.accept_many([string for string, _ in batch])
+        except Exception as error:  # no call of the batch may be left waiting
+            _fail(batch, error)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def _run(self, function: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.get_event_loop().run_in_executor(
+            self._pool, function, *args)
+
+    def _connect(
+            self, reader: asyncio.StreamReader,
+            writer: asyncio.StreamWriter) -> None:
+        self._connections[writer] = asyncio.ensure_future(
+            self._serve(reader, writer))
+
+    async def _serve(
+            self, reader: asyncio.StreamReader,
+            writer: asyncio.StreamWriter) -> None:
+        """ Answers the requests of a connection, concurrently """
+        lock = asyncio.Lock()
+        tasks = set()  # type: Set[asyncio.Task]
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    task = asyncio.ensure_future(
+                        self._respond(line, writer, lock))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.wait(tasks)
+        except ConnectionError:
+            pass
+        finally:
+            del self._connections[writer]
+            writer.close()
+
+    async def _respond(
+            self, line: bytes, writer: asyncio.StreamWriter,
+            lock: asyncio.Lock) -> None:
+        response = await self.call(line)
+        async with lock:
+            writer.write(json.dumps(response).encode() + b"\n")
+            await writer.drain()
+
+    async def call(self, line: bytes) -> Dict[str, Any]:
+        """ Answers a JSON-RPC request """
+        begin = time.perf_counter()
+        request_id = None
+        try:
+            request = json.loads(line)
+        except ValueError as error:
+            return _error(None, PARSE_ERROR, str(error))
+        if not isinstance(request, dict) or \
+                not isinstance(request.get("method"), str):
+            return _error(None, INVALID_REQUEST, "Invalid request")
+
+        request_id = request.get("id")
+        method = self._methods.get(request["method"])
+        if method is None:
+            return _error(request_id, METHOD_NOT_FOUND, "Method not found")
+        params = request.get("params", {})
+        try:
+            if isinstance(params, list):
+                result = await method(*params)
+            else:
+                result = await method(**params)
+        except TypeError as error:
+            return _error(request_id, INVALID_PARAMS, str(error))
+        except OSError as error:
+            # its first argument is the error number
+            message = "{}: '{}'".format(error.strerror, error.filename) \
+                if error.filename else str(error)
+            return _error(request_id, SERVER_ERROR, message)
+        except (KeyError, RuntimeError) as error:
+            message = error.args[0] if error.args else type(error).__name__
+            return _error(request_id, SERVER_ERROR, str(message))
+        except Exception as error:  # the client must always get an answer
+            return _error(request_id, SERVER_ERROR, "{}: {}".format(
+                type(error).__name__, error))
+        finally:
+            self._latencies[request["method"]].add(
+                time.perf_counter() - begin)
+        return {"jsonrpc": "2.0", "id": request_id, "result": result}
+
+
+def _fail(batch: List[Tuple[str, asyncio.Future]], error: Exception) -> None:
+    for _, future in batch:
+        if not future.done():
+            future.set_exception(error)
+
+
+def _error(request_id: Any, code: int, message: str) -> Dict[str, Any]:
+    return {
+        "jsonrpc": "2.0", "id": request_id,
+        "error": {"code": code, "message": message}}
+
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--socket", required=True)
+    parser.add_argument("--directory", default=".")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument(
+        "--batch-delay", type=float, default=0.0,
+        help="seconds to collect accept calls before matching them")
+    args = parser.parse_args(argv)
+    service = AutomatonService(args.directory, args.workers, args.batch_delay)
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(service.serve_forever(args.socket))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.run_until_complete(service.close())
+        loop.close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
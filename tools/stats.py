@@ -0,0 +1,87 @@
+from typing import Any, Callable, Dict, Optional
+import time
+
+
+class Stats():
+    """
+        Optional instrumentation of the automata algorithms.
+
+        An instance may be passed as the `stats` argument of the algorithms,
+        which then report counters (e.g. "states_created"), peaks (e.g.
+        "states") and the wall time of each phase. The callback, if given, is
+        called as callback(event, stats) when a phase starts or ends, with
+        the event "<phase>:start" or "<phase>:end".
+
+        Algorithms keep their counts in local variables and only touch this
+        object at phase boundaries, so passing no stats costs nearly nothing.
+    """
+
+    def __init__(
+            self,
+            callback: Optional[Callable[[str, 'Stats'], None]]=None) -> None:
+        self.counters = {}  # type: Dict[str, int]
+        self.peaks = {}  # type: Dict[str, int]
+        self.phases = {}  # type: Dict[str, float]
+        self._callback = callback
+
+    def count(self, name: str, amount: int=1) -> None:
+        """ Increments a counter """
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def peak(self, name: str, value: int) -> None:
+        """ Records a value, keeping only the maximum """
+        if value > self.peaks.get(name, value - 1):
+            self.peaks[name] = value
+
+    def phase(self, name: str) -> '_Phase':
+        """ Context manager that accumulates the wall time of a phase """
+        return _Phase(self, name)
+
+    def notify(self, event: str) -> None:
+        if self._callback is not None:
+            self._callback(event, self)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "counters": dict(self.counters),
+            "peaks": dict(self.peaks),
+            "phases": dict(self.phases)
+        }
+
+    def __repr__(self) -> str:
+        return "Stats({})".format(self.as_dict())
+
+
+class _Phase():
+
+    def __init__(self, stats: Stats, name: str) -> None:
+        self._stats = stats
+        self._name = name
+        self._begin = 0.0
+
+    def __enter__(self) -> None:
+        self._stats.notify(self._name + ":start")
+        self._begin = time.perf_counter()
+
+    def __exit__(self, *_: Any) -> None:
+        elapsed = time.perf_counter() - self._begin
+        phases = self._stats.phases
+        phases[self._name] = phases.get(self._name, 0.0) + elapsed
+        self._stats.notify(self._name + ":end")
+
+
+class _NullPhase():
+
+    def __enter__(self) -> None:
+        pass
+
+    def __exit__(self, *_: Any) -> None:
+        pass
+
+
+NULL_PHASE = _NullPhase()
+
+
+def phase(stats: Optional[Stats], name: str) -> Any:
+    """ Times a phase in `stats`, does nothing if stats is None """
+    return stats.phase(name) if stats is not None else NULL_PHASE
@@ -0,0 +1,171 @@
+from typing import Any, Iterable, Iterator, List, Optional, TextIO, Tuple
+import json
+
+CHUNK_SIZE = 1 << 16
+WHITESPACE = " \t\n\r"
+
+
+class JSONStreamReader():
+    """
+        Incremental reader for a JSON document whose top level is an object.
+
+        Only a bounded window of the file is kept in memory: members are
+        decoded one by one and the elements of the arrays listed in `streamed`
+        are yielded lazily, so a huge transition list never has to be loaded
+        at once.
+    """
+
+    def __init__(self, file: TextIO, chunk_size: int=CHUNK_SIZE) -> None:
+        self._file = file
+        self._chunk_size = chunk_size
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def members(self, streamed: Iterable[str]=()) \
+            -> Iterator[Tuple[str, Any]]:
+        """
+            Yields the (key, value) pairs of the top level object. The value
+            of a key in `streamed` is an iterator over the array elements that
+            must be exhausted before advancing to the next member.
+        """
+        streamed = frozenset(streamed)
+        self._expect("{")
+        if self._peek() == "}":
+            self._pos += 1
+            return
+
+        while True:
+            key = self._value()
+            if not isinstance(key, str):
+                self._error("Expecting property name")
+            self._expect(":")
+            if key in streamed and self._peek() == "[":
+                elements = self._elements()
+                yield key, elements
+                for _ in elements:  # skip what the consumer left behind
+                    pass
+            else:
+                yield key, self._value()
+
+            if self._peek() == ",":
+                self._pos += 1
+            else:
+                self._expect("}")
+                return
+
+    def _elements(self) -> Iterator[Any]:
+        self._expect("[")
+        if self._peek() == "]":
+            self._pos += 1
+            return
+
+        while True:
+            yield self._value()
+            if self._peek() == ",":
+                self._pos += 1
+            else:
+                self._expect("]")
+                return
+
+    def _fill(self) -> bool:
+        """ Reads another chunk, returns False at the end of the file """
+        if self._eof:
+            return False
+        chunk = self._file.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        # drop what was already consumed, keeping the window bounded
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self) -> str:
+        while True:
+            while self._pos < len(self._buffer) and \
+                    self._buffer[self._pos] in WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ""
+
+    def _expect(self, char: str) -> None:
+        if self._peek() != char:
+            self._error("Expecting '{}'".format(char))
+        self._pos += 1
+
+    def _value(self) -> Any:
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # a number may continue on the next chunk
+            if end == len(self._buffer) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def _error(self, message: str) -> None:
+        raise json.JSONDecodeError(message, self._buffer, self._pos)
+
+
+def write_automaton(
+        file: TextIO,
+        states: List[str],
+        alphabet: List[str],
+        transitions: Iterable[Tuple[str, str, List[str]]],
+        initial_state: str,
+        final_states: List[str],
+        indent: Optional[int]=4) -> None:
+    """
+        Writes an automaton in the JSON format, one transition at a time.
+        The output is the same as json.dump would produce for the whole
+        document, but the transitions are never collected in a list.
+    """
+    if indent is None:
+        opening, separator, closing = "", ", ", ""
+        item_separator, key_separator = ", ", ": "
+    else:
+        opening = "\n" + " " * indent
+        separator = "," + opening
+        closing = "\n"
+        item_separator, key_separator = ",", ": "
+
+    def encode(value: Any, level: int) -> str:
+        text = json.dumps(
+            value, indent=indent,
+            separators=(item_separator, key_separator))
+        if indent is not None:
+            text = text.replace("\n", "\n" + " " * (indent * level))
+        return text
+
+    file.write("{" + opening)
+    file.write('"states"' + key_separator + encode(states, 1) + separator)
+    file.write('"alphabet"' + key_separator + encode(alphabet, 1) + separator)
+
+    file.write('"transitions"' + key_separator + "[")
+    first = True
+    for transition in transitions:
+        if not first:
+            file.write(item_separator)
+        if indent is not None:
+            file.write("\n" + " " * (indent * 2))
+        file.write(encode(list(transition), 2))
+        first = False
+    if not first and indent is not None:
+        file.write("\n" + " " * indent)
+    file.write("]" + separator)
+
+    file.write(
+        '"initial_state"' + key_separator + encode(initial_state, 1) +
+        separator)
+    file.write(
+        '"final_states"' + key_separator + encode(final_states, 1) + closing)
+    file.write("}")
@@ -0,0 +1,108 @@
+from typing import List
+from tools.regex import EPSILON, RegExpParser, SyntaxTree
+
+# instructions of a Program
+CHAR = 0  # consume the symbol and go to the next instruction
+SPLIT = 1  # go to both targets without consuming anything (epsilon moves)
+JUMP = 2  # go to the target without consuming anything
+MATCH = 3
+
+
+class Program():
+    """
+        Thompson's epsilon-NFA of a RegExp, compiled to a list of
+        instructions, one per state: the states of a CHAR go to the next
+        instruction on its symbol, the others only have epsilon moves.
+
+        The automaton has O(m) states for a regex of size m and matching
+        simulates it on the set of current states (Pike's VM without
+        submatches), which takes O(n * m) time and O(m) memory for a string
+        of size n. Nothing is ever determinized, so patterns whose DFAs blow
+        up can still be matched.
+    """
+
+    def __init__(self, regex: str) -> None:
+        self._opcodes = []  # type: List[int]
+        self._symbols = []  # type: List[str]
+        self._targets = []  # type: List[int]
+        self._alternatives = []  # type: List[int]
+        tree = RegExpParser(regex).parse()
+        self._compile(tree, tree.root)
+        self._emit(MATCH)
+
+    def __len__(self) -> int:
+        return len(self._opcodes)
+
+    def _emit(self, opcode: int, symbol: str="", target: int=-1,
+              alternative: int=-1) -> int:
+        self._opcodes.append(opcode)
+        self._symbols.append(symbol)
+        self._targets.append(target)
+        self._alternatives.append(alternative)
+        return len(self._opcodes) - 1
+
+    def _compile(self, tree: SyntaxTree, node: int) -> None:
+        symbol, left, right = tree.symbols[node], tree.lefts[node], \
+            tree.rights[node]
+        if symbol == '|':
+            split = self._emit(SPLIT, target=len(self._opcodes) + 1)
+            self._compile(tree, left)
+            jump = self._emit(JUMP)
+            self._alternatives[split] = len(self._opcodes)
+            self._compile(tree, right)
+            self._targets[jump] = len(self._opcodes)
+        elif symbol == '.':
+            self._compile(tree, left)
+            self._compile(tree, right)
+        elif symbol == '*':
+            split = self._emit(SPLIT, target=len(self._opcodes) + 1)
+            self._compile(tree, left)
+            self._emit(JUMP, target=split)
+            self._alternatives[split] = len(self._opcodes)
+        elif symbol == '?':
+            split = self._emit(SPLIT, target=len(self._opcodes) + 1)
+            self._compile(tree, left)
+            self._alternatives[split] = len(self._opcodes)
+        elif symbol != EPSILON:
+            self._emit(CHAR, symbol, len(self._opcodes) + 1)
+
+    def _add(self, states: List[int], marks: List[int], step: int,
+             pc: int) -> None:
+        """
+            Adds the CHAR and MATCH states of the epsilon closure of pc to
+            states, marks[i] == step tells that i was already visited
+        """
+        opcodes = self._opcodes
+        to_visit = [pc]
+        while to_visit:
+            pc = to_visit.pop()
+            if marks[pc] == step:
+                continue
+            marks[pc] = step
+            opcode = opcodes[pc]
+            if opcode == SPLIT:
+                to_visit.append(self._alternatives[pc])
+                to_visit.append(self._targets[pc])
+            elif opcode == JUMP:
+                to_visit.append(self._targets[pc])
+            else:
+                states.append(pc)
+
+    def accept(self, string: str) -> bool:
+        """ Checks if the whole string matches the RegExp """
+        opcodes = self._opcodes
+        symbols = self._symbols
+        marks = [-1] * len(opcodes)
+        states = []  # type: List[int]
+        self._add(states, marks, 0, 0)
+
+        for step, symbol in enumerate(string, 1):
+            next_states = []  # type: List[int]
+            for pc in states:
+                if opcodes[pc] == CHAR and symbols[pc] == symbol:
+                    self._add(next_states, marks, step, pc + 1)
+            if not next_states:
+                return False
+            states = next_states
+
+        return any(opcodes[pc] == MATCH for pc in states)
@@ -1,13 +1,17 @@
-from typing import Set
-import re
+from typing import Any, Callable, Optional
+import copy
 from ui.main_window_ui import Ui_MainWindow
+from ui.worker import Worker
+from ui.transition_model import TransitionTableModel
 from tools.nfa import NFA
-from tools.grammar import RegularGrammar
+from tools.grammar import IndexedGrammar
 from tools.regex import regex_to_dfa
+from tools.stats import Stats
+from tools.budget import Budget
+from PyQt5.QtCore import Qt, QThreadPool
 from PyQt5.QtWidgets import (
-    QMainWindow, QTableWidgetItem, QInputDialog, QMessageBox, QFileDialog)
-
-GRAMMAR_PATTERN = re.compile(r"^[A-Z]'?->[a-z0-9&][A-Z]?(\|[a-z0-9&][A-Z]?)*$")
+    QMainWindow, QInputDialog, QMessageBox, QFileDialog, QProgressDialog,
+    QHeaderView)
 
 
 class MainWindow(QMainWindow, Ui_MainWindow):
@@ -53,63 +57,139 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.actionContains.triggered.connect(self._contains)
         self.actionEquivalent.triggered.connect(self._is_equal)
 
-        self.transitionTable.cellChanged.connect(self._update_nfa)
-
-        self._grammar = RegularGrammar()
+        self._model = TransitionTableModel(self)
+        self._model.transition_changed.connect(self._test_emptiness)
+        self._model.error.connect(
+            lambda message: QMessageBox.information(self, "Error", message))
+        self.transitionTable.setModel(self._model)
+        # fixed size rows and columns, so scrolling never measures cells
+        for header in (
+                self.transitionTable.horizontalHeader(),
+                self.transitionTable.verticalHeader()):
+            header.setSectionResizeMode(QHeaderView.Fixed)
+
+        self._grammar = IndexedGrammar()
         self._nfa = NFA()
+        self._worker = None  # type: Optional[Worker]
+        self._update_table()
+
+    def _run(
+            self, title: str,
+            function: Callable[[NFA, Stats, Budget], Any],
+            on_finished: Callable[[Any], None]) -> None:
+        """
+            Runs function(nfa, stats, budget) over a copy of the automaton in
+            a worker thread, so the window stays responsive. A progress
+            dialog shows the current phase and cancels the operation. The
+            result is handed to on_finished in the GUI thread.
+        """
+        nfa = copy.deepcopy(self._nfa)
+        worker = Worker(lambda stats, budget: function(nfa, stats, budget))
+
+        dialog = QProgressDialog(title + "...", "Cancel", 0, 0, self)
+        dialog.setWindowTitle(title)
+        dialog.setWindowModality(Qt.NonModal)
+        dialog.setMinimumDuration(500)
+        dialog.canceled.connect(worker.cancel)
+
+        def done() -> None:
+            dialog.canceled.disconnect(worker.cancel)
+            dialog.reset()
+            dialog.deleteLater()
+            self._worker = None
+            self._set_operations_enabled(True)
+
+        def failed(message: str) -> None:
+            done()
+            QMessageBox.information(self, "Error", message)
+
+        def cancelled() -> None:
+            done()
+            self.statusbar.showMessage(title + " cancelled")
+
+        def finished(result: Any) -> None:
+            done()
+            on_finished(result)
+
+        worker.signals.progress.connect(dialog.setLabelText)
+        worker.signals.failed.connect(failed)
+        worker.signals.cancelled.connect(cancelled)
+        worker.signals.finished.connect(finished)
+
+        self._worker = worker
+        self._set_operations_enabled(False)
+        QThreadPool.globalInstance().start(worker)
+
+    def _set_operations_enabled(self, enabled: bool) -> None:
+        """
+            Only one operation may run at a time, and the automaton may not
+            be edited or replaced meanwhile, since the result replaces it
+        """
+        for widget in (
+                self.regexToDFAButton, self.menuTransformations,
+                self.menuOperations, self.transitionTable,
+                self.addSymbolButton, self.addStateButton,
+                self.removeSymbolButton, self.removeStateButton,
+                self.finalStateButton, self.toNFAbutton, self.actionNew,
+                self.actionOpen):
+            widget.setEnabled(enabled)
+
+    def _set_nfa(self, nfa: NFA) -> None:
+        self._nfa = nfa
         self._update_table()
 
     def _regex_to_dfa(self) -> None:
-        try:
-            self._nfa = regex_to_dfa(self.regexInput.text())
-            self._update_table()
-        except RuntimeError as error:
-            QMessageBox.information(self, "Error", error.args[0])
+        regex = self.regexInput.text()
+        self._run(
+            "RegExp to DFA",
+            lambda _, stats, budget: regex_to_dfa(regex, stats, budget),
+            self._set_nfa)
 
     def _add_symbols(self) -> None:
         text, ok = QInputDialog.getText(
             self, "Add symbols", "Symbols (a,b,c,...):")
         if ok:
             for symbol in text.replace(" ", "").split(","):
-                self._nfa.add_symbol(symbol)
-            self._update_table()
+                self._model.add_symbol(symbol)
+            self._test_emptiness()
 
     def _add_states(self) -> None:
         text, ok = QInputDialog.getText(
             self, "Add states", "States (q0,q1,...):")
         if ok:
             for state in text.replace(" ", "").split(","):
-                self._nfa.add_state(state)
-            self._update_table()
+                self._model.add_state(state)
+            self._test_emptiness()
 
     def _remove_symbols(self) -> None:
         text, ok = QInputDialog.getText(
             self, "Remove symbols", "Symbols (a,b,c,...):")
         if ok:
             for symbol in text.replace(" ", "").split(","):
-                self._nfa.remove_symbol(symbol)
-            self._update_table()
+                self._model.remove_symbol(symbol)
+            self._test_emptiness()
 
     def _remove_states(self) -> None:
         text, ok = QInputDialog.getText(
             self, "Remove states", "States (q0,q1,...):")
         if ok:
             for state in text.replace(" ", "").split(","):
-                self._nfa.remove_state(state)
-            self._update_table()
+                self._model.remove_state(state)
+            self._test_emptiness()
 
     def _toggle_final_states(self) -> None:
         text, ok = QInputDialog.getText(
             self, "Final states", "States (q0,q1,...):")
         if ok:
             for state in text.replace(" ", "").split(","):
-                self._nfa.toggle_final_state(state)
-            self._update_table()
+                self._model.toggle_final_state(state)
+            self._test_emptiness()
 
     def _test_emptiness(self) -> None:
-        if self._nfa.is_empty():
+        analysis = self._model.analysis
+        if analysis.is_empty():
             self.languageLabel.setText("The language is empty.")
-        elif self._nfa.is_finite():
+        elif analysis.is_finite():
             self.languageLabel.setText("The language is finite.")
         else:
             self.languageLabel.setText("The language is infinite.")
@@ -123,18 +203,16 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self._update_table()
 
     def _merge_equivalent(self) -> None:
-        try:
-            self._nfa.merge_equivalent()
-            self._update_table()
-        except RuntimeError as error:
-            QMessageBox.information(self, "Error", error.args[0])
+        def merge_equivalent(nfa: NFA, stats: Stats, budget: Budget) -> NFA:
+            nfa.merge_equivalent(stats, budget)
+            return nfa
+        self._run("Merge equivalent states", merge_equivalent, self._set_nfa)
 
     def _minimize(self) -> None:
-        try:
-            self._nfa.minimize()
-            self._update_table()
-        except RuntimeError as error:
-            QMessageBox.information(self, "Error", error.args[0])
+        def minimize(nfa: NFA, stats: Stats, budget: Budget) -> NFA:
+            nfa.minimize(stats, budget)
+            return nfa
+        self._run("Minimize", minimize, self._set_nfa)
 
     def _test_string(self) -> None:
         try:
@@ -145,8 +223,10 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             QMessageBox.information(self, "Error", error.args[0])
 
     def _determinize(self) -> None:
-        self._nfa.determinize()
-        self._update_table()
+        def determinize(nfa: NFA, stats: Stats, budget: Budget) -> NFA:
+            nfa.determinize(stats, budget)
+            return nfa
+        self._run("Determinize", determinize, self._set_nfa)
 
     def _beautify_qn(self) -> None:
         self._nfa.beautify_qn()
@@ -160,151 +240,94 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             QMessageBox.information(self, "Error", error.args[0])
 
     def _nfa_to_grammar(self) -> None:
-        self._grammar = RegularGrammar.from_nfa(self._nfa)
+        self._grammar = IndexedGrammar.from_nfa(self._nfa)
         self._update_grammar_text()
 
     def _grammar_to_nfa(self) -> None:
         try:
-            self._nfa = NFA.from_regular_grammar(
-                parse_grammar_text(self.grammarText.toPlainText()))
+            self._nfa = IndexedGrammar.parse(
+                self.grammarText.toPlainText().split("\n")).to_nfa()
             self._update_table()
         except RuntimeError as error:
             QMessageBox.information(self, "Error", error.args[0])
 
+    def _open_second_nfa(self) -> Optional[NFA]:
+        path, _ = QFileDialog.getOpenFileName(self)
+        return NFA.load(path) if path else None
+
     def _union(self) -> None:
-        try:
-            path, _ = QFileDialog.getOpenFileName(self)
-            if path:
-                second_nfa = NFA.load(path)
-                self._nfa.union(second_nfa)
-                self._update_table()
-        except RuntimeError as error:
-            QMessageBox.information(self, "Error", error.args[0])
+        second_nfa = self._open_second_nfa()
+        if second_nfa:
+            def union(nfa: NFA, stats: Stats, _: Budget) -> NFA:
+                nfa.union(second_nfa, stats)
+                # the table only shows transitions by symbols
+                nfa.remove_epsilon(stats)
+                return nfa
+            self._run("Union", union, self._set_nfa)
 
     def _complement(self) -> None:
-        self._nfa.complement()
-        self._update_table()
+        def complement(nfa: NFA, stats: Stats, budget: Budget) -> NFA:
+            nfa.complement(stats, budget)
+            return nfa
+        self._run("Complement", complement, self._set_nfa)
 
     def _intersection(self) -> None:
-        try:
-            path, _ = QFileDialog.getOpenFileName(self)
-            if path:
-                second_nfa = NFA.load(path)
-                self._nfa.intersection(second_nfa)
-                self._update_table()
-        except RuntimeError as error:
-            QMessageBox.information(self, "Error", error.args[0])
+        second_nfa = self._open_second_nfa()
+        if second_nfa:
+            def intersection(nfa: NFA, stats: Stats, budget: Budget) -> NFA:
+                nfa.intersection(second_nfa, stats, budget)
+                return nfa
+            self._run("Intersection", intersection, self._set_nfa)
 
     def _contains(self) -> None:
-        try:
-            path, _ = QFileDialog.getOpenFileName(self)
-            if path:
-                second_nfa = NFA.load(path)
-                if self._nfa.contains(second_nfa):
-                    QMessageBox.information(
-                        self, "Contains",
-                        "The automaton contains the second one.")
-                else:
-                    QMessageBox.information(
-                        self, "Contains",
-                        "The automaton does not contain the second one.")
-        except RuntimeError as error:
-            QMessageBox.information(self, "Error", error.args[0])
+        def show_result(contains: bool) -> None:
+            if contains:
+                QMessageBox.information(
+                    self, "Contains",
+                    "The automaton contains the second one.")
+            else:
+                QMessageBox.information(
+                    self, "Contains",
+                    "The automaton does not contain the second one.")
+
+        second_nfa = self._open_second_nfa()
+        if second_nfa:
+            self._run(
+                "Contains",
+                lambda nfa, stats, budget:
+                    nfa.contains(second_nfa, stats, budget),
+                show_result)
 
     def _is_equal(self) -> None:
-        try:
-            path, _ = QFileDialog.getOpenFileName(self)
-            if path:
-                second_nfa = NFA.load(path)
-                if self._nfa.is_equal(second_nfa):
-                    QMessageBox.information(
-                        self, "Equivalent",
-                        "The automata are equivalent.")
-                else:
-                    QMessageBox.information(
-                        self, "Equivalent",
-                        "The automata are not equivalent.")
-        except RuntimeError as error:
-            QMessageBox.information(self, "Error", error.args[0])
-
-    def _update_nfa(self, row: int, col: int) -> None:
-        states = self._nfa.states
-        alphabet = self._nfa.alphabet
-        next_states = \
-            set(self.transitionTable.item(row, col).text().replace(
-                " ", "").split(","))
-
-        try:
-            self._nfa.set_transition(
-                states[row], alphabet[col],
-                next_states if next_states != {""} else set())
-        except KeyError as error:
-            QMessageBox.information(self, "Error", error.args[0])
-            self.transitionTable.item(row, col).setText("")
-
-        self._test_emptiness()
+        def show_result(equal: bool) -> None:
+            if equal:
+                QMessageBox.information(
+                    self, "Equivalent",
+                    "The automata are equivalent.")
+            else:
+                QMessageBox.information(
+                    self, "Equivalent",
+                    "The automata are not equivalent.")
+
+        second_nfa = self._open_second_nfa()
+        if second_nfa:
+            self._run(
+                "Equivalent",
+                lambda nfa, stats, budget:
+                    nfa.is_equal(second_nfa, stats, budget),
+                show_result)
 
     def _update_table(self) -> None:
-        # avoid useless calls to _update_nfa()
-        self.transitionTable.cellChanged.disconnect(self._update_nfa)
-
-        states = []
-        for state in self._nfa.states:
-            preffix = ""
-            if state in self._nfa.final_states:
-                preffix += "*"
-            if state == self._nfa.initial_state:
-                preffix += "->"
-            states.append(preffix + state)
-
-        alphabet = self._nfa.alphabet
-
-        self.transitionTable.setRowCount(len(states))
-        self.transitionTable.setVerticalHeaderLabels(states)
-
-        self.transitionTable.setColumnCount(len(alphabet))
-        self.transitionTable.setHorizontalHeaderLabels(alphabet)
-
-        table = self._nfa.transition_table
-        for i, state in enumerate(self._nfa.states):
-            for j, symbol in enumerate(alphabet):
-                transition = ",".join(sorted(table[state, symbol])) \
-                    if (state, symbol) in table else ""
-                self.transitionTable.setItem(
-                    i, j, QTableWidgetItem(transition))
-
+        self._model.set_nfa(self._nfa)
         self._test_emptiness()
 
-        # reconnect
-        self.transitionTable.cellChanged.connect(self._update_nfa)
-
     def _update_grammar_text(self) -> None:
-        """
-            "B", {"aB", "bC", "a"} turns into
-            "B -> aB | bC | a"
-        """
-        def transform_production(non_terminal: str, productions: Set[str]):
-            return "{} -> {}".format(
-                non_terminal, " | ".join(sorted(productions)))
-
-        initial_symbol = self._grammar.initial_symbol()
-        productions = self._grammar.productions()
-
-        text = ""
-
-        if initial_symbol in productions:
-            text = transform_production(
-                initial_symbol, productions[initial_symbol]) + "\n"
-
-        for non_terminal in sorted(set(productions.keys()) - {initial_symbol}):
-            text += transform_production(
-                non_terminal, productions[non_terminal]) + "\n"
-
-        self.grammarText.setPlainText(text)
+        self.grammarText.setPlainText(
+            "".join(line + "\n" for line in self._grammar.lines()))
 
     def _new(self) -> None:
         self._nfa = NFA()
-        self._grammar = RegularGrammar()
+        self._grammar = IndexedGrammar()
         self._update_table()
 
     def _open(self) -> None:
@@ -317,19 +340,3 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         path, _ = QFileDialog.getSaveFileName(self)
         if path:
             self._nfa.save(path)
-
-
-def parse_grammar_text(grammar: str) -> RegularGrammar:
-    grammar = grammar.strip().replace(" ", "")
-    lines = grammar.split("\n")
-
-    if not all(map(GRAMMAR_PATTERN.match, lines)):
-        raise RuntimeError("Grammar is not regular")
-
-    initial_symbol, prods = lines[0].split("->")
-    productions = {initial_symbol: set(prods.split("|"))}
-    for line in lines[1:]:
-        non_terminal, prods = line.split("->")
-        productions[non_terminal] = set(prods.split("|"))
-
-    return RegularGrammar(initial_symbol, productions)
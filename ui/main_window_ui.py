@@ -38,9 +38,7 @@ class Ui_MainWindow(object):
         self.automatonTab.setObjectName("automatonTab")
         self.gridLayout = QtWidgets.QGridLayout(self.automatonTab)
         self.gridLayout.setObjectName("gridLayout")
-        self.transitionTable = QtWidgets.QTableWidget(self.automatonTab)
-        self.transitionTable.setRowCount(0)
-        self.transitionTable.setColumnCount(0)
+        self.transitionTable = QtWidgets.QTableView(self.automatonTab)
         self.transitionTable.setObjectName("transitionTable")
         self.gridLayout.addWidget(self.transitionTable, 0, 0, 1, 1)
         self.verticalLayout_2 = QtWidgets.QVBoxLayout()
@@ -0,0 +1,149 @@
+from typing import Any, List
+from bisect import bisect_left
+from tools.nfa import EPSILON, NFA
+from tools.analysis import LanguageAnalysis
+from PyQt5.QtCore import (
+    QAbstractTableModel, QModelIndex, Qt, QVariant, pyqtSignal)
+
+
+class TransitionTableModel(QAbstractTableModel):
+    """
+        Table model backed directly by the automaton: rows are states,
+        columns are symbols and each cell is the transition, formatted as
+        "q1,q2". Cells are only formatted when the view asks for them, so
+        only the visible part of a large automaton costs anything.
+
+        Edits should go through the methods of the model, which update the
+        automaton and its LanguageAnalysis and notify the view of the rows
+        and columns that changed instead of resetting it.
+    """
+
+    transition_changed = pyqtSignal()
+    error = pyqtSignal(str)
+
+    def __init__(self, parent: Any=None) -> None:
+        QAbstractTableModel.__init__(self, parent)
+        self._nfa = NFA()
+        self._analysis = LanguageAnalysis(self._nfa)
+        self._states = []  # type: List[str]
+        self._alphabet = []  # type: List[str]
+
+    def set_nfa(self, nfa: NFA) -> None:
+        """ Shows another automaton """
+        self.beginResetModel()
+        self._nfa = nfa
+        self._analysis = LanguageAnalysis(nfa)
+        self._states = nfa.states if nfa.initial_state else []
+        self._alphabet = nfa.alphabet
+        self.endResetModel()
+
+    @property
+    def analysis(self) -> LanguageAnalysis:
+        return self._analysis
+
+    def rowCount(self, parent: QModelIndex=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._states)
+
+    def columnCount(self, parent: QModelIndex=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._alphabet)
+
+    def data(self, index: QModelIndex, role: int=Qt.DisplayRole) -> Any:
+        if role not in (Qt.DisplayRole, Qt.EditRole) or not index.isValid():
+            return QVariant()
+        return ",".join(sorted(self._nfa.transition(
+            self._states[index.row()], self._alphabet[index.column()])))
+
+    def headerData(
+            self, section: int, orientation: Qt.Orientation,
+            role: int=Qt.DisplayRole) -> Any:
+        if role != Qt.DisplayRole:
+            return QVariant()
+        if orientation == Qt.Horizontal:
+            return self._alphabet[section]
+
+        state = self._states[section]
+        preffix = ""
+        if self._nfa.is_final(state):
+            preffix += "*"
+        if state == self._nfa.initial_state:
+            preffix += "->"
+        return preffix + state
+
+    def flags(self, index: QModelIndex) -> Qt.ItemFlags:
+        return QAbstractTableModel.flags(self, index) | Qt.ItemIsEditable
+
+    def setData(
+            self, index: QModelIndex, value: Any,
+            role: int=Qt.EditRole) -> bool:
+        if role != Qt.EditRole or not index.isValid():
+            return False
+
+        next_states = set(str(value).replace(" ", "").split(",")) - {""}
+        try:
+            self._analysis.set_transition(
+                self._states[index.row()], self._alphabet[index.column()],
+                next_states)
+        except KeyError as error:
+            self.error.emit(error.args[0])
+            return False
+
+        self.dataChanged.emit(index, index, [Qt.DisplayRole, Qt.EditRole])
+        self.transition_changed.emit()
+        return True
+
+    def _state_row(self, state: str) -> int:
+        """ Row where the state is, or should be inserted """
+        if not self._states or state == self._states[0]:
+            return 0
+        return bisect_left(self._states, state, 1)
+
+    def add_state(self, state: str) -> None:
+        if not state or self._nfa.has_state(state):
+            return
+        row = self._state_row(state)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self._analysis.add_state(state)
+        self._states.insert(row, state)
+        self.endInsertRows()
+
+    def remove_state(self, state: str) -> None:
+        if not self._nfa.has_state(state) or \
+                state == self._nfa.initial_state:
+            return
+        row = self._state_row(state)
+        self.beginRemoveRows(QModelIndex(), row, row)
+        self._analysis.remove_state(state)
+        del self._states[row]
+        self.endRemoveRows()
+        # transitions to the removed state are gone from the other rows
+        self._all_data_changed()
+
+    def toggle_final_state(self, state: str) -> None:
+        if self._nfa.has_state(state):
+            self._analysis.toggle_final_state(state)
+            row = self._state_row(state)
+            self.headerDataChanged.emit(Qt.Vertical, row, row)
+
+    def add_symbol(self, symbol: str) -> None:
+        if not symbol or symbol == EPSILON or self._nfa.has_symbol(symbol):
+            return
+        column = bisect_left(self._alphabet, symbol)
+        self.beginInsertColumns(QModelIndex(), column, column)
+        self._analysis.add_symbol(symbol)
+        self._alphabet.insert(column, symbol)
+        self.endInsertColumns()
+
+    def remove_symbol(self, symbol: str) -> None:
+        if not self._nfa.has_symbol(symbol):
+            return
+        column = bisect_left(self._alphabet, symbol)
+        self.beginRemoveColumns(QModelIndex(), column, column)
+        self._analysis.remove_symbol(symbol)
+        del self._alphabet[column]
+        self.endRemoveColumns()
+
+    def _all_data_changed(self) -> None:
+        if self._states and self._alphabet:
+            self.dataChanged.emit(
+                self.index(0, 0),
+                self.index(len(self._states) - 1, len(self._alphabet) - 1))
@@ -0,0 +1,53 @@
+from typing import Any, Callable
+from tools.budget import Budget, BudgetExceeded, CancelToken
+from tools.stats import Stats
+from PyQt5.QtCore import QObject, QRunnable, pyqtSignal
+
+
+class WorkerSignals(QObject):
+    """
+        Signals of a Worker. They are emitted from the worker thread and,
+        since this object lives in the GUI thread, delivered to the GUI
+        thread through its event loop.
+    """
+
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+    progress = pyqtSignal(str)
+
+
+class Worker(QRunnable):
+    """
+        Runs function(stats, budget) in a thread pool. The budget carries a
+        cancel token that is set by cancel(), and the phases reported to
+        stats are forwarded as progress messages.
+    """
+
+    def __init__(self, function: Callable[[Stats, Budget], Any]) -> None:
+        QRunnable.__init__(self)
+        self.signals = WorkerSignals()
+        self._function = function
+        self._token = CancelToken()
+
+    def cancel(self) -> None:
+        self._token.cancel()
+
+    def run(self) -> None:
+        stats = Stats(self._report)
+        try:
+            result = self._function(stats, Budget(cancel=self._token))
+        except BudgetExceeded as error:
+            if self._token.cancelled:
+                self.signals.cancelled.emit()
+            else:
+                self.signals.failed.emit(str(error))
+        except Exception as error:  # the window waits for a signal
+            self.signals.failed.emit(str(error) or type(error).__name__)
+        else:
+            self.signals.finished.emit(result)
+
+    def _report(self, event: str, _: Stats) -> None:
+        name, status = event.rsplit(":", 1)
+        if status == "start":
+            self.signals.progress.emit(name.replace("_", " ").capitalize())